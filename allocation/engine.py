@@ -17,7 +17,21 @@ from django.utils.timezone import timedelta, datetime
 from threepio import logger
 
 from allocation.models import AllocationResult, GlobalRule, InstanceResult,\
-    InstanceRule, InstanceHistoryResult
+    InstanceRule, InstanceHistoryResult, AllocationCheckpoint,\
+    IgnoreStatusRule, IgnoreMachineRule, IgnoreProviderRule,\
+    MultiplyBurnTime, MultiplySizeCPU, MultiplySizeDisk, MultiplySizeRAM
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Histories closed less than CHECKPOINT_DELAY before the end of the window
+# are NOT folded into a checkpoint. This leaves room for histories that are
+# end-dated 'late' (Ex: _cleanup_missing_instances) to be counted.
+# Later changes to closed histories invalidate the checkpoint
+# (See core.models.instance_history)
+CHECKPOINT_DELAY = timedelta(hours=1)
 
 
 def _get_zero_date_utc():
@@ -49,7 +63,37 @@ def get_allocation_window(allocation,
 
 
 # Main ###
+def validate_checkpoint(allocation, checkpoint):
+    """
+    Returns whether the engine can resume from 'checkpoint'
+    when calculating 'allocation'.
+    """
+    (window_start_date, window_end_date) = get_allocation_window(allocation)
+    empty_result = AllocationResult(
+        allocation, window_start_date, window_end_date,
+        force_interval_every=allocation.interval_delta)
+    return checkpoint.is_valid_for(allocation, empty_result)
+
+
+def _create_checkpoint(allocation, allocation_result, checkpoint=None):
+    closed_until = allocation_result.window_end - CHECKPOINT_DELAY
+    if checkpoint and checkpoint.closed_until > closed_until:
+        # Never 'unfold' histories that are already part of the checkpoint
+        closed_until = checkpoint.closed_until
+    return AllocationCheckpoint(
+        allocation_result.window_start, closed_until,
+        AllocationCheckpoint.rule_signatures_for(allocation))
+
+
 def calculate_allocation(allocation, print_logs=False):
+    """
+    Calculate the AllocationResult for 'allocation'.
+
+    If 'allocation.checkpoint' is set (and valid), the time folded into the
+    checkpoint is re-used and every history closed on/before
+    'checkpoint.closed_until' is skipped. In either case, the new
+    checkpoint is returned as 'allocation_result.checkpoint'.
+    """
     (window_start_date, window_end_date) = get_allocation_window(allocation)
 
     # FYI: Calculates time periods based on allocation.credits
@@ -61,6 +105,12 @@ def calculate_allocation(allocation, print_logs=False):
         logger.debug(
             "New AllocationResult, Start On & (End On): %s (%s)"
             % (current_result.window_start, current_result.window_end))
+    checkpoint = allocation.checkpoint
+    if checkpoint and not checkpoint.is_valid_for(allocation, current_result):
+        logger.warn("Checkpoint %s does not match the allocation window. "
+                    "Counting all instance history." % checkpoint)
+        checkpoint = None
+    new_checkpoint = _create_checkpoint(allocation, current_result, checkpoint)
     instance_rules = []
     # First loop - Apply all global rules.
     #             Collect instance rules seperately.
@@ -83,6 +133,11 @@ def calculate_allocation(allocation, print_logs=False):
             if current_period.total_credit > timedelta(0):
                 logger.debug("> > Allocation Increased: %s"
                              % current_period.total_credit)
+        old_period = checkpoint.get_period(current_period)\
+            if checkpoint else None
+        period_checkpoint = new_checkpoint.add_period(current_period)
+        if old_period:
+            period_checkpoint.extend(old_period)
         # Second loop - Go through all the instances and apply
         #              the specific rules (This loop relates to time USED)
         instance_results = []
@@ -95,13 +150,29 @@ def calculate_allocation(allocation, print_logs=False):
                 instance, instance_rules,
                 current_period.start_counting_date,
                 current_period.stop_counting_date,
-                print_logs=print_logs)
+                print_logs=print_logs,
+                checkpoint=checkpoint,
+                period_checkpoint=period_checkpoint)
+            if old_period:
+                history_list = old_period.history_results(
+                    instance.identifier) + history_list
             if not history_list:
                 continue
             instance_result = InstanceResult(
                 identifier=instance.identifier, history_list=history_list)
             instance_results.append(instance_result)
 
+        if old_period:
+            # Instances whose history has been completely folded
+            counted = set(
+                instance.identifier for instance in allocation.instances)
+            for identifier in old_period.identifiers():
+                if identifier in counted:
+                    continue
+                instance_results.append(InstanceResult(
+                    identifier=identifier,
+                    history_list=old_period.history_results(identifier)))
+
         if print_logs:
             logger.debug("> > Instance history Results:")
             for instance_result in instance_results:
@@ -118,6 +189,7 @@ def calculate_allocation(allocation, print_logs=False):
             # We need to 'carry forward the negative value'
             # to appropriately 'credit' the next month.
             time_forward = -diff_amount if is_over else diff_amount
+    current_result.checkpoint = new_checkpoint
     return current_result
 
 
@@ -128,43 +200,61 @@ def _multiply_time_delta(timedelta1, timedelta2):
 
 
 def _calculate_instance_history_list(instance, rules, start_date, end_date,
-                                     print_logs=False):
+                                     print_logs=False, checkpoint=None,
+                                     period_checkpoint=None):
     """
     Given an instance and a set of 'InstanceRules'
     Calculate the time used for every history
+
+    Histories already folded into 'checkpoint' are skipped.
+    Closed histories are folded into 'period_checkpoint'.
     """
     # Calculate time used by applying rules to each history and keeping a
     # running total for each status
     history_list = []
     for history in instance.history:
-        history_result = InstanceHistoryResult(status_name=history.status)
-        if history.end_date and history.end_date < start_date:
-            history_result.clock_time = timedelta(0)
-            history_list.append(history_result)
+        if checkpoint and checkpoint.is_folded(history):
             continue
+        history_result = _calculate_instance_history(
+            instance, history, rules, start_date, end_date,
+            print_logs=print_logs)
+        if period_checkpoint:
+            period_checkpoint.fold_history(
+                instance.identifier, history, history_result)
+        history_list.append(history_result)
 
-        clock_time = _get_clock_time(history, start_date, end_date,
-                                     print_logs=print_logs)
+    return history_list
 
-        if clock_time == timedelta(0):
-            # do we need this? seems like it could cause unforseen problems
-            history_result.clock_time = clock_time
-            history_list.append(history_result)
-            continue
 
-        # NOTE: There are some limitations to an implementation like this
-        #       Ex: A rule that starts 'halfway' between start and end date
-        #          (Is that a thing?)
-        time_per_second = _running_time_per_second(history, instance, rules)
-        running_time = _multiply_time_delta(clock_time, time_per_second)
-        history_result.clock_time += clock_time
-        history_result.total_time += running_time
+def _calculate_instance_history(instance, history, rules, start_date,
+                                end_date, print_logs=False):
+    """
+    Apply the 'InstanceRules' to a single history
+    """
+    history_result = InstanceHistoryResult(status_name=history.status)
+    if history.end_date and history.end_date < start_date:
+        history_result.clock_time = timedelta(0)
+        return history_result
 
-        if _get_burn_rate_test(history, end_date):
-            history_result.burn_rate += time_per_second
-        history_list.append(history_result)
+    clock_time = _get_clock_time(history, start_date, end_date,
+                                 print_logs=print_logs)
 
-    return history_list
+    if clock_time == timedelta(0):
+        # do we need this? seems like it could cause unforseen problems
+        history_result.clock_time = clock_time
+        return history_result
+
+    # NOTE: There are some limitations to an implementation like this
+    #       Ex: A rule that starts 'halfway' between start and end date
+    #          (Is that a thing?)
+    time_per_second = _running_time_per_second(history, instance, rules)
+    running_time = _multiply_time_delta(clock_time, time_per_second)
+    history_result.clock_time += clock_time
+    history_result.total_time += running_time
+
+    if _get_burn_rate_test(history, end_date):
+        history_result.burn_rate += time_per_second
+    return history_result
 
 
 def _get_burn_rate_test(history, end_date):
@@ -227,3 +317,291 @@ def _running_time_per_second(history, instance, rules):
         # returns it as a result
         running_time = rule.apply_rule(instance, history, running_time)
     return running_time
+
+
+# Batch ###
+def calculate_allocations(allocations, print_logs=False):
+    """
+    Calculate an AllocationResult for every allocation in 'allocations'.
+
+    Every InstanceHistory (of every allocation) is loaded into NumPy arrays,
+    and the clock time, total time and burn rate are calculated for all
+    histories and TimePeriodResults at once. The results are identical to
+    calling 'calculate_allocation' on each allocation.
+
+    NOTE: Allocations that include a checkpoint (and all allocations, when
+          NumPy is not installed) are calculated one at a time.
+    An allocation that cannot be calculated has a result of None (The error
+    is logged). If the batch fails, its allocations are calculated one at a
+    time, so one bad allocation does not fail the others.
+    """
+    results = [None] * len(allocations)
+    batch = []
+    for index, allocation in enumerate(allocations):
+        if not numpy or allocation.checkpoint:
+            results[index] = _calculate_or_log(allocation, print_logs)
+        else:
+            batch.append(index)
+    try:
+        batch_results = _calculate_allocation_batch(
+            [allocations[index] for index in batch])
+    except Exception:
+        logger.exception("Could not calculate %s allocations as a batch. "
+                         "Calculating them one at a time." % len(batch))
+        batch_results = [_calculate_or_log(allocations[index], print_logs)
+                         for index in batch]
+    for index, result in zip(batch, batch_results):
+        results[index] = result
+    if print_logs:
+        logger.debug("Calculated %s allocations (%s as a batch)"
+                     % (len(allocations), len(batch)))
+    return results
+
+
+def _calculate_or_log(allocation, print_logs=False):
+    try:
+        return calculate_allocation(allocation, print_logs=print_logs)
+    except Exception:
+        logger.exception("Could not calculate an allocation (Window: %s - %s)"
+                         % (allocation.start_date, allocation.end_date))
+        return None
+
+
+def _to_microseconds(date):
+    delta = date - _get_zero_date_utc()
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def _round_microseconds(seconds):
+    """
+    timedelta only counts microseconds.
+    Round the same way (Half to even) that a timedelta would.
+    """
+    return numpy.rint(seconds * 10 ** 6) / 10 ** 6
+
+
+def _rule_values(rule):
+    if not isinstance(rule.value, list):
+        return [rule.value]
+    return rule.value
+
+
+def _vectorized_rate(rules, columns, rows):
+    """
+    The array equivalent of '_running_time_per_second' for every history
+    in 'rows'. Returns None if a rule cannot be applied as an array.
+    """
+    rate = numpy.ones(len(rows))
+    for rule in rules:
+        rule_type = type(rule)
+        if rule_type == IgnoreStatusRule:
+            ignored = columns.codes('status', _rule_values(rule))
+            rate[numpy.in1d(columns.status[rows], ignored)] = 0
+        elif rule_type == IgnoreMachineRule:
+            ignored = columns.codes('machine', _rule_values(rule))
+            rate[numpy.in1d(columns.machine[rows], ignored)] = 0
+        elif rule_type == IgnoreProviderRule:
+            ignored = columns.codes('provider', _rule_values(rule))
+            rate[numpy.in1d(columns.provider[rows], ignored)] = 0
+        elif rule_type == MultiplyBurnTime:
+            rate = _round_microseconds(rate * rule.multiplier)
+        elif rule_type == MultiplySizeCPU:
+            rate = _round_microseconds(
+                rate * (rule.multiplier * columns.cpu[rows]))
+        elif rule_type == MultiplySizeRAM:
+            rate = _round_microseconds(
+                rate * (rule.multiplier * columns.ram[rows]))
+        elif rule_type == MultiplySizeDisk:
+            rate = _round_microseconds(
+                rate * (rule.multiplier * columns.disk[rows]))
+        else:
+            return None
+    return rate
+
+
+class _HistoryColumns(object):
+
+    """
+    Every InstanceHistory of a list of allocations, stored as columns.
+    Rows are ordered by allocation, instance, then history.
+    """
+
+    def __init__(self, allocations):
+        self._code_maps = {'status': {}, 'machine': {}, 'provider': {}}
+        self.rows = []
+        allocation_idx, instance_idx = [], []
+        start, end, is_open = [], [], []
+        status, machine, provider = [], [], []
+        cpu, ram, disk = [], [], []
+        instance_count = 0
+        for a_index, allocation in enumerate(allocations):
+            for instance in allocation.instances:
+                machine_code = self._code(
+                    'machine', instance.machine.identifier
+                    if instance.machine else None)
+                provider_code = self._code(
+                    'provider', instance.provider.identifier
+                    if instance.provider else None)
+                for history in instance.history:
+                    self.rows.append((instance, history))
+                    allocation_idx.append(a_index)
+                    instance_idx.append(instance_count)
+                    start.append(_to_microseconds(history.start_date))
+                    end.append(_to_microseconds(history.end_date)
+                               if history.end_date else 0)
+                    is_open.append(not history.end_date)
+                    status.append(self._code('status', history.status))
+                    machine.append(machine_code)
+                    provider.append(provider_code)
+                    cpu.append(history.size.cpu)
+                    ram.append(history.size.ram)
+                    disk.append(history.size.disk)
+                instance_count += 1
+        self.allocation = numpy.array(allocation_idx, dtype=numpy.int64)
+        self.instance = numpy.array(instance_idx, dtype=numpy.int64)
+        self.start = numpy.array(start, dtype=numpy.int64)
+        self.end = numpy.array(end, dtype=numpy.int64)
+        self.is_open = numpy.array(is_open, dtype=bool)
+        # Open histories are counted until the end of every period
+        self.end[self.is_open] = numpy.iinfo(numpy.int64).max
+        self.status = numpy.array(status, dtype=numpy.int64)
+        self.machine = numpy.array(machine, dtype=numpy.int64)
+        self.provider = numpy.array(provider, dtype=numpy.int64)
+        self.cpu = numpy.array(cpu, dtype=numpy.float64)
+        self.ram = numpy.array(ram, dtype=numpy.float64)
+        self.disk = numpy.array(disk, dtype=numpy.float64)
+
+    def _code(self, column, value):
+        code_map = self._code_maps[column]
+        if value not in code_map:
+            code_map[value] = len(code_map)
+        return code_map[value]
+
+    def codes(self, column, values):
+        code_map = self._code_maps[column]
+        return numpy.array(
+            [code_map[value] for value in values if value in code_map],
+            dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _prepare_allocation(allocation):
+    """
+    Create the (empty) AllocationResult and apply all global rules.
+    Returns the result and the list of instance rules.
+    """
+    (window_start_date, window_end_date) = get_allocation_window(allocation)
+    current_result = AllocationResult(
+        allocation, window_start_date, window_end_date,
+        force_interval_every=allocation.interval_delta)
+    instance_rules = []
+    for rule in allocation.rules:
+        if issubclass(rule.__class__, GlobalRule):
+            rule.apply_global_rule(allocation, current_result)
+        elif issubclass(rule.__class__, InstanceRule):
+            instance_rules.append(rule)
+        else:
+            raise Exception("Unknown Type of Rule: %s" % rule)
+    return current_result, instance_rules
+
+
+def _calculate_allocation_batch(allocations):
+    if not allocations:
+        return []
+    prepared = [_prepare_allocation(allocation) for allocation in allocations]
+    columns = _HistoryColumns(allocations)
+
+    # Time used per second, for every history.
+    # Allocations that share the same rules are calculated together.
+    rate = numpy.zeros(len(columns))
+    rule_groups = {}
+    for a_index, (_, instance_rules) in enumerate(prepared):
+        group_key = repr(AllocationCheckpoint.rule_signatures_for(
+            allocations[a_index]))
+        rule_groups.setdefault(group_key, (instance_rules, []))[1].append(
+            a_index)
+    for instance_rules, a_indexes in rule_groups.values():
+        rows = numpy.flatnonzero(numpy.in1d(columns.allocation, a_indexes))
+        group_rate = _vectorized_rate(instance_rules, columns, rows)
+        if group_rate is None:
+            group_rate = [
+                _running_time_per_second(
+                    columns.rows[row][1], columns.rows[row][0],
+                    instance_rules).total_seconds()
+                for row in rows]
+        rate[rows] = group_rate
+
+    # Every TimePeriodResult, for every allocation.
+    all_periods = [period for current_result, _ in prepared
+                   for period in current_result.time_periods]
+    period_count = numpy.array(
+        [len(current_result.time_periods) for current_result, _ in prepared],
+        dtype=numpy.int64)
+    period_offset = numpy.cumsum(period_count) - period_count
+    period_start = numpy.array(
+        [_to_microseconds(period.start_counting_date)
+         for period in all_periods], dtype=numpy.int64)
+    period_stop = numpy.array(
+        [_to_microseconds(period.stop_counting_date)
+         for period in all_periods], dtype=numpy.int64)
+
+    # Pair every history with every TimePeriodResult of its allocation
+    counts = period_count[columns.allocation]
+    pair_history = numpy.repeat(numpy.arange(len(columns)), counts)
+    pair_period = numpy.repeat(period_offset[columns.allocation], counts) +\
+        numpy.arange(len(pair_history)) -\
+        numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+    # Same rules as '_get_clock_time' and '_get_burn_rate_test'
+    start = columns.start[pair_history]
+    end = columns.end[pair_history]
+    stop_counting = period_stop[pair_period]
+    start_counting = period_start[pair_period]
+    outside = (end < start_counting) | (start > stop_counting)
+    clock_time = numpy.minimum(end, stop_counting) -\
+        numpy.maximum(start, start_counting)
+    clock_time[outside] = 0
+    pair_rate = rate[pair_history]
+    total_time = (clock_time / 10.0 ** 6) * pair_rate
+    burns = (clock_time != 0) & (start <= stop_counting) &\
+        (columns.is_open[pair_history] | (end >= stop_counting))
+    burn_rate = numpy.where(burns, pair_rate, 0)
+
+    # Order the same way the engine does: period, instance, history
+    order = numpy.lexsort((pair_history, pair_period))
+    instance_idx = columns.instance.tolist()
+    period_results = [[] for _ in all_periods]
+    last_key = None
+    for p_index, h_index, clock, total, burn in zip(
+            pair_period[order].tolist(), pair_history[order].tolist(),
+            clock_time[order].tolist(), total_time[order].tolist(),
+            burn_rate[order].tolist()):
+        instance, history = columns.rows[h_index]
+        history_result = InstanceHistoryResult(
+            status_name=history.status,
+            clock_time=timedelta(microseconds=clock),
+            total_time=timedelta(seconds=total),
+            burn_rate=timedelta(seconds=burn))
+        key = (p_index, instance_idx[h_index])
+        if key != last_key:
+            period_results[p_index].append(InstanceResult(
+                identifier=instance.identifier, history_list=[]))
+            last_key = key
+        period_results[p_index][-1].history_list.append(history_result)
+
+    results = []
+    for a_index, (current_result, _) in enumerate(prepared):
+        time_forward = timedelta(0)
+        offset = period_offset[a_index]
+        for p_index, current_period in enumerate(current_result.time_periods):
+            if current_result.carry_forward and time_forward:
+                current_period.increase_credit(
+                    time_forward, carry_forward=True)
+            current_period.instance_results = period_results[offset + p_index]
+            is_over, diff_amount = current_period.allocation_difference()
+            if current_result.carry_forward:
+                time_forward = -diff_amount if is_over else diff_amount
+        results.append(current_result)
+    return results
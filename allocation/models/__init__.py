@@ -1,4 +1,5 @@
 from allocation.models.inputs import TimeUnit, Provider, Machine, Size, Instance, InstanceHistory, AllocationIncrease, AllocationUnlimited, AllocationRecharge, Allocation
 from allocation.models.results import InstanceHistoryResult, InstanceResult, TimePeriodResult, AllocationResult
 from allocation.models.rules import Rule, GlobalRule, InstanceRule, CarryForwardTime, FilterOutRule, InstanceCountingRule, InstanceMultiplierRule, IgnoreStatusRule, IgnoreMachineRule, IgnoreProviderRule, MultiplyBurnTime, MultiplySizeCPU, MultiplySizeDisk, MultiplySizeRAM
+from allocation.models.checkpoint import TimePeriodCheckpoint, AllocationCheckpoint
 from allocation.models.strategy import PythonAllocationStrategy, PythonRulesBehavior, GlobalRules, NewUserRules, StaffRules, MultiplySizeCPURule, IgnoreNonActiveStatus, PythonRefreshBehavior, OneTimeRefresh, RecurringRefresh, PythonCountingBehavior, FixedWindow, FixedStartSlidingWindow, FixedEndSlidingWindow
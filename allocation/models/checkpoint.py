@@ -0,0 +1,189 @@
+"""
+Checkpoints (Saved state) produced by the allocation engine.
+
+A checkpoint remembers the time used by every InstanceHistory that was
+closed on or before 'closed_until'. Later runs can resume from the
+checkpoint and only count the histories that were opened or changed
+after that date.
+"""
+from django.utils.timezone import timedelta
+
+from allocation.models.results import InstanceHistoryResult
+
+
+def _rule_signature(rule):
+    return (rule.__class__.__name__, rule.name,
+            getattr(rule, 'value', None),
+            getattr(rule, 'multiplier', None))
+
+
+class TimePeriodCheckpoint(object):
+
+    """
+    The time used inside a single TimePeriodResult by every
+    InstanceHistory that was closed on or before 'closed_until'
+    """
+
+    def __init__(self, start_date, end_date, closed_until,
+                 allocation_credit=timedelta(0)):
+        self.start_counting_date = start_date
+        self.stop_counting_date = end_date
+        self.closed_until = closed_until
+        self.allocation_credit = allocation_credit
+        # identifier -> {status_name: (clock_time, total_time)}
+        self.folded = {}
+
+    def is_folded(self, history):
+        return history.end_date is not None\
+            and history.end_date <= self.closed_until
+
+    def matches(self, time_period):
+        """
+        Returns whether the folded time is still correct for 'time_period'
+        """
+        if self.start_counting_date != time_period.start_counting_date:
+            return False
+        if self.stop_counting_date == time_period.stop_counting_date:
+            return True
+        # Every folded history ended on/before 'closed_until', so moving
+        # a stop date that is past 'closed_until' does not change the
+        # clock time of any folded history.
+        return self.stop_counting_date >= self.closed_until and\
+            time_period.stop_counting_date >= self.closed_until
+
+    def fold(self, identifier, status_name, clock_time, total_time):
+        status_map = self.folded.setdefault(identifier, {})
+        (old_clock, old_total) = status_map.get(
+            status_name, (timedelta(0), timedelta(0)))
+        status_map[status_name] = (old_clock + clock_time,
+                                   old_total + total_time)
+
+    def fold_history(self, identifier, history, history_result):
+        """
+        Fold 'history_result' into the checkpoint if 'history' is closed.
+        Returns True if the history was folded.
+        """
+        if not self.is_folded(history):
+            return False
+        self.fold(identifier, history_result.status_name,
+                  history_result.clock_time, history_result.total_time)
+        return True
+
+    def extend(self, period_checkpoint):
+        """
+        Fold all of the time from an older 'period_checkpoint' into this one
+        """
+        for identifier, status_map in period_checkpoint.folded.items():
+            for status_name, (clock_time, total_time) in status_map.items():
+                self.fold(identifier, status_name, clock_time, total_time)
+
+    def identifiers(self):
+        return self.folded.keys()
+
+    def history_results(self, identifier):
+        """
+        Returns a list of InstanceHistoryResult (One per status)
+        NOTE: Folded histories are closed, so they have no burn rate.
+        """
+        status_map = self.folded.get(identifier, {})
+        return [InstanceHistoryResult(status_name,
+                                      clock_time=clock_time,
+                                      total_time=total_time)
+                for status_name, (clock_time, total_time)
+                in sorted(status_map.items())]
+
+    def used_time(self):
+        used_time = timedelta(0)
+        for status_map in self.folded.values():
+            for (clock_time, total_time) in status_map.values():
+                used_time += total_time
+        return used_time
+
+    def __repr__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return "<TimePeriodCheckpoint: Starting From: %s To: %s "\
+            "Allocation Credit:%s Used Time:%s>"\
+            % (self.start_counting_date, self.stop_counting_date,
+               self.allocation_credit, self.used_time())
+
+
+class AllocationCheckpoint(object):
+
+    """
+    The state required to resume the allocation engine:
+    * The window and rules that were used to calculate it
+    * The date that all folded histories were closed by ('closed_until')
+    * A TimePeriodCheckpoint for every TimePeriodResult
+    """
+
+    def __init__(self, window_start, closed_until, rule_signatures,
+                 time_periods=None):
+        self.window_start = window_start
+        self.closed_until = closed_until
+        self.rule_signatures = rule_signatures
+        if not time_periods:
+            self.time_periods = []
+        else:
+            self.time_periods = time_periods
+
+    @classmethod
+    def rule_signatures_for(cls, allocation):
+        return [_rule_signature(rule) for rule in allocation.rules]
+
+    def is_folded(self, history):
+        return history.end_date is not None\
+            and history.end_date <= self.closed_until
+
+    def add_period(self, time_period):
+        period_checkpoint = TimePeriodCheckpoint(
+            time_period.start_counting_date,
+            time_period.stop_counting_date,
+            self.closed_until,
+            time_period.total_credit)
+        self.time_periods.append(period_checkpoint)
+        return period_checkpoint
+
+    def get_period(self, time_period):
+        """
+        Returns the TimePeriodCheckpoint that matches 'time_period' (or None)
+        """
+        for period_checkpoint in self.time_periods:
+            if period_checkpoint.matches(time_period):
+                return period_checkpoint
+        return None
+
+    def is_valid_for(self, allocation, allocation_result):
+        """
+        A checkpoint can only be resumed if:
+        * The window started on the same date, using the same rules
+        * Every TimePeriodCheckpoint matches a TimePeriodResult
+        * TimePeriodResults without a match start after 'closed_until'
+          (No folded history could have been counted there)
+        """
+        if self.window_start != allocation_result.window_start:
+            return False
+        if self.rule_signatures != self.rule_signatures_for(allocation):
+            return False
+        matched = 0
+        for time_period in allocation_result.time_periods:
+            if self.get_period(time_period):
+                matched += 1
+            elif time_period.start_counting_date < self.closed_until:
+                return False
+        return matched == len(self.time_periods)
+
+    def used_time(self):
+        used_time = timedelta(0)
+        for period_checkpoint in self.time_periods:
+            used_time += period_checkpoint.used_time()
+        return used_time
+
+    def __repr__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return "<AllocationCheckpoint: Window Start: %s Closed Until: %s "\
+            "Time Periods: %s>"\
+            % (self.window_start, self.closed_until, self.time_periods)
@@ -95,19 +95,28 @@ class Instance(object):
         self.history = history
 
     @classmethod
-    def from_core(cls, core_instance, start_date=None):
+    def from_core(cls, core_instance, start_date=None, history_list=None):
+        """
+        history_list - (Optional) core histories that have already been
+                       retrieved, ordered by start_date.
+        """
         source = core_instance.source.current_source
         prov = Provider.from_core(source.provider)
         mach = Machine.from_core(source)
         instance_history = []
-        if not start_date:
+        if history_list is not None:
+            # Preloaded list
+            pass
+        elif not start_date:
             # Full list
-            history_list = core_instance.instancestatushistory_set.all()
+            history_list = core_instance.instancestatushistory_set.all()\
+                .order_by('start_date')
         else:
             # Shorter list
             history_list = core_instance.instancestatushistory_set.filter(
-                Q(end_date=None) | Q(end_date__gt=start_date))
-        for history in history_list.order_by('start_date'):
+                Q(end_date=None) | Q(end_date__gt=start_date))\
+                .order_by('start_date')
+        for history in history_list:
             alloc_history = InstanceHistory.from_core(history)
             instance_history.append(alloc_history)
 
@@ -257,7 +266,7 @@ class AllocationRecharge(AllocationIncrease):
 class Allocation(object):
 
     def __init__(self, credits, rules, instances,
-                 start_date, end_date, interval_delta=None):
+                 start_date, end_date, interval_delta=None, checkpoint=None):
         validate_interval(start_date, end_date)
         # TODO: Sort so that Recharges happen PRIOR to Increases on EQUAL dates
         self.credits = credits
@@ -266,6 +275,8 @@ class Allocation(object):
         self.start_date = start_date
         self.end_date = end_date
         self.interval_delta = interval_delta
+        # Resume the engine from this AllocationCheckpoint (If valid)
+        self.checkpoint = checkpoint
 
     def __repr__(self):
         return self.__unicode__()
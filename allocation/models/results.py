@@ -189,6 +189,8 @@ class AllocationResult():
     time_periods = []
     # POLICY decisions that affect the engine
     carry_forward = False
+    # AllocationCheckpoint created while calculating this result
+    checkpoint = None
 
     @classmethod
     def no_allocation(cls):
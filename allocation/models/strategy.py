@@ -11,6 +11,16 @@ from allocation.models import Instance as AllocInstance
 
 from threepio import logger
 
+
+def _preloaded_history(core_instance, start_date):
+    """
+    Filter the (prefetched) history of 'core_instance' in memory
+    """
+    return [history for history in
+            core_instance.instancestatushistory_set.all()
+            if not history.end_date or history.end_date > start_date]
+
+
 class PythonAllocationStrategy(object):
 
     """
@@ -31,26 +41,59 @@ class PythonAllocationStrategy(object):
         self.recharge_behaviors = recharge_behaviors
         self.rule_behaviors = rule_behaviors
 
-    def get_instance_list(self, identity):
+    def get_instance_list(self, identity, start_date=None,
+                          core_instances=None):
+        """
+        core_instances - (Optional) core instances that have been preloaded
+                         with their 'instancestatushistory_set'
+                         (See service.monitoring._get_allocation_inputs)
+        """
         from service.monitoring import _core_instances_for
-        # Retrieve the core that could have an impact..
-        core_instances = _core_instances_for(
-            identity,
-            self.counting_behavior.start_date)
+        if not start_date:
+            start_date = self.counting_behavior.start_date
+        preloaded = core_instances is not None
+        if not preloaded:
+            # Retrieve the core that could have an impact..
+            core_instances = _core_instances_for(
+                identity,
+                start_date)
         # Convert Core Models --> Allocation/core Models
         alloc_instances = []
         for inst in core_instances:
             try:
+                history_list = None
+                if preloaded:
+                    history_list = _preloaded_history(inst, start_date)
+                    if not history_list and inst.end_date\
+                            and inst.end_date <= start_date:
+                        # Same as _core_instances_for: No impact.
+                        continue
                 alloc_instances.append(
-                    AllocInstance.from_core(inst, self.counting_behavior.start_date)
+                    AllocInstance.from_core(inst, start_date, history_list)
                 )
             except Exception as exc:
                 logger.exception(exc)
         return alloc_instances
 
-    def apply(self, identity, core_allocation):
-        instances = self.get_instance_list(identity)
-
+    def _history_start_date(self, allocation):
+        """
+        When resuming from a checkpoint, only histories that were
+        opened or changed after 'checkpoint.closed_until' are required.
+        """
+        from allocation.engine import validate_checkpoint
+        start_date = self.counting_behavior.start_date
+        checkpoint = allocation.checkpoint
+        if not checkpoint:
+            return start_date
+        if not validate_checkpoint(allocation, checkpoint):
+            logger.info("Checkpoint %s is no longer valid. "
+                        "Counting all instance history." % checkpoint)
+            allocation.checkpoint = None
+            return start_date
+        return max(start_date, checkpoint.closed_until)
+
+    def apply(self, identity, core_allocation, checkpoint=None,
+              core_instances=None):
         credits = []
         for behavior in self.recharge_behaviors:
             if core_allocation:
@@ -71,12 +114,16 @@ class PythonAllocationStrategy(object):
                 behavior.apply_rules(identity, core_allocation)
             )
 
-        return Allocation(
+        allocation = Allocation(
             credits=credits, rules=rules,
-            instances=instances,
+            instances=[],
             start_date=self.counting_behavior.start_date,
             end_date=self.counting_behavior.end_date,
-            interval_delta=self.counting_behavior.interval_delta)
+            interval_delta=self.counting_behavior.interval_delta,
+            checkpoint=checkpoint)
+        allocation.instances = self.get_instance_list(
+            identity, self._history_start_date(allocation), core_instances)
+        return allocation
 
     def __repr__(self):
         return self.__unicode__()
@@ -15,6 +15,7 @@ Questions:
 """
 
 from dateutil.relativedelta import relativedelta
+import mock
 import pytz
 
 from django.test import TestCase
@@ -521,6 +522,165 @@ class TestAllocationEngine(AllocationTestCase):
         self.assertTotalRuntimeEquals(allocation, timedelta(days=45))
 
 
+class TestAllocationCheckpoint(AllocationTestCase):
+
+    def setUp(self):
+        increase_date = self.start_window = datetime(
+            2014, 7, 1, tzinfo=pytz.utc)
+        self.first_run = datetime(2014, 7, 10, tzinfo=pytz.utc)
+        self.second_run = datetime(2014, 7, 20, tzinfo=pytz.utc)
+        self.allocation_helper = AllocationHelper(
+            self.start_window, self.first_run, increase_date)
+        # Instance 1: Closed long before the first run
+        helper = InstanceHelper()
+        helper.add_history_entry(
+            datetime(2014, 7, 2, tzinfo=pytz.utc),
+            datetime(2014, 7, 4, tzinfo=pytz.utc))
+        helper.add_history_entry(
+            datetime(2014, 7, 4, tzinfo=pytz.utc),
+            datetime(2014, 7, 5, tzinfo=pytz.utc), status="suspended")
+        self.allocation_helper.add_instance(helper.to_instance("Instance 1"))
+        # Instance 2: Active through both runs
+        helper = InstanceHelper()
+        helper.add_history_entry(
+            datetime(2014, 7, 6, tzinfo=pytz.utc), None, size="test.small")
+        self.allocation_helper.add_instance(helper.to_instance("Instance 2"))
+
+    def _resume(self):
+        first_result = self._calculate_allocation(
+            self.allocation_helper.to_allocation())
+        self.allocation_helper.set_window(self.start_window, self.second_run)
+        allocation = self.allocation_helper.to_allocation()
+        allocation.checkpoint = first_result.checkpoint
+        return first_result, allocation
+
+    def test_checkpoint_folds_closed_history(self):
+        """
+        Only histories closed before the end of the window are folded
+        """
+        first_result, _ = self._resume()
+        self.assertEqual(first_result.checkpoint.used_time(),
+                         timedelta(days=2))
+
+    def test_resume_matches_full_calculation(self):
+        """
+        Resuming from a checkpoint gives the same result as counting all time
+        """
+        first_result, allocation = self._resume()
+        full_result = self._calculate_allocation(
+            self.allocation_helper.to_allocation())
+        resumed_result = self._calculate_allocation(allocation)
+        self.assertEqual(resumed_result.total_runtime(),
+                         full_result.total_runtime())
+        self.assertEqual(resumed_result.total_difference(),
+                         full_result.total_difference())
+        self.assertEqual(resumed_result.get_burn_rate(),
+                         full_result.get_burn_rate())
+
+    def test_resume_without_folded_history(self):
+        """
+        Histories folded into the checkpoint are not required to resume
+        """
+        first_result, allocation = self._resume()
+        checkpoint = first_result.checkpoint
+        for instance in allocation.instances:
+            instance.history = [history for history in instance.history
+                                if not checkpoint.is_folded(history)]
+        allocation.instances = [instance for instance in allocation.instances
+                                if instance.history]
+        resumed_result = self._calculate_allocation(allocation)
+        self.assertEqual(resumed_result.total_runtime(),
+                         timedelta(days=2) + timedelta(days=14 * 2))
+
+    def test_invalid_checkpoint_is_ignored(self):
+        """
+        A checkpoint calculated with different rules is not resumed
+        """
+        first_result, allocation = self._resume()
+        allocation.rules = allocation.rules + [multiply_by_cpu]
+        self.assertFalse(
+            engine.validate_checkpoint(allocation, first_result.checkpoint))
+        resumed_result = self._calculate_allocation(allocation)
+        self.assertEqual(resumed_result.total_runtime(),
+                         timedelta(days=2) + timedelta(days=14 * 4))
+
+
+@unittest.skipIf(engine.numpy is None, "NumPy is not installed")
+class TestAllocationBatch(AllocationTestCase):
+
+    def setUp(self):
+        increase_date = start_window = datetime(2014, 7, 1, tzinfo=pytz.utc)
+        stop_window = datetime(2014, 9, 1, tzinfo=pytz.utc)
+        self.allocations = []
+        current_time = datetime(2014, 7, 4, hour=12, tzinfo=pytz.utc)
+        for interval in [None, relativedelta(days=7)]:
+            allocation_helper = AllocationHelper(
+                start_window, stop_window, increase_date,
+                interval_delta=interval)
+            for idx, size in enumerate(AVAILABLE_SIZES.keys()):
+                helper = InstanceHelper()
+                start_time = current_time + timedelta(days=idx, minutes=idx)
+                end_time = start_time + timedelta(days=3)
+                helper.add_history_entry(start_time, end_time, size=size)
+                helper.add_history_entry(
+                    end_time, end_time + timedelta(days=3),
+                    status="suspended", size=size)
+                helper.add_history_entry(
+                    end_time + timedelta(days=3), None, size=size)
+                allocation_helper.add_instance(
+                    helper.to_instance("Instance %s" % idx))
+            self.allocations.append(allocation_helper.to_allocation())
+        # An allocation without any instances
+        self.allocations.append(AllocationHelper(
+            start_window, stop_window, increase_date).to_allocation())
+
+    def _history_values(self, allocation_result):
+        return [[(instance_result.identifier, history_result.status_name,
+                  history_result.clock_time, history_result.total_time,
+                  history_result.burn_rate)
+                 for instance_result in period.instance_results
+                 for history_result in instance_result.history_list]
+                for period in allocation_result.time_periods]
+
+    def test_batch_matches_engine(self):
+        """
+        calculate_allocations returns the same results as calculate_allocation
+        """
+        batch_results = engine.calculate_allocations(self.allocations)
+        self.assertEqual(len(batch_results), len(self.allocations))
+        for allocation, batch_result in zip(self.allocations, batch_results):
+            result = self._calculate_allocation(allocation)
+            self.assertEqual(self._history_values(batch_result),
+                             self._history_values(result))
+            self.assertEqual(batch_result.total_difference(),
+                             result.total_difference())
+            self.assertEqual(batch_result.get_burn_rate(),
+                             result.get_burn_rate())
+
+    def test_errors_are_isolated(self):
+        """
+        A failing batch is calculated one allocation at a time,
+        a failing allocation has a result of None
+        """
+        bad_allocation = self.allocations[0]
+        calculate_allocation = engine.calculate_allocation
+
+        def calculate(allocation, print_logs=False):
+            if allocation is bad_allocation:
+                raise ValueError("Bad instance history")
+            return calculate_allocation(allocation, print_logs=print_logs)
+        with mock.patch.object(engine, '_calculate_allocation_batch',
+                               side_effect=ValueError("Bad batch")),\
+                mock.patch.object(engine, 'calculate_allocation', calculate):
+            batch_results = engine.calculate_allocations(self.allocations)
+        self.assertIsNone(batch_results[0])
+        for allocation, batch_result in zip(self.allocations[1:],
+                                            batch_results[1:]):
+            self.assertEqual(batch_result.total_difference(),
+                             self._calculate_allocation(
+                                 allocation).total_difference())
+
+
 # From the REPL
 def repl_profile_test_1():
     """
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework.test import APIClient
+
+from api.profiling import is_scaling, scaling_profiles, v2_list_routes
+from core.models import AtmosphereUser
+
+
+class Command(BaseCommand):
+    help = ("Profile the SQL queries of every v2 list route. "
+            "Fails if a route makes more queries for more objects (N+1).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("username",
+                            help="User that the requests are made as")
+        parser.add_argument("--page-sizes", default="1,25",
+                            help="Comma separated page sizes to compare")
+        parser.add_argument("--host", default="localhost",
+                            help="Host header (Must be in ALLOWED_HOSTS)")
+        parser.add_argument("--route", action="append", default=[],
+                            help="Only profile these route prefixes")
+
+    def handle(self, *args, **options):
+        try:
+            user = AtmosphereUser.objects.get(username=options['username'])
+        except AtmosphereUser.DoesNotExist:
+            raise CommandError("User %s does not exist" % options['username'])
+        page_sizes = [int(size) for size in options['page_sizes'].split(",")]
+        client = APIClient(HTTP_HOST=options['host'])
+        scaling = []
+        for prefix, url in v2_list_routes():
+            if options['route'] and prefix not in options['route']:
+                continue
+            profiles = scaling_profiles(
+                url, page_sizes, user=user, client=client)
+            if not profiles:
+                self.stdout.write("SKIPPED %s (Request failed)" % url)
+                continue
+            for profile in profiles:
+                self.stdout.write(unicode(profile))
+            if is_scaling(profiles):
+                scaling.append(prefix)
+                for sql, count in sorted(profiles[-1].repeated.items(),
+                                         key=lambda item: -item[1]):
+                    self.stdout.write("  %sx %s" % (count, sql))
+        if scaling:
+            raise CommandError("Queries scale with the page size (N+1): %s"
+                               % ", ".join(scaling))
+        self.stdout.write("No route scales with the page size.")
@@ -1,7 +1,18 @@
 """
 custom pagination support
 """
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+import json
+import operator
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 # NOTE: this value is set here for v1 api support
 DEFAULT_PAGINATION_SIZE = 20
@@ -23,11 +34,171 @@ def _get_count(queryset):
     except (AttributeError, TypeError):
         return len(queryset)
 
+class KeysetPagination(BasePagination):
+
+    """
+    Cursor pagination on unique, indexed keys, ex: ('-start_date', '-id')
+    Each page is found with a WHERE on the keys of the last object of the
+    previous page (instead of an OFFSET), so deep pages cost as much as
+    the first, and objects added while paging are never repeated.
+    Keys can be NULL: They are ordered as PostgreSQL does (NULLS FIRST
+    for descending keys, NULLS LAST for ascending keys).
+    NOTE: There is no total count, and no previous page.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering, page_size=100, max_page_size=1000):
+        self.ordering = ordering
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+
+    @classmethod
+    def is_requested(cls, request, view=None):
+        """
+        True if 'view' supports it (See 'cursor_ordering')
+        and the request has a 'cursor' (empty for the first page)
+        """
+        return bool(getattr(view, 'cursor_ordering', None)) and \
+            cls.cursor_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        model = queryset.model
+        self.fields = [model._meta.get_field(key.lstrip('-'))
+                       for key in self.ordering]
+        position = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.ordering)
+        if position:
+            queryset = queryset.filter(self._after(position))
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def _after(self, position):
+        """
+        Q for the objects after 'position', with ordering ('-a', '-b'):
+            a <= x AND (a < x OR (a = x AND b < y))
+        (The first condition lets the index scan start at 'position')
+        """
+        clauses = []
+        for index, key in enumerate(self.ordering):
+            clause = self._key_after(key, position[index])
+            for previous_key, value in zip(self.ordering[:index], position):
+                clause &= self._key_equals(previous_key, value)
+            clauses.append(clause)
+        after = reduce(operator.or_, clauses)
+        first_key, first_value = self.ordering[0], position[0]
+        # (Unless NULLs come after 'position')
+        if first_value is not None and \
+                (first_key.startswith('-') or not self.fields[0].null):
+            lookup = 'lte' if first_key.startswith('-') else 'gte'
+            after &= Q(**{'%s__%s' % (first_key.lstrip('-'), lookup):
+                          first_value})
+        return after
+
+    def _key_after(self, key, value):
+        """
+        Q for the values of 'key' after 'value'
+        """
+        name = key.lstrip('-')
+        if key.startswith('-'):
+            if value is None:
+                return Q(**{'%s__isnull' % name: False})
+            return Q(**{'%s__lt' % name: value})
+        if value is None:
+            # Nothing comes after NULL
+            return Q(pk__in=[])
+        after = Q(**{'%s__gt' % name: value})
+        if self.fields[self.ordering.index(key)].null:
+            after |= Q(**{'%s__isnull' % name: True})
+        return after
+
+    def _key_equals(self, key, value):
+        name = key.lstrip('-')
+        if value is None:
+            return Q(**{'%s__isnull' % name: True})
+        return Q(**{name: value})
+
+    def encode_cursor(self, obj):
+        position = [None if field.value_from_object(obj) is None
+                    else field.value_to_string(obj)
+                    for field in self.fields]
+        return urlsafe_b64encode(json.dumps(position))
+
+    def decode_cursor(self, request):
+        """
+        Returns the position (one value per key) of the cursor,
+        or None for the first page.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(str(cursor)))
+            if len(position) != len(self.fields):
+                raise ValueError(position)
+            for field, value in zip(self.fields, position):
+                if value is None and not field.null:
+                    raise ValueError(position)
+            return [None if value is None else field.to_python(value)
+                    for field, value in zip(self.fields, position)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+
 class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 1000
     page_size = 100
     page_size_query_param = 'page_size'
 
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Views with a 'cursor_ordering' can also be paged with a 'cursor'
+        (See KeysetPagination)
+        """
+        self.keyset = None
+        # NOTE: 'DISTINCT ON' querysets must keep their own ordering
+        query = getattr(queryset, 'query', None)
+        if KeysetPagination.is_requested(request, view) \
+                and query and not query.distinct_fields:
+            self.keyset = KeysetPagination(
+                view.cursor_ordering, self.page_size, self.max_page_size)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super(StandardResultsSetPagination, self).paginate_queryset(
+            queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super(StandardResultsSetPagination, self)\
+            .get_paginated_response(data)
+
 class OptionalPagination(PageNumberPagination):
 
     """
@@ -0,0 +1,199 @@
+"""
+SQL query profiling for the API.
+
+QueryProfileMiddleware records the number of queries and time spent in
+the database for every (v2) API request, and how that relates to the
+number of serialized objects in the response. Queries that are repeated
+once per object (the same statement with different values) are reported
+as a possible N+1.
+
+Enable it with settings.API_QUERY_PROFILING. 'profile_get' is used by
+the test harness ('api.tests.query_budget') and, with 'v2_list_routes',
+by the 'profile_api_queries' benchmark command.
+"""
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from threepio import logger
+
+# A statement repeated this many times (or more) is a possible N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SQL_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def normalize_sql(sql):
+    """
+    Replace the values in 'sql' so that statements that only differ by
+    their values are equal:
+        SELECT ... WHERE "id" = 12  -> SELECT ... WHERE "id" = ?
+    """
+    sql = _SQL_LITERALS.sub("?", sql)
+    return _SQL_IN_LISTS.sub("(?)", sql)
+
+
+def count_serialized_objects(response):
+    """
+    Returns the number of objects in a (DRF) response,
+    (paginated) lists count each item, details count as one.
+    """
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return len(data['results'])
+    if isinstance(data, list):
+        return len(data)
+    if data:
+        return 1
+    return 0
+
+
+class QueryProfile(object):
+
+    """
+    The queries made while serving a single request.
+    """
+
+    def __init__(self, path, captured_queries, objects=0,
+                 threshold=N_PLUS_ONE_THRESHOLD):
+        self.path = path
+        self.objects = objects
+        self.queries = len(captured_queries)
+        self.time = sum(float(query.get('time') or 0)
+                        for query in captured_queries)
+        statements = Counter(normalize_sql(query['sql'])
+                             for query in captured_queries)
+        self.repeated = dict(
+            (sql, count) for sql, count in statements.items()
+            if count >= threshold)
+
+    @property
+    def queries_per_object(self):
+        if not self.objects:
+            return float(self.queries)
+        return float(self.queries) / self.objects
+
+    def suspected_n_plus_one(self):
+        """
+        Statements that were repeated (roughly) once per serialized object
+        """
+        if self.objects < N_PLUS_ONE_THRESHOLD:
+            return {}
+        return dict((sql, count) for sql, count in self.repeated.items()
+                    if count >= self.objects)
+
+    def __repr__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return "<QueryProfile: %s Queries:%s Time:%.3fs Objects:%s "\
+            "Queries/Object:%.2f Repeated:%s>"\
+            % (self.path, self.queries, self.time, self.objects,
+               self.queries_per_object, len(self.repeated))
+
+
+def v2_list_routes():
+    """
+    Returns a list of (prefix, url) for every list route in api/v2/urls.py
+    """
+    from api.v2.urls import router
+    routes = []
+    for prefix, viewset, base_name in router.registry:
+        try:
+            url = reverse('api:v2:%s-list' % base_name)
+        except NoReverseMatch:
+            continue
+        routes.append((prefix, url))
+    return routes
+
+
+def profile_get(url, user=None, data=None, client=None):
+    """
+    GET 'url' (as 'user') and return (response, QueryProfile)
+    """
+    from rest_framework.test import APIClient
+    if not client:
+        client = APIClient()
+    if user:
+        client.force_authenticate(user=user)
+    with CaptureQueriesContext(connection) as query_capture:
+        response = client.get(url, data or {})
+    profile = QueryProfile(
+        url, query_capture.captured_queries,
+        objects=count_serialized_objects(response))
+    return response, profile
+
+
+def scaling_profiles(url, page_sizes, user=None, client=None):
+    """
+    GET 'url' once per page size. Returns the list of QueryProfile
+    (Or None if any request fails)
+    """
+    profiles = []
+    for page_size in page_sizes:
+        response, profile = profile_get(
+            url, user, {'page_size': page_size}, client=client)
+        if response.status_code != 200:
+            return None
+        profiles.append(profile)
+    return profiles
+
+
+def is_scaling(profiles):
+    """
+    True if more objects were served with more queries
+    """
+    small, large = profiles[0], profiles[-1]
+    return large.objects > small.objects and large.queries > small.queries
+
+
+class QueryProfileMiddleware(object):
+
+    """
+    Record SQL count and time for every request to API_QUERY_PROFILING_PATHS
+    (Adds the 'X-Query-Count' and 'X-Query-Time' headers to the response)
+
+    Requests over settings.API_QUERY_BUDGET queries,
+    or with a suspected N+1, are logged as a warning.
+    """
+
+    def _is_profiled(self, request):
+        if not getattr(settings, 'API_QUERY_PROFILING', False):
+            return False
+        paths = getattr(settings, 'API_QUERY_PROFILING_PATHS', ['/api/v2'])
+        return any(request.path.startswith(path) for path in paths)
+
+    def process_request(self, request):
+        if not self._is_profiled(request):
+            return
+        request._query_capture = CaptureQueriesContext(connection)
+        request._query_capture.__enter__()
+
+    def process_response(self, request, response):
+        query_capture = getattr(request, '_query_capture', None)
+        if not query_capture:
+            return response
+        query_capture.__exit__(None, None, None)
+        del request._query_capture
+        profile = QueryProfile(
+            request.get_full_path(), query_capture.captured_queries,
+            objects=count_serialized_objects(response))
+        response['X-Query-Count'] = str(profile.queries)
+        response['X-Query-Time'] = "%.3f" % profile.time
+
+        budget = getattr(settings, 'API_QUERY_BUDGET', None)
+        suspects = profile.suspected_n_plus_one()
+        if suspects:
+            logger.warn("Possible N+1 in %s: %s"
+                        % (profile, sorted(suspects.items(),
+                                           key=lambda item: -item[1])))
+        elif budget and profile.queries > budget:
+            logger.warn("Query budget (%s) exceeded: %s" % (budget, profile))
+        else:
+            logger.debug(profile)
+        return response
@@ -0,0 +1,136 @@
+"""
+Server-side response caching and conditional GETs for the API.
+
+A viewset lists the models its responses are built from ('cache_models').
+The ETag of a response is computed from the user, the request (path, query
+and format) and the version of each of those models
+(See 'core.models.model_version'), so saving or deleting any of them
+changes the ETag:
+* A request with a matching 'If-None-Match' is answered with a 304
+* Serialized responses are shared by every process (in redis),
+  for settings.API_RESPONSE_CACHE_TIMEOUT seconds.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.utils.http import parse_etags, quote_etag
+
+import redis
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from threepio import logger
+
+from core.models.model_version import get_model_versions
+from service.cache import redis_connection
+
+RESPONSE_CACHE_KEY = "api_response.{0}"
+DEFAULT_TIMEOUT = 5 * 60
+
+
+def _cache_timeout():
+    return getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _get_cached_data(etag):
+    try:
+        data = redis_connection().get(RESPONSE_CACHE_KEY.format(etag))
+    except redis.exceptions.ConnectionError:
+        return None
+    if data is None:
+        return None
+    return json.loads(data, object_pairs_hook=OrderedDict)
+
+
+def _set_cached_data(etag, data):
+    try:
+        redis_connection().setex(
+            RESPONSE_CACHE_KEY.format(etag), _cache_timeout(),
+            json.dumps(data, cls=JSONEncoder))
+    except (TypeError, ValueError):
+        logger.exception("Could not cache the response for %s" % etag)
+    except redis.exceptions.ConnectionError:
+        pass
+
+
+def etag_matches(etag, if_none_match):
+    """
+    True if 'etag' is listed in the 'If-None-Match' header
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return etag in parse_etags(if_none_match)
+
+
+class ResponseCacheMixin(object):
+
+    """
+    Cache the responses of 'list' and 'retrieve', per user.
+    Set 'cache_models' to every model the response is built from,
+    including those used by 'get_queryset' and by nested serializers.
+    (Nothing is cached when 'cache_models' is empty)
+    """
+    cache_models = None
+
+    def response_etag(self):
+        """
+        Returns the ETag of the current request
+        (Or None when the response can not be cached)
+        """
+        request = self.request
+        if not self.cache_models or request.method not in ('GET', 'HEAD'):
+            return None
+        if not getattr(settings, 'API_RESPONSE_CACHE', False):
+            return None
+        versions = get_model_versions(self.cache_models)
+        if versions is None:
+            return None
+        user = request.user
+        timeout = _cache_timeout()
+        renderer = getattr(request, 'accepted_renderer', None)
+        parts = [
+            self.__class__.__name__,
+            user.pk if user.is_authenticated() else 'anonymous',
+            request.get_host(),
+            request.get_full_path(),
+            renderer.format if renderer else '',
+            # Querysets also depend on the time (start and end dates)
+            int(time.time() // timeout),
+        ] + versions
+        return hashlib.md5(
+            ":".join(str(part) for part in parts)).hexdigest()
+
+    def _cached_response(self, view_method, request, *args, **kwargs):
+        etag = self.response_etag()
+        if not etag:
+            return view_method(request, *args, **kwargs)
+        if etag_matches(etag, self.request.META.get('HTTP_IF_NONE_MATCH')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = _get_cached_data(etag)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = view_method(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                _set_cached_data(etag, response.data)
+        response['ETag'] = quote_etag(etag)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(
+            super(ResponseCacheMixin, self).list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(
+            super(ResponseCacheMixin, self).retrieve,
+            request, *args, **kwargs)
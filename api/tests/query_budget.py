@@ -0,0 +1,57 @@
+"""
+Query-count budget for API tests.
+
+    class TagQueryTests(QueryBudgetMixin, APITestCase):
+        def test_tags_do_not_scale(self):
+            TagFactory.create_batch(10)
+            self.assertQueriesDoNotScale(reverse('api:v2:tag-list'))
+
+An endpoint 'scales' when serving more objects takes more queries,
+which is almost always an N+1 in a serializer.
+"""
+from api.profiling import is_scaling, profile_get, scaling_profiles
+
+
+class QueryBudgetMixin(object):
+
+    """
+    Assertions on the queries made by API requests (For APITestCase)
+    """
+    # Page sizes compared by 'assertQueriesDoNotScale'
+    small_page_size = 1
+    large_page_size = 5
+
+    def profile_page_sizes(self, url, user=None, page_sizes=None):
+        """
+        Returns a QueryProfile for each page size (Or None on errors)
+        """
+        if not page_sizes:
+            page_sizes = (self.small_page_size, self.large_page_size)
+        return scaling_profiles(url, page_sizes, user=user)
+
+    def assertQueriesDoNotScale(self, url, user=None, page_sizes=None):
+        """
+        Fail if the number of queries grows with the number of objects
+        """
+        profiles = self.profile_page_sizes(url, user, page_sizes)
+        self.assertIsNotNone(profiles, "GET %s failed" % url)
+        self.assertGreater(
+            profiles[-1].objects, profiles[0].objects,
+            "%s served %s objects on every page size, "
+            "create more objects to compare" % (url, profiles[0].objects))
+        self.assertFalse(
+            is_scaling(profiles),
+            "%s makes more queries for more objects (N+1):\n%s\n%s\n"
+            "Repeated statements: %s"
+            % (url, profiles[0], profiles[-1], profiles[-1].repeated.keys()))
+
+    def assertQueryBudget(self, url, budget, user=None, data=None):
+        """
+        Fail if GET 'url' makes more than 'budget' queries
+        """
+        response, profile = profile_get(url, user, data)
+        self.assertLessEqual(
+            profile.queries, budget,
+            "%s exceeded the query budget (%s): %s"
+            % (url, budget, profile))
+        return response
@@ -0,0 +1,97 @@
+"""
+tests for keyset (cursor) pagination
+"""
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+import json
+
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.pagination import StandardResultsSetPagination
+from api.tests.factories import UserFactory
+from core.models import AtmosphereUser
+
+
+class KeysetView(object):
+    cursor_ordering = ('-date_joined', '-id')
+
+
+class NullableKeysetView(object):
+    # 'last_login' is NULL until the first login
+    cursor_ordering = ('-last_login', '-id')
+
+
+class AscendingNullableKeysetView(object):
+    cursor_ordering = ('last_login', 'id')
+
+
+class TestKeysetPagination(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        # Three users share every 'date_joined'
+        self.users = [
+            UserFactory.create(date_joined=now - timedelta(hours=i // 3))
+            for i in range(10)]
+
+    def _get(self, url, view=None):
+        request = Request(APIRequestFactory().get(url))
+        paginator = StandardResultsSetPagination()
+        page = paginator.paginate_queryset(
+            AtmosphereUser.objects.all(), request, view or KeysetView())
+        return paginator.get_paginated_response([user.id for user in page])
+
+    def _all_pages(self, view):
+        seen = []
+        url = '/api/v2/users?cursor=&page_size=3'
+        while url:
+            response = self._get(url, view)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_pages_are_complete_and_ordered(self):
+        seen = []
+        url = '/api/v2/users?cursor=&page_size=4'
+        while url:
+            response = self._get(url)
+            self.assertNotIn('count', response.data)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+        expected = sorted(
+            self.users, key=lambda user: (user.date_joined, user.id),
+            reverse=True)
+        self.assertEquals(seen, [user.id for user in expected])
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(NotFound):
+            self._get('/api/v2/users?cursor=invalid')
+
+    def test_page_number_without_cursor(self):
+        response = self._get('/api/v2/users?page_size=4')
+        self.assertEquals(response.data['count'], len(self.users))
+
+    def test_null_keys(self):
+        # (Ordered as PostgreSQL does: NULLS FIRST when descending)
+        now = timezone.now()
+        for index, user in enumerate(self.users):
+            user.last_login = None if index % 2 else \
+                now - timedelta(hours=index // 4)
+            user.save()
+        never_logged_in = sorted(
+            [user.id for user in self.users if not user.last_login])
+        logged_in = [user.id for user in sorted(
+            [user for user in self.users if user.last_login],
+            key=lambda user: (user.last_login, user.id))]
+        self.assertEquals(self._all_pages(NullableKeysetView()),
+                          never_logged_in[::-1] + logged_in[::-1])
+        self.assertEquals(self._all_pages(AscendingNullableKeysetView()),
+                          logged_in + never_logged_in)
+
+    def test_null_key_in_cursor(self):
+        with self.assertRaises(NotFound):
+            self._get('/api/v2/users?cursor=%s' % urlsafe_b64encode(
+                json.dumps([None, 1])))
@@ -0,0 +1,85 @@
+"""
+tests for the API response cache (ETags and conditional GETs)
+"""
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from rest_framework.response import Response
+
+from api.response_cache import ResponseCacheMixin, etag_matches
+from api.tests.factories import UserFactory
+
+
+class BaseView(object):
+    def list(self, request, *args, **kwargs):
+        self.calls += 1
+        return Response([{"id": 1}])
+
+
+class CachedView(ResponseCacheMixin, BaseView):
+    cache_models = (mock.Mock(),)
+
+    def __init__(self, request):
+        self.request = request
+        self.calls = 0
+
+
+@override_settings(API_RESPONSE_CACHE=True)
+@mock.patch('api.response_cache.get_model_versions', return_value=[1])
+@mock.patch('api.response_cache._set_cached_data')
+@mock.patch('api.response_cache._get_cached_data', return_value=None)
+class TestResponseCacheMixin(TestCase):
+    def setUp(self):
+        self.request = mock.Mock()
+        self.request.method = 'GET'
+        self.request.user = UserFactory.create()
+        self.request.get_host.return_value = 'localhost'
+        self.request.get_full_path.return_value = '/api/v2/tags'
+        self.request.accepted_renderer.format = 'json'
+        self.request.META = {}
+
+    def test_response_has_etag(self, get_cached, set_cached, versions):
+        view = CachedView(self.request)
+        response = view.list(self.request)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertEquals(view.calls, 1)
+        self.assertTrue(set_cached.called)
+
+    def test_matching_etag_is_not_modified(
+            self, get_cached, set_cached, versions):
+        view = CachedView(self.request)
+        etag = view.list(self.request)['ETag']
+        self.request.META = {'HTTP_IF_NONE_MATCH': etag}
+        response = view.list(self.request)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(view.calls, 1)
+
+    def test_new_version_changes_etag(
+            self, get_cached, set_cached, versions):
+        view = CachedView(self.request)
+        etag = view.list(self.request)['ETag']
+        versions.return_value = [2]
+        self.request.META = {'HTTP_IF_NONE_MATCH': etag}
+        response = view.list(self.request)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEquals(view.calls, 2)
+
+    def test_cached_data_is_not_serialized(
+            self, get_cached, set_cached, versions):
+        get_cached.return_value = [{"id": 1}]
+        view = CachedView(self.request)
+        response = view.list(self.request)
+        self.assertEquals(response.data, [{"id": 1}])
+        self.assertEquals(view.calls, 0)
+
+
+class TestEtagMatches(TestCase):
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('abc', '"abc"'))
+        self.assertTrue(etag_matches('abc', '"xyz", "abc"'))
+        self.assertTrue(etag_matches('abc', '*'))
+        self.assertFalse(etag_matches('abc', '"xyz"'))
+        self.assertFalse(etag_matches('abc', None))
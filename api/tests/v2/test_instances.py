@@ -0,0 +1,129 @@
+from datetime import timedelta
+
+import mock
+
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase, APIRequestFactory,\
+    force_authenticate
+
+from api.tests.factories import UserFactory, GroupFactory, ProviderFactory,\
+    IdentityFactory, IdentityMembershipFactory, QuotaFactory,\
+    AllocationFactory, LeadershipFactory
+from api.tests.query_budget import QueryBudgetMixin
+from api.v2.serializers.details import InstanceSerializer
+from core.models import Application, ApplicationVersion, Instance,\
+    InstanceSource, InstanceStatus, InstanceStatusHistory, ProviderMachine,\
+    Size
+from core.models.instance import with_last_history
+
+
+class InstanceTestData(object):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = UserFactory.create()
+        self.group = GroupFactory.create(name=self.user.username)
+        LeadershipFactory.create(user=self.user, group=self.group)
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider, created_by=self.user)
+        IdentityMembershipFactory.create(
+            member=self.group, identity=self.identity,
+            quota=QuotaFactory.create(),
+            allocation=AllocationFactory.create())
+        self.application = Application.objects.create(
+            name="Ubuntu", created_by=self.user,
+            created_by_identity=self.identity)
+        self.version = ApplicationVersion.objects.create(
+            application=self.application, name="1.0", created_by=self.user,
+            created_by_identity=self.identity)
+        self.tiny = self._size("1", "tiny")
+        self.small = self._size("2", "small")
+
+    def _size(self, alias, name):
+        return Size.objects.create(
+            alias=alias, name=name, provider=self.provider,
+            cpu=1, disk=0, root=0, mem=512)
+
+    def _instance(self, alias, histories=None):
+        """
+        Create an instance with 'histories': [(status, activity, size), ..]
+        (oldest first)
+        """
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier="image-%s" % alias,
+            created_by=self.user, created_by_identity=self.identity)
+        ProviderMachine.objects.create(
+            instance_source=source, application_version=self.version)
+        instance = Instance.objects.create(
+            name=alias, provider_alias=alias, source=source,
+            created_by=self.user, created_by_identity=self.identity,
+            start_date=self.now - timedelta(hours=2))
+        start_date = instance.start_date
+        for status_name, activity, size in histories or []:
+            InstanceStatusHistory.objects.create(
+                instance=instance, size=size, activity=activity,
+                status=InstanceStatus.objects.get_or_create(
+                    name=status_name)[0],
+                start_date=start_date)
+            start_date += timedelta(minutes=10)
+        return instance
+
+
+class InstanceListQueryTests(InstanceTestData, QueryBudgetMixin,
+                             APITestCase):
+
+    def test_instances_do_not_scale(self):
+        for idx in range(self.large_page_size):
+            self._instance("vm-%s" % idx, [
+                ("build", "spawning", self.tiny),
+                ("active", None, self.small)])
+        self.assertQueriesDoNotScale(
+            reverse('api:v2:instance-list'), user=self.user)
+
+
+class InstanceSerializerTests(InstanceTestData, APITestCase):
+
+    def setUp(self):
+        super(InstanceSerializerTests, self).setUp()
+        request = APIRequestFactory().get(reverse('api:v2:instance-list'))
+        force_authenticate(request, user=self.user)
+        self.serializer = InstanceSerializer(context={'request': request})
+
+    def _annotated(self, instance):
+        return with_last_history(Instance.objects.filter(id=instance.id))[0]
+
+    def test_annotated_last_history(self):
+        instance = self._annotated(self._instance("vm-1", [
+            ("active", None, self.tiny),
+            ("suspended", "suspending", self.small)]))
+        with mock.patch.object(Instance, 'get_last_history') as last_history:
+            self.assertEquals(
+                self.serializer.get_status(instance), "suspended")
+            self.assertEquals(
+                self.serializer.get_activity(instance), "suspending")
+            self.assertEquals(
+                self.serializer.get_size(instance)['alias'], "2")
+            self.assertEquals(
+                self.serializer.get_ip_address(instance), "0.0.0.0")
+        self.assertFalse(last_history.called)
+
+    def test_live_instance(self):
+        instance = self._annotated(self._instance("vm-1", [
+            ("active", None, self.tiny)]))
+        instance.esh = mock.Mock()
+        instance.esh.get_status.return_value = "active - networking"
+        self.assertEquals(
+            self.serializer.get_status(instance), "active - networking")
+        self.assertEquals(
+            self.serializer.get_activity(instance), "networking")
+        self.assertEquals(self.serializer.get_size(instance)['alias'], "1")
+
+    def test_instance_without_history(self):
+        instance = self._annotated(self._instance("vm-1"))
+        self.assertEquals(instance.last_status, None)
+        # Falls back to get_last_history, which records an 'Unknown' one.
+        self.assertEquals(self.serializer.get_status(instance), "Unknown")
+        self.assertEquals(
+            self.serializer.get_size(instance)['alias'], "N/A")
@@ -0,0 +1,34 @@
+from rest_framework.test import APITestCase
+from api.tests.factories import (
+    UserFactory, GroupFactory, TagFactory, ProviderTypeFactory,
+    PlatformTypeFactory)
+from api.tests.query_budget import QueryBudgetMixin
+from django.core.urlresolvers import reverse
+
+
+class ListQueryBudgetTests(QueryBudgetMixin, APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.group = GroupFactory.create(name=self.user.username)
+        self.staff_user = UserFactory.create(is_staff=True)
+
+    def test_tags_do_not_scale(self):
+        TagFactory.create_batch(self.large_page_size)
+        self.assertQueriesDoNotScale(reverse('api:v2:tag-list'))
+
+    def test_users_do_not_scale(self):
+        UserFactory.create_batch(self.large_page_size)
+        self.assertQueriesDoNotScale(
+            reverse('api:v2:atmosphereuser-list'), user=self.staff_user)
+
+    def test_provider_types_do_not_scale(self):
+        ProviderTypeFactory.create_batch(self.large_page_size)
+        self.assertQueriesDoNotScale(
+            reverse('api:v2:providertype-list'), user=self.user)
+
+    def test_platform_types_do_not_scale(self):
+        for idx in range(self.large_page_size):
+            PlatformTypeFactory.create(name="platform-%s" % idx)
+        self.assertQueriesDoNotScale(
+            reverse('api:v2:platformtype-list'), user=self.user)
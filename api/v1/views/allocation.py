@@ -6,8 +6,9 @@ from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
 from rest_framework import status
 
-from core.models import Allocation, AllocationStrategy
+from core.models import Allocation
 from core.query import only_active_memberships
+from service.monitoring import get_allocation_result
 
 from api.v1.serializers import AllocationSerializer, AllocationResultSerializer
 from api.v1.views.base import AuthAPIView
@@ -98,11 +99,8 @@ class MonitoringList(AuthAPIView):
         allocation_results = []
         memberships = only_active_memberships(user)
         for membership in memberships:
-            strat = AllocationStrategy.objects.get(
-                provider=membership.identity.provider)
-            allocation_result = strat.execute(
-                membership.identity, membership.allocation)
-            allocation_results.append(allocation_result)
+            allocation_results.append(
+                get_allocation_result(membership.identity))
         serialized_data = AllocationResultSerializer(
             allocation_results, many=True).data
         return Response(serialized_data)
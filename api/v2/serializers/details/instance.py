@@ -1,4 +1,5 @@
-from core.models import BootScript, Instance, Application as Image
+from core.models import BootScript, Instance, Size
+from core.models.instance import prefetch_last_size
 from rest_framework import serializers
 from api.v2.serializers.fields import ModelRelatedField
 from api.v2.serializers.summaries import (
@@ -13,12 +14,26 @@ from api.v2.serializers.summaries import (
 from api.v2.serializers.fields.base import UUIDHyperlinkedIdentityField
 
 
+class InstanceListSerializer(serializers.ListSerializer):
+
+    """
+    Load the sizes of every instance in the list with one query
+    (See 'core.models.instance.with_last_history')
+    """
+
+    def to_representation(self, data):
+        if hasattr(data, 'all'):
+            data = data.all()
+        return super(InstanceListSerializer, self).to_representation(
+            prefetch_last_size(data))
+
+
 class InstanceSerializer(serializers.HyperlinkedModelSerializer):
     identity = IdentitySummarySerializer(source='created_by_identity')
     user = UserSummarySerializer(source='created_by')
     provider = ProviderSummarySerializer(source='created_by_identity.provider')
-    status = serializers.CharField(source='esh_status', read_only=True)
-    activity = serializers.CharField(source='esh_activity', read_only=True)
+    status = serializers.SerializerMethodField()
+    activity = serializers.SerializerMethodField()
     projects = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     scripts = ModelRelatedField(
         many=True, required=False,
@@ -35,19 +50,42 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
         uuid_field='provider_alias'
     )
 
+    def _has_last_history(self, obj):
+        """
+        True when 'obj' was annotated with its last history
+        (and there is no live 'esh' status to prefer)
+        """
+        return not obj.esh and getattr(obj, 'last_status', None) is not None
+
+    def get_status(self, obj):
+        if self._has_last_history(obj):
+            return obj.last_status
+        return obj.esh_status()
+
+    def get_activity(self, obj):
+        if self._has_last_history(obj):
+            return obj.last_activity
+        return obj.esh_activity()
+
     def get_size(self, obj):
-        size = obj.get_size()
+        if not self._has_last_history(obj):
+            size = obj.get_size()
+        elif hasattr(obj, 'last_size'):
+            size = obj.last_size
+        elif obj.last_size_id:
+            size = Size.objects.get(id=obj.last_size_id)
+        else:
+            size = None
         serializer = SizeSummarySerializer(size, context=self.context)
         return serializer.data
 
     def get_image(self, obj):
-        image_uuid = obj.application_uuid()
-        image = Image.objects.get(uuid=image_uuid)
+        image = obj.source.providermachine.application_version.application
         serializer = ImageSummarySerializer(image, context=self.context)
         return serializer.data
 
     def get_ip_address(self, obj):
-        status = obj.esh_status()
+        status = self.get_status(obj)
         if status in ["suspended", "shutoff", "shelved"]:
             return "0.0.0.0"
         return obj.ip_address
@@ -61,6 +99,7 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Instance
+        list_serializer_class = InstanceListSerializer
         fields = (
             'id',
             'uuid',
@@ -14,6 +14,7 @@ from api.permissions import (
         ApiAuthOptional, ApiAuthRequired, EnabledUserRequired,
         InMaintenance, CloudAdminRequired
     )
+from api.response_cache import ResponseCacheMixin
 from api.v2.views.mixins import MultipleFieldLookup
 
 
@@ -39,7 +40,7 @@ def unresolved_requests_only(fn):
     return wrapper
 
 
-class AuthViewSet(ModelViewSet):
+class AuthViewSet(ResponseCacheMixin, ModelViewSet):
     http_method_names = ['get', 'put', 'patch', 'post',
                          'delete', 'head', 'options', 'trace']
     permission_classes = (InMaintenance,
@@ -54,13 +55,13 @@ class AdminAuthViewSet(AuthViewSet):
                           ApiAuthRequired,)
 
 
-class AuthOptionalViewSet(ModelViewSet):
+class AuthOptionalViewSet(ResponseCacheMixin, ModelViewSet):
 
     permission_classes = (InMaintenance,
                           ApiAuthOptional,)
 
 
-class AuthReadOnlyViewSet(ReadOnlyModelViewSet):
+class AuthReadOnlyViewSet(ResponseCacheMixin, ReadOnlyModelViewSet):
 
     permission_classes = (InMaintenance,
                           ApiAuthOptional,)
@@ -6,7 +6,10 @@ from api.v2.serializers.details import ImageSerializer
 from api.v2.views.base import AuthOptionalViewSet
 from api.v2.views.mixins import MultipleFieldLookup
 
-from core.models import Application as Image
+from core.models import (
+    Application as Image, ApplicationBookmark, ApplicationCatalogEntry,
+    ApplicationMembership, ApplicationVersion, AtmosphereUser, Group,
+    Identity, IdentityMembership, Provider, Tag)
 
 
 class ImageFilter(filters.FilterSet):
@@ -51,6 +54,10 @@ class ImageViewSet(MultipleFieldLookup, AuthOptionalViewSet):
                           permissions.ApplicationMemberOrReadOnly)
 
     serializer_class = ImageSerializer
+    # 'current_apps' depends on the groups and providers of the user
+    cache_models = (Image, ApplicationBookmark, ApplicationCatalogEntry,
+                    ApplicationMembership, ApplicationVersion, AtmosphereUser,
+                    Group, Identity, IdentityMembership, Provider, Tag)
     filter_backends = (filters.DjangoFilterBackend, filters.SearchFilter, BookmarkedFilterBackend)
     filter_class = ImageFilter
     search_fields = ('id', 'name', 'versions__change_log', 'tags__name',
@@ -7,7 +7,7 @@ from api.v2.views.instance_action import InstanceActionViewSet
 from core.exceptions import ProviderNotActive
 from core.models import Instance, Identity
 from core.models.boot_script import _save_scripts_to_instance
-from core.models.instance import find_instance
+from core.models.instance import find_instance, with_last_history
 from core.models.instance_action import InstanceAction
 from core.query import only_current
 
@@ -46,6 +46,8 @@ class InstanceViewSet(MultipleFieldLookup, AuthViewSet):
     serializer_class = InstanceSerializer
     filter_fields = ('created_by__id', 'projects')
     lookup_fields = ("id", "provider_alias")
+    # Newest first, when paged with a 'cursor'
+    cursor_ordering = ('-start_date', '-id')
     http_method_names = ['get', 'put', 'patch', 'post',
                          'delete', 'head', 'options', 'trace']
 
@@ -63,6 +65,11 @@ class InstanceViewSet(MultipleFieldLookup, AuthViewSet):
         user = self.request.user
         identity_ids = user.current_identities.values_list('id', flat=True)
         qs = Instance.objects.filter(created_by_identity__in=identity_ids)
+        # Everything InstanceSerializer needs, without a query per instance
+        qs = with_last_history(qs).select_related(
+            'created_by', 'created_by_identity__provider',
+            'source__providermachine__application_version__application',
+        ).prefetch_related('projects', 'scripts')
         if 'archived' in self.request.query_params:
             return qs
         return qs.filter(only_current())
@@ -38,6 +38,8 @@ class InstanceStatusHistoryViewSet(MultipleFieldLookup, AuthReadOnlyViewSet):
     serializer_class = InstanceStatusHistorySerializer
     ordering = ('-instance__start_date', 'instance__id')
     ordering_fields = ('-instance__start_date', '-start_date', 'instance__id')
+    # Newest first, when paged with a 'cursor'
+    cursor_ordering = ('-start_date', '-id')
     lookup_fields = ("id", "uuid")
     filter_class = InstanceStatusHistoryFilter
     filter_backends = (filters.OrderingFilter, filters.DjangoFilterBackend)
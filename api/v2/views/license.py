@@ -2,7 +2,7 @@ from api import permissions
 from api.v2.serializers.details import LicenseSerializer
 from api.v2.views.base import AuthViewSet
 from api.v2.views.mixins import MultipleFieldLookup
-from core.models import License
+from core.models import AtmosphereUser, License, LicenseType
 
 
 class LicenseViewSet(MultipleFieldLookup, AuthViewSet):
@@ -14,6 +14,7 @@ class LicenseViewSet(MultipleFieldLookup, AuthViewSet):
     queryset = License.objects.none()
     permission_classes = (permissions.CanEditOrReadOnly,)
     serializer_class = LicenseSerializer
+    cache_models = (AtmosphereUser, License, LicenseType)
     filter_fields = ('title',)
     search_fields = ('^title',)
     lookup_fields = ("id", "uuid")
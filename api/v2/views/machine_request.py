@@ -29,6 +29,8 @@ class MachineRequestViewSet(BaseRequestViewSet):
     filter_fields = ('status__id', 'status__name', 'new_machine_owner__username')
     ordering_fields = ('start_date', 'end_date', 'new_machine_owner__username')
     ordering = ('-start_date',)
+    # Newest first, when paged with a 'cursor'
+    cursor_ordering = ('-start_date', '-id')
 
     def get_queryset(self):
         if 'active' in self.request.query_params:
@@ -2,7 +2,9 @@ from django.contrib.auth.models import AnonymousUser
 from rest_framework.decorators import detail_route
 from rest_framework import viewsets
 
-from core.models import Provider, Group
+from core.models import (
+    AtmosphereUser, Group, Identity, IdentityMembership, PlatformType,
+    Provider, ProviderType, Size)
 from core.query import only_current_provider, only_current
 
 from api.permissions import CloudAdminRequired
@@ -19,6 +21,8 @@ class ProviderViewSet(MultipleFieldLookup, AuthReadOnlyViewSet):
     lookup_fields = ("id", "uuid")
     queryset = Provider.objects.all()
     serializer_class = ProviderSerializer
+    cache_models = (AtmosphereUser, Group, Identity, IdentityMembership,
+                    PlatformType, Provider, ProviderType, Size)
     http_method_names = ['get', 'head', 'options', 'trace']
 
 
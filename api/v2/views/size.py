@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AnonymousUser
 
-from core.models import Group, Size, Provider
+from core.models import (
+    Group, Identity, IdentityMembership, Size, Provider)
 from core.query import only_current, only_current_provider
 
 from api.v2.serializers.details import SizeSerializer
@@ -15,6 +16,7 @@ class SizeViewSet(MultipleFieldLookup, AuthReadOnlyViewSet):
     lookup_fields = ("id", "uuid")
     queryset = Size.objects.all()
     serializer_class = SizeSerializer
+    cache_models = (Group, Identity, IdentityMembership, Provider, Size)
     ordering = ("cpu", "mem", "disk", "root", "name")
     filter_fields = ('provider__id',)
 
@@ -17,6 +17,7 @@ class TagViewSet(MultipleFieldLookup, AuthOptionalViewSet):
     lookup_fields = ("id", "uuid")
     queryset = Tag.objects.all()
     serializer_class = TagSummarySerializer
+    cache_models = (Tag,)
 
     def perform_create(self, serializer):
         same_name_tags = Tag.objects.filter(
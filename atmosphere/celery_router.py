@@ -21,7 +21,8 @@ class PredeclareRouter(object):
             for queue in queues.itervalues():
                 queue(channel).declare()
 DEPLOY_TASKS = [
-    "_deploy_init_to", "service.tasks.driver._deploy_init_to"
+    "_deploy_init_to", "service.tasks.driver._deploy_init_to",
+    "deploy_batch", "service.tasks.driver.deploy_batch"
 ]
 EMAIL_TASKS = [
     "send_email", "core.tasks.email.send_email",
@@ -42,18 +43,22 @@ IMAGING_TASKS = [
 ]
 PERIODIC_TASKS = [
     "monitor_sizes", "monitor_sizes_for",
+    "refresh_project_directories", "refresh_project_directory_for",
     "monitor_machines", "monitor_machines_for",
     "monitor_instances", "monitor_instances_for",
+    "monitor_instances_for_users", "monitor_instances_summary",
     "prune_machines", "prune_machines_for",
     "check_image_membership", "update_membership_for",
-    "clear_empty_ips", "clear_empty_ips_for",
+    "clear_empty_ips", "clear_empty_ips_for", "clear_empty_ips_for_provider",
     "remove_empty_networks_for",
     "reset_provider_allocation",
+    "rebuild_usage_rollups", "rebuild_usage_rollups_for",
+    "rebuild_application_catalog",
     "monthly_allocation_reset"
 
 ]
 SHORT_TASKS = [
-    "wait_for_instance", "deploy_ready_test"
+    "wait_for_instance", "watch_instances_for", "deploy_ready_test"
 ]
 
 
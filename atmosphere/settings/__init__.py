@@ -53,7 +53,7 @@ MANAGERS = ADMINS
 DATABASES = {
     'default': {
         'NAME': 'atmosphere',
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'transaction_hooks.backends.postgresql_psycopg2',
         'USER': 'atmo_app',
         'PASSWORD': 'atmosphere',
         'HOST': 'localhost',
@@ -129,8 +129,19 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'atmosphere.slash_middleware.RemoveSlashMiddleware',
+    # Disabled unless API_QUERY_PROFILING is set
+    'api.profiling.QueryProfileMiddleware',
 )
 
+# api.profiling: Record SQL count/time (and suspected N+1) per API request
+API_QUERY_PROFILING = False
+API_QUERY_PROFILING_PATHS = ['/api/v2']
+# Requests making more queries than this are logged as a warning
+API_QUERY_BUDGET = 50
+# api.response_cache: ETags and shared (redis) responses for 'cache_models'
+API_RESPONSE_CACHE = True
+API_RESPONSE_CACHE_TIMEOUT = 5 * 60
+
 ROOT_URLCONF = 'atmosphere.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
@@ -391,6 +402,41 @@ djcelery.setup_loader()
 # Related to Celerybeat
 CELERYBEAT_CHDIR = PROJECT_ROOT
 
+# monitor_instances_for: Users per shard, and processes used
+# when monitor_instances_for is called directly (Not as a task)
+MONITOR_INSTANCES_CHUNK_SIZE = 25
+MONITOR_INSTANCES_PROCESSES = 4
+
+# AccountDriver: Concurrent requests to the cloud (See service.accounts.executor)
+ACCOUNT_DRIVER_WORKERS = 8
+# Requests per second, per provider (and process). None for no limit.
+ACCOUNT_DRIVER_RATE_LIMIT = None
+# Retries of transient errors, with an exponential backoff (seconds)
+ACCOUNT_DRIVER_RETRIES = 3
+ACCOUNT_DRIVER_BACKOFF = 1.0
+
+# wait_for_instance: Poll the instances of each provider once per interval
+# (seconds), instead of once per instance. See service.instance_watcher
+INSTANCE_WATCHER = True
+INSTANCE_WATCHER_INTERVAL = 15
+
+# _deploy_init_to: Deploy to the instances that become ready within
+# ANSIBLE_DEPLOY_BATCH_WINDOW seconds with one playbook run (Up to
+# ANSIBLE_DEPLOY_BATCH_SIZE instances, ANSIBLE_FORKS at a time)
+# See service.deploy_batch
+ANSIBLE_DEPLOY_BATCH = False
+ANSIBLE_DEPLOY_BATCH_WINDOW = 30
+ANSIBLE_DEPLOY_BATCH_SIZE = 50
+ANSIBLE_FORKS = 20
+
+# wait_for_instance/deploy_ready_test retries. See service.retry_policy
+# {task_name: {delay, factor, max_delay, max_wait, jitter}}
+TASK_RETRY_POLICIES = {}
+# Wait for this percentile of the (recorded) ready times of an image
+READY_TIME_PERCENTILE = 50
+# Spread out the retries of a provider beyond this many in flight
+TASK_RETRIES_IN_FLIGHT = 200
+
 CELERYBEAT_SCHEDULE = {
     "check_image_membership": {
         "task": "check_image_membership",
@@ -415,6 +461,11 @@ CELERYBEAT_SCHEDULE = {
         "schedule": timedelta(minutes=30),
         "options": {"expires": 10 * 60, "time_limit": 10 * 60}
     },
+    "refresh_project_directories": {
+        "task": "refresh_project_directories",
+        "schedule": timedelta(minutes=15),
+        "options": {"expires": 10 * 60, "time_limit": 10 * 60}
+    },
     "monitor_instance_allocations": {
         "task": "monitor_instance_allocations",
         "schedule": timedelta(minutes=15),
@@ -425,6 +476,22 @@ CELERYBEAT_SCHEDULE = {
         "schedule": timedelta(minutes=15),
         "options": {"expires": 10 * 60, "time_limit": 10 * 60}
     },
+    "rebuild_usage_rollups": {
+        "task": "rebuild_usage_rollups",
+        "schedule": timedelta(minutes=60),
+        "options": {"expires": 10 * 60, "time_limit": 10 * 60}
+    },
+    "rebuild_application_catalog": {
+        "task": "rebuild_application_catalog",
+        "schedule": timedelta(minutes=30),
+        "options": {"expires": 10 * 60, "time_limit": 10 * 60}
+    },
+    "deploy_batch": {
+        "task": "deploy_batch",
+        # Put back the deployments of batches that did not finish
+        "schedule": timedelta(minutes=30),
+        "options": {"expires": 10 * 60}
+    },
     "clear_empty_ips": {
         "task": "clear_empty_ips",
         "schedule": timedelta(minutes=120),
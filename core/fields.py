@@ -88,3 +88,36 @@ class VersionNumberField(models.Field):
     def value_to_string(self, obj):
         value = self._get_val_from_obj(obj)
         return self.get_prep_value(value)
+
+
+# Text search configuration used for every tsvector/tsquery
+SEARCH_CONFIG = 'simple'
+
+
+class TSVectorField(models.Field):
+
+    """
+    A PostgreSQL text search document (tsvector).
+    Written with raw SQL (to_tsvector), searched with the 'matches' lookup:
+        queryset.filter(document__matches="ubuntu:* & desktop:*")
+    """
+
+    def db_type(self, connection):
+        return 'tsvector'
+
+
+class TSQueryMatch(models.Lookup):
+
+    """
+    document @@ to_tsquery(SEARCH_CONFIG, value)
+    """
+    lookup_name = 'matches'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        params = lhs_params + [SEARCH_CONFIG] + rhs_params
+        return "%s @@ to_tsquery(%%s, %s)" % (lhs, rhs), params
+
+
+TSVectorField.register_lookup(TSQueryMatch)
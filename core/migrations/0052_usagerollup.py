@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0051_non_null_key_instance_action'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('window_start', models.DateTimeField()),
+                ('window_end', models.DateTimeField(null=True, blank=True)),
+                ('credit', models.FloatField()),
+                ('used', models.FloatField()),
+                ('remaining', models.FloatField()),
+                ('burn_rate', models.FloatField()),
+                ('calculated_at', models.DateTimeField()),
+                ('dirty', models.BooleanField(default=False)),
+                ('identity', models.ForeignKey(related_name='usage_rollups', to='core.Identity')),
+            ],
+            options={
+                'db_table': 'usage_rollup',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='usagerollup',
+            unique_together=set([('identity', 'window_start')]),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def build_catalog(apps, schema_editor):
+    from core.models.application_catalog import MACHINE_FIELDS, catalog_rows
+    ApplicationCatalogEntry = apps.get_model("core", "ApplicationCatalogEntry")
+    ProviderMachine = apps.get_model("core", "ProviderMachine")
+    ProviderMachineMembership = apps.get_model(
+        "core", "ProviderMachineMembership")
+    ApplicationVersionMembership = apps.get_model(
+        "core", "ApplicationVersionMembership")
+    rows = catalog_rows(
+        ProviderMachine.objects.values_list(*MACHINE_FIELDS),
+        ProviderMachineMembership.objects.values_list(
+            'provider_machine', 'group'),
+        ApplicationVersionMembership.objects.values_list(
+            'image_version', 'group'))
+    ApplicationCatalogEntry.objects.bulk_create([
+        ApplicationCatalogEntry(
+            application_id=app_id, provider_id=provider_id,
+            group_id=group_id, public=public, current=current)
+        for (app_id, provider_id, group_id, public, current, _) in rows],
+        batch_size=1000)
+
+
+def clear_catalog(apps, schema_editor):
+    ApplicationCatalogEntry = apps.get_model("core", "ApplicationCatalogEntry")
+    ApplicationCatalogEntry.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0052_usagerollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationCatalogEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('public', models.BooleanField(default=False)),
+                ('current', models.BooleanField(default=False)),
+                ('application', models.ForeignKey(related_name='catalog_entries', to='core.Application')),
+                ('group', models.ForeignKey(related_name='catalog_entries', blank=True, to='core.Group', null=True)),
+                ('provider', models.ForeignKey(related_name='catalog_entries', to='core.Provider')),
+            ],
+            options={
+                'db_table': 'application_catalog',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='applicationcatalogentry',
+            unique_together=set([('application', 'provider', 'group')]),
+        ),
+        migrations.RunPython(build_catalog, clear_catalog),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import core.fields
+
+
+def build_search_documents(apps, schema_editor):
+    from core.models.application_search import rebuild_search_documents
+    rebuild_search_documents()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0053_applicationcatalogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationSearchDocument',
+            fields=[
+                ('application', models.OneToOneField(related_name='search_document', primary_key=True, serialize=False, to='core.Application')),
+                ('document', core.fields.TSVectorField(null=True)),
+            ],
+            options={
+                'db_table': 'application_search',
+            },
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX application_search_document_gin "
+            "ON application_search USING gin(document);",
+            "DROP INDEX application_search_document_gin;"),
+        migrations.RunPython(
+            build_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0054_applicationsearchdocument'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='instance',
+            index_together=set([('start_date', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='instancestatushistory',
+            index_together=set([('start_date', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='machinerequest',
+            index_together=set([('start_date', 'id')]),
+        ),
+    ]
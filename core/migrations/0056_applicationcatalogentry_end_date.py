@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def rebuild_catalog(apps, schema_editor):
+    from core.models.application_catalog import MACHINE_FIELDS, catalog_rows
+    ApplicationCatalogEntry = apps.get_model("core", "ApplicationCatalogEntry")
+    ProviderMachine = apps.get_model("core", "ProviderMachine")
+    ProviderMachineMembership = apps.get_model(
+        "core", "ProviderMachineMembership")
+    ApplicationVersionMembership = apps.get_model(
+        "core", "ApplicationVersionMembership")
+    rows = catalog_rows(
+        ProviderMachine.objects.values_list(*MACHINE_FIELDS),
+        ProviderMachineMembership.objects.values_list(
+            'provider_machine', 'group'),
+        ApplicationVersionMembership.objects.values_list(
+            'image_version', 'group'))
+    ApplicationCatalogEntry.objects.all().delete()
+    ApplicationCatalogEntry.objects.bulk_create([
+        ApplicationCatalogEntry(
+            application_id=app_id, provider_id=provider_id,
+            group_id=group_id, public=public, current=current,
+            end_date=end_date)
+        for (app_id, provider_id, group_id, public, current, end_date)
+        in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0055_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationcatalogentry',
+            name='end_date',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+        migrations.RunPython(rebuild_catalog, migrations.RunPython.noop),
+    ]
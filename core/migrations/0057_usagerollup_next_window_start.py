@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def mark_rollups_dirty(apps, schema_editor):
+    # Existing rollups do not know when their window ends.
+    UsageRollup = apps.get_model("core", "UsageRollup")
+    UsageRollup.objects.update(dirty=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0056_applicationcatalogentry_end_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagerollup',
+            name='next_window_start',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+        migrations.RunPython(mark_rollups_dirty, migrations.RunPython.noop),
+    ]
@@ -29,6 +29,8 @@ from core.models.provider import (
 )
 from core.models.license import LicenseType, License, ApplicationVersionLicense
 from core.models.machine import ProviderMachine, ProviderMachineMembership
+from core.models.application_catalog import ApplicationCatalogEntry
+from core.models.application_search import ApplicationSearchDocument
 from core.models.machine_request import MachineRequest
 from core.models.match import PatternMatch, MatchType
 from core.models.maintenance import MaintenanceRecord
@@ -45,6 +47,9 @@ from core.models.status_type import StatusType
 from core.models.t import T
 from core.models.tag import Tag
 from core.models.template import (EmailTemplate, HelpLink)
+from core.models.usage_rollup import UsageRollup
 from core.models.user import AtmosphereUser
 from core.models.volume import Volume
 from core.models.ssh_key import SSHKey
+# Attach the version counter hooks (See 'core.models.model_version')
+import core.models.model_version
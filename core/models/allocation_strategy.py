@@ -161,13 +161,11 @@ class AllocationStrategy(models.Model):
         one_month = relativedelta(months=1)
         monthiversary = timezone.datetime(
             now.year, now.month, user_join.day, tzinfo=timezone.utc)
-        start_month = monthiversary \
-            if user_join.day > now.day \
-            else monthiversary - one_month
+        # Until this month's 'monthiversary', the window started last month
         if user_join.day > now.day:
-            start_month = monthiversary
-        else:
             start_month = monthiversary - one_month
+        else:
+            start_month = monthiversary
         next_month = start_month + one_month
         return FixedWindow(start_month, next_month)
 
@@ -179,6 +177,21 @@ class AllocationStrategy(models.Model):
         next_month = first_month + relativedelta(months=1)
         return FixedWindow(first_month, now)
 
+    def get_next_window_start(self, identity, now=None):
+        """
+        Returns when the counting window of 'identity' (as of 'now') ends,
+        and the next one starts. (Or None, if it never ends)
+        """
+        counting_behavior = self._parse_counting_behavior(identity, now)
+        if not counting_behavior:
+            return None
+        try:
+            if self.counting_behavior.name == "Count all time":
+                return None
+        except CountingBehavior.DoesNotExist:
+            pass
+        return counting_behavior.start_date + relativedelta(months=1)
+
     def _parse_rules_behaviors(self):
         rule_behaviors = []
         for rb in self.rules_behaviors.all():
@@ -232,7 +245,8 @@ class AllocationStrategy(models.Model):
                                           tzinfo=timezone.utc)
         return OneTimeRefresh(increase_date)
 
-    def apply(self, identity, core_allocation):
+    def apply(self, identity, core_allocation, checkpoint=None,
+              core_instances=None):
         """
         Create an allocation.models.allocationstrategy
         """
@@ -242,7 +256,8 @@ class AllocationStrategy(models.Model):
         rules_behaviors = self._parse_rules_behaviors()
         new_strategy = PythonAllocationStrategy(
             counting_behavior, refresh_behaviors, rules_behaviors)
-        return new_strategy.apply(identity, core_allocation)
+        return new_strategy.apply(
+            identity, core_allocation, checkpoint, core_instances)
 
     def execute(self, identity, core_allocation):
         from allocation.engine import calculate_allocation
@@ -10,7 +10,7 @@ from threepio import logger
 
 from atmosphere import settings
 
-from core.query import only_current, only_current_apps, only_current_source, in_provider_list
+from core.query import only_current, only_current_apps, only_current_source
 from core.models.provider import Provider, AccountProvider
 from core.models.identity import Identity
 from core.models.tag import Tag, updateTags
@@ -112,23 +112,24 @@ class Application(models.Model):
 
     @classmethod
     def current_apps(cls, atmo_user=None):
+        """
+        Applications that can be listed by 'atmo_user'.
+        Read from the (precomputed) ApplicationCatalogEntry index,
+        see 'public_apps', 'shared_with' and 'admin_apps' for the rules.
+        """
+        from core.models.application_catalog import ApplicationCatalogEntry
         from core.models.user import AtmosphereUser
-        public_images = Application.public_apps()
         if not atmo_user or isinstance(atmo_user, AnonymousUser):
-            return public_images.distinct()
-        if not isinstance(atmo_user, AtmosphereUser):
+            entries = ApplicationCatalogEntry.visible_to()
+        elif not isinstance(atmo_user, AtmosphereUser):
             raise Exception("Expected atmo_user to be of type AtmosphereUser"
                             " - Received %s" % type(atmo_user))
-        user_images = atmo_user.application_set.all()
-        shared_images = Application.shared_with(atmo_user)
-        if atmo_user.is_staff:
-            admin_images = Application.admin_apps(atmo_user)
         else:
-            admin_images = Application.objects.none()
-        all_the_images = (public_images | user_images |
-                shared_images | admin_images).distinct().filter(
-                in_provider_list(atmo_user.current_providers, key_override='versions__machines__instance_source__provider'))
-        return all_the_images
+            entries = ApplicationCatalogEntry.visible_to(
+                atmo_user,
+                provider_ids=atmo_user.current_providers.values('id'))
+        return Application.objects.filter(
+            id__in=entries.values('application'))
 
     def get_metrics(self):
         """
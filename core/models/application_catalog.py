@@ -0,0 +1,293 @@
+"""
+  Application catalog (index) for atmosphere.
+"""
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from threepio import logger
+
+from core.models.application import Application
+from core.models.application_version import (
+    ApplicationVersion, ApplicationVersionMembership)
+from core.models.instance_source import InstanceSource
+from core.models.machine import ProviderMachine, ProviderMachineMembership
+from core.models.model_version import bump_model_version
+from core.models.provider import Provider
+
+# Everything needed to decide if a ProviderMachine is current
+MACHINE_FIELDS = (
+    'id',
+    'application_version',
+    'application_version__application',
+    'application_version__application__private',
+    'application_version__application__start_date',
+    'application_version__application__end_date',
+    'application_version__start_date',
+    'application_version__end_date',
+    'instance_source__start_date',
+    'instance_source__end_date',
+    'instance_source__provider',
+    'instance_source__provider__active',
+    'instance_source__provider__end_date',
+)
+
+
+def _in_range(start_date, end_date, now):
+    return (start_date is None or start_date < now) and\
+        (end_date is None or end_date > now)
+
+
+def _earliest(*dates):
+    """
+    Returns the first of 'dates' to pass (None if there are none)
+    """
+    dates = [date for date in dates if date]
+    return min(dates) if dates else None
+
+
+def _latest(end_date, other_end_date):
+    """
+    Returns the last of two end dates to pass (None never passes)
+    """
+    if end_date is None or other_end_date is None:
+        return None
+    return max(end_date, other_end_date)
+
+
+def catalog_rows(machine_rows, machine_members, version_members, now=None):
+    """
+    INPUT:
+    * machine_rows - ProviderMachine rows (See MACHINE_FIELDS)
+    * machine_members - (provider_machine_id, group_id) rows
+    * version_members - (application_version_id, group_id) rows
+    OUTPUT: A list of 6-tuples
+      (application_id, provider_id, group_id, public, current, end_date)
+    There is one row (group_id=None) for each application and provider,
+    and one row for each group that is a member of a current
+    machine/version of the application.
+    'end_date' is when a current row stops being current (None if never),
+    the last end date of its current machines (Or of their version,
+    application or provider, if that comes first)
+    """
+    if not now:
+        now = timezone.now()
+    # (application_id, provider_id) -> [public, current, end_date]
+    available = {}
+    # machine_id/version_id -> (application_id, end_date)
+    current_machines = {}
+    current_versions = {}
+    for (machine_id, version_id, app_id, private, app_start, app_end,
+         version_start, version_end, source_start, source_end,
+         provider_id, provider_active, provider_end) in machine_rows:
+        app_current = _in_range(app_start, app_end, now)
+        version_current = app_current and\
+            _in_range(version_start, version_end, now)
+        current = version_current and\
+            _in_range(source_start, source_end, now) and\
+            provider_active and _in_range(None, provider_end, now)
+        entry = available.setdefault((app_id, provider_id),
+                                     [not private, False, None])
+        if not current:
+            continue
+        end_date = _earliest(app_end, version_end, source_end, provider_end)
+        entry[2] = _latest(entry[2], end_date) if entry[1] else end_date
+        entry[1] = True
+        current_machines[machine_id] = (app_id, end_date)
+        if version_id in current_versions:
+            end_date = _latest(current_versions[version_id][1], end_date)
+        current_versions[version_id] = (app_id, end_date)
+
+    # application_id -> {group_id: end_date}
+    app_groups = {}
+    for members, current_members in [(machine_members, current_machines),
+                                     (version_members, current_versions)]:
+        for member_id, group_id in members:
+            if member_id not in current_members:
+                continue
+            app_id, end_date = current_members[member_id]
+            groups = app_groups.setdefault(app_id, {})
+            if group_id in groups:
+                end_date = _latest(groups[group_id], end_date)
+            groups[group_id] = end_date
+
+    rows = []
+    for (app_id, provider_id), (public, current, end_date) in \
+            available.items():
+        rows.append((app_id, provider_id, None, public, current, end_date))
+        if public or not current:
+            continue
+        groups = app_groups.get(app_id, {})
+        for group_id in sorted(groups):
+            rows.append((app_id, provider_id, group_id, public, current,
+                         _earliest(end_date, groups[group_id])))
+    return rows
+
+
+class ApplicationCatalogEntry(models.Model):
+
+    """
+    A precomputed index of the applications that can be listed:
+    * Every application and provider pair that has a machine
+      ('current' when a current machine is on an active provider)
+    * Every group that is a member of a current, private application
+    The catalog is kept up to date when applications, versions, machines,
+    memberships or providers are saved. Entries stop being current at their
+    'end_date', so end dates in the future need no rebuild
+    ('rebuild_application_catalog' rebuilds it periodically, for start
+    dates in the future).
+    """
+    application = models.ForeignKey(Application,
+                                    related_name='catalog_entries')
+    provider = models.ForeignKey(Provider, related_name='catalog_entries')
+    group = models.ForeignKey('Group', null=True, blank=True,
+                              related_name='catalog_entries')
+    public = models.BooleanField(default=False)
+    current = models.BooleanField(default=False)
+    end_date = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def rebuild(cls, application_ids=None):
+        """
+        Rebuild the entries of 'application_ids' (or all applications)
+        Returns the number of entries.
+        """
+        machines = ProviderMachine.objects.all()
+        machine_members = ProviderMachineMembership.objects.all()
+        version_members = ApplicationVersionMembership.objects.all()
+        entries = cls.objects.all()
+        if application_ids is not None:
+            application_ids = set(application_ids)
+            if not application_ids:
+                return 0
+            machines = machines.filter(
+                application_version__application__in=application_ids)
+            machine_members = machine_members.filter(
+                provider_machine__application_version__application__in=application_ids)
+            version_members = version_members.filter(
+                image_version__application__in=application_ids)
+            entries = entries.filter(application__in=application_ids)
+        rows = catalog_rows(
+            machines.values_list(*MACHINE_FIELDS),
+            machine_members.values_list('provider_machine', 'group'),
+            version_members.values_list('image_version', 'group'))
+        with transaction.atomic():
+            entries.delete()
+            cls.objects.bulk_create([
+                cls(application_id=app_id, provider_id=provider_id,
+                    group_id=group_id, public=public, current=current,
+                    end_date=end_date)
+                for (app_id, provider_id, group_id, public, current, end_date)
+                in rows], batch_size=1000)
+        bump_model_version(cls)
+        return len(rows)
+
+    @classmethod
+    def visible_to(cls, atmo_user=None, provider_ids=None):
+        """
+        Returns the entries of the applications 'atmo_user' can list
+        (Same rules as Application.current_apps):
+        * Current, public applications
+        * Current, private applications shared with any group of the user
+        * Applications created by the user
+        * For staff, applications (started, not end-dated) on their
+          providers
+        """
+        now_time = timezone.now()
+        current_query = Q(current=True) &\
+            (Q(end_date__isnull=True) | Q(end_date__gt=now_time))
+        public_query = current_query &\
+            Q(public=True, group__isnull=True)
+        if not atmo_user:
+            return cls.objects.filter(public_query)
+        query = public_query |\
+            (current_query & Q(group__in=atmo_user.group_ids())) |\
+            Q(group__isnull=True, application__created_by=atmo_user)
+        if atmo_user.is_staff:
+            query |= Q(group__isnull=True,
+                       provider__in=atmo_user.provider_ids(),
+                       application__start_date__lte=now_time) &\
+                (Q(application__end_date__isnull=True) |
+                 Q(application__end_date__gt=now_time))
+        entries = cls.objects.filter(query)
+        if provider_ids is not None:
+            entries = entries.filter(provider__in=provider_ids)
+        return entries
+
+    def __unicode__(self):
+        return "%s (Provider:%s Group:%s%s%s)" % (
+            self.application_id, self.provider_id, self.group_id,
+            " - Public" if self.public else "",
+            " - Current" if self.current else "")
+
+    class Meta:
+        db_table = "application_catalog"
+        app_label = "core"
+        unique_together = ("application", "provider", "group")
+
+
+# Save Hooks Here:
+
+
+def _rebuild_catalog(application_ids):
+    try:
+        ApplicationCatalogEntry.rebuild(
+            [app_id for app_id in application_ids if app_id])
+    except Exception:
+        logger.exception("Could not rebuild the application catalog for %s"
+                         % application_ids)
+
+
+def _application_changed(sender, instance=None, **kwargs):
+    _rebuild_catalog([instance.id])
+
+
+def _version_changed(sender, instance=None, **kwargs):
+    _rebuild_catalog([instance.application_id])
+
+
+def _machine_changed(sender, instance=None, **kwargs):
+    _rebuild_catalog(ApplicationVersion.objects.filter(
+        id=instance.application_version_id
+    ).values_list('application', flat=True))
+
+
+def _source_changed(sender, instance=None, **kwargs):
+    _rebuild_catalog(ProviderMachine.objects.filter(
+        instance_source=instance
+    ).values_list('application_version__application', flat=True))
+
+
+def _machine_membership_changed(sender, instance=None, **kwargs):
+    _rebuild_catalog(ProviderMachine.objects.filter(
+        id=instance.provider_machine_id
+    ).values_list('application_version__application', flat=True))
+
+
+def _version_membership_changed(sender, instance=None, **kwargs):
+    _rebuild_catalog(ApplicationVersion.objects.filter(
+        id=instance.image_version_id
+    ).values_list('application', flat=True))
+
+
+def _provider_changed(sender, instance=None, created=False, **kwargs):
+    if created:
+        return
+    _rebuild_catalog(ProviderMachine.objects.filter(
+        instance_source__provider=instance
+    ).values_list('application_version__application', flat=True)
+        .distinct())
+
+
+# Instantiate the hooks:
+for hook, model in [
+        (_application_changed, Application),
+        (_version_changed, ApplicationVersion),
+        (_machine_changed, ProviderMachine),
+        (_source_changed, InstanceSource),
+        (_machine_membership_changed, ProviderMachineMembership),
+        (_version_membership_changed, ApplicationVersionMembership)]:
+    post_save.connect(hook, sender=model)
+    post_delete.connect(hook, sender=model)
+post_save.connect(_provider_changed, sender=Provider)
@@ -0,0 +1,171 @@
+"""
+  Full-text search documents for applications.
+"""
+import re
+
+from django.db import connection, models, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from threepio import logger
+
+from core.fields import SEARCH_CONFIG, TSVectorField
+from core.models.application import Application
+from core.models.application_version import ApplicationVersion
+from core.models.tag import Tag
+
+# Weights: A) name B) tag names C) description and tag descriptions
+#          D) version change logs
+SEARCH_DOCUMENT_SQL = """
+INSERT INTO application_search (application_id, document)
+SELECT app.id,
+    setweight(to_tsvector(%(config)s, coalesce(app.name, '')), 'A') ||
+    setweight(to_tsvector(%(config)s, coalesce(
+        (SELECT string_agg(tag.name, ' ')
+         FROM application_tags app_tag
+         JOIN tag ON tag.id = app_tag.tag_id
+         WHERE app_tag.application_id = app.id), '')), 'B') ||
+    setweight(to_tsvector(%(config)s, coalesce(app.description, '') || ' ' ||
+        coalesce(
+        (SELECT string_agg(tag.description, ' ')
+         FROM application_tags app_tag
+         JOIN tag ON tag.id = app_tag.tag_id
+         WHERE app_tag.application_id = app.id), '')), 'C') ||
+    setweight(to_tsvector(%(config)s, coalesce(
+        (SELECT string_agg(version.change_log, ' ')
+         FROM application_version version
+         WHERE version.application_id = app.id), '')), 'D')
+FROM application app
+"""
+
+# Characters with a meaning in to_tsquery
+TSQUERY_SPECIAL_CHARS = re.compile(r"[&|!():*'\\<>]")
+
+
+def to_prefix_query(query):
+    """
+    Convert user input to a tsquery, where every word is a prefix:
+        "Ubuntu deskt" -> "ubuntu:* & deskt:*"
+    Returns None when there is nothing to search for.
+    """
+    if not query:
+        return None
+    words = TSQUERY_SPECIAL_CHARS.sub(' ', query).lower().split()
+    if not words:
+        return None
+    return " & ".join("%s:*" % word for word in words)
+
+
+def rebuild_search_documents(application_ids=None):
+    """
+    (Re-)Write the search document of 'application_ids' (or all
+    applications) using the current name, description, tags and versions.
+    The DELETE and INSERT run in one transaction (a savepoint, inside the
+    transaction of the caller), so a failure leaves the documents as they
+    were and the caller's transaction usable.
+    """
+    sql = SEARCH_DOCUMENT_SQL
+    params = {"config": SEARCH_CONFIG}
+    delete_sql = "DELETE FROM application_search"
+    delete_params = {}
+    if application_ids is not None:
+        application_ids = tuple(set(application_ids))
+        if not application_ids:
+            return
+        sql += "WHERE app.id IN %(ids)s"
+        delete_sql += " WHERE application_id IN %(ids)s"
+        params["ids"] = delete_params["ids"] = application_ids
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute(delete_sql, delete_params)
+        cursor.execute(sql, params)
+
+
+class ApplicationSearchDocument(models.Model):
+
+    """
+    The text search document (tsvector) of an application, covering its
+    name, description, tags and version change logs.
+    Documents are re-written when applications, versions or tags change.
+    """
+    application = models.OneToOneField(
+        Application, primary_key=True, related_name='search_document')
+    document = TSVectorField(null=True)
+
+    @classmethod
+    def search(cls, query, queryset=None):
+        """
+        Returns the applications in 'queryset' (or all applications)
+        that match every word of 'query' (as a prefix), best match first.
+        """
+        if queryset is None:
+            queryset = Application.objects.all()
+        tsquery = to_prefix_query(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(
+            search_document__document__matches=tsquery
+        ).extra(
+            select={"search_rank":
+                    "ts_rank(application_search.document, "
+                    "to_tsquery(%s, %s))"},
+            select_params=(SEARCH_CONFIG, tsquery),
+            order_by=["-search_rank", "name"])
+
+    class Meta:
+        db_table = "application_search"
+        app_label = "core"
+
+
+# Save Hooks Here:
+
+
+def _rebuild_documents(application_ids):
+    # The savepoint of rebuild_search_documents is rolled back before the
+    # error reaches this handler.
+    try:
+        rebuild_search_documents(
+            [app_id for app_id in application_ids if app_id])
+    except Exception:
+        logger.exception("Could not rebuild the search documents for %s"
+                         % application_ids)
+
+
+def _application_changed(sender, instance=None, **kwargs):
+    _rebuild_documents([instance.id])
+
+
+def _version_changed(sender, instance=None, **kwargs):
+    _rebuild_documents([instance.application_id])
+
+
+def _tag_changed(sender, instance=None, created=False, **kwargs):
+    if created:
+        return
+    _rebuild_documents(
+        instance.application_set.values_list('id', flat=True))
+
+
+def _application_tags_changed(sender, instance=None, action=None,
+                              reverse=False, pk_set=None, **kwargs):
+    if reverse and action == 'pre_clear':
+        # Remember the applications, they are gone after the clear.
+        instance._search_application_ids = list(
+            instance.application_set.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _rebuild_documents([instance.id])
+    elif action == 'post_clear':
+        _rebuild_documents(getattr(instance, '_search_application_ids', []))
+    else:
+        _rebuild_documents(pk_set or [])
+
+
+# Instantiate the hooks:
+post_save.connect(_application_changed, sender=Application)
+post_save.connect(_version_changed, sender=ApplicationVersion)
+post_delete.connect(_version_changed, sender=ApplicationVersion)
+post_save.connect(_tag_changed, sender=Tag)
+m2m_changed.connect(_application_tags_changed,
+                    sender=Application.tags.through)
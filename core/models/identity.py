@@ -289,17 +289,9 @@ class Identity(models.Model):
 
     def get_allocation_usage(self):
         # Undoubtedly will cause circular dependencies
-        from service.monitoring import _get_allocation_result
-        allocation_result = _get_allocation_result(self)
-        over_allocation, diff_amount = allocation_result.total_difference()
-        burn_time = allocation_result.get_burn_rate()
-        # Moving from seconds to hours
-        hourly_credit = int(allocation_result
-                            .total_credit().total_seconds() / 3600.0)
-        hourly_runtime = int(allocation_result
-                             .total_runtime().total_seconds() / 3600.0)
-        hourly_difference = int(diff_amount.total_seconds() / 3600.0)
-        zero_time = allocation_result.time_to_zero()
+        from service.monitoring import get_allocation_usage
+        hourly_credit, hourly_runtime, hourly_difference, zero_time = \
+            get_allocation_usage(self)
         return {
             "threshold": hourly_credit,  # Total amount
             "current": hourly_runtime,  # Total used
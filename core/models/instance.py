@@ -431,6 +431,8 @@ class Instance(models.Model):
     class Meta:
         db_table = "instance"
         app_label = "core"
+        # Keyset pagination (See api.pagination.KeysetPagination)
+        index_together = [("start_date", "id")]
 
 
 """
@@ -550,6 +552,49 @@ def find_instance(instance_id):
     return None
 
 
+# The newest InstanceStatusHistory of an instance (See 'get_last_history')
+_LAST_HISTORY_SQL = """
+SELECT %s FROM instance_status_history history
+%s
+WHERE history.instance_id = instance.id
+ORDER BY history.start_date DESC, history.id DESC LIMIT 1
+"""
+
+LAST_HISTORY_SELECT = {
+    'last_status': _LAST_HISTORY_SQL % (
+        "status.name",
+        "JOIN instance_status status ON status.id = history.status_id"),
+    'last_activity': _LAST_HISTORY_SQL % ("history.activity", ""),
+    'last_size_id': _LAST_HISTORY_SQL % ("history.size_id", ""),
+}
+
+
+def with_last_history(queryset):
+    """
+    Annotate every instance in 'queryset' with the status name ('last_status'),
+    activity ('last_activity') and size ('last_size_id')
+    of its newest InstanceStatusHistory.
+    NOTE: 'last_status' is None when the instance has no history.
+    """
+    return queryset.extra(select=LAST_HISTORY_SELECT)
+
+
+def prefetch_last_size(instances):
+    """
+    Set 'last_size' on every instance annotated by 'with_last_history',
+    with a single query for all of their sizes.
+    """
+    instances = list(instances)
+    size_ids = set(getattr(instance, 'last_size_id', None)
+                   for instance in instances)
+    size_ids.discard(None)
+    sizes = Size.objects.in_bulk(list(size_ids)) if size_ids else {}
+    for instance in instances:
+        if hasattr(instance, 'last_size_id'):
+            instance.last_size = sizes.get(instance.last_size_id)
+    return instances
+
+
 def _find_esh_ip(esh_instance):
     if esh_instance.ip:
         return esh_instance.ip
@@ -667,8 +712,10 @@ def convert_esh_instance(
         identity_uuid,
         user,
         token=None,
-        password=None):
+        password=None,
+        size_catalog=None):
     """
+    size_catalog - (Optional) service.cache.SizeCatalog for the provider
     """
     instance_id = esh_instance.id
     ip_address = _find_esh_ip(esh_instance)
@@ -703,7 +750,8 @@ def convert_esh_instance(
     core_instance.esh = esh_instance
     # Update the InstanceStatusHistory
     core_size = _esh_instance_size_to_core(esh_driver,
-                                           esh_instance, provider_uuid)
+                                           esh_instance, provider_uuid,
+                                           size_catalog)
     # TODO: You are the mole!
     core_instance.update_history(
         esh_instance.extra['status'],
@@ -716,16 +764,118 @@ def convert_esh_instance(
     return core_instance
 
 
-def _esh_instance_size_to_core(esh_driver, esh_instance, provider_uuid):
+def convert_esh_instances(esh_instance_list, provider_uuid,
+                          size_catalog=None):
+    """
+    Bulk version of 'convert_esh_instance'
+    esh_instance_list - [(esh_driver, esh_instance, identity_uuid, user), ..]
+    size_catalog - (Optional) service.cache.SizeCatalog for the provider
+    Core instances, their current history and sizes are retrieved in a
+    few queries, and every changed InstanceStatusHistory is written in a
+    single transaction. New instances (and instances without a current
+    history) are converted one at a time.
+    Returns the list of core instances (In the same order)
+    """
+    from core.models import InstanceStatusHistory
+    core_instances = dict(
+        (core_instance.provider_alias, core_instance)
+        for core_instance in Instance.objects.filter(
+            provider_alias__in=[esh_instance.id for (_, esh_instance, _, _)
+                                in esh_instance_list])
+        .select_related('created_by', 'source__provider__type'))
+    last_histories = dict(
+        (history.instance_id, history)
+        for history in InstanceStatusHistory.objects.filter(
+            instance__in=core_instances.values(), end_date=None)
+        .select_related('status').order_by('start_date'))
+    size_map = _esh_instance_sizes_to_core(
+        esh_instance_list, provider_uuid, size_catalog)
+    results = []
+    changes = []
+    for (esh_driver, esh_instance, identity_uuid, user) in esh_instance_list:
+        core_instance = core_instances.get(esh_instance.id)
+        last_history = last_histories.get(core_instance.id)\
+            if core_instance else None
+        if not last_history:
+            results.append(convert_esh_instance(
+                esh_driver, esh_instance, provider_uuid, identity_uuid, user,
+                size_catalog=size_catalog))
+            continue
+        ip_address = _find_esh_ip(esh_instance)
+        if core_instance.ip_address != ip_address or core_instance.end_date:
+            _update_core_instance(core_instance, ip_address, None)
+        core_instance.esh = esh_instance
+        core_size = size_map[esh_instance.size.id]
+        status_name = _get_status_name_for_provider(
+            core_instance.source.provider,
+            esh_instance.extra['status'],
+            esh_instance.extra.get('task'),
+            esh_instance.extra.get('metadata', {}).get(
+                'tmp_status', "MISSING"))
+        if last_history.status.name != status_name \
+                or last_history.size_id != core_size.id:
+            changes.append((status_name, core_instance.esh_activity(),
+                            core_instance, core_size, last_history))
+        results.append(core_instance)
+    InstanceStatusHistory.bulk_transaction(changes, start_time=timezone.now())
+    return results
+
+
+def _esh_instance_sizes_to_core(esh_instance_list, provider_uuid,
+                                size_catalog=None):
+    """
+    Bulk version of '_esh_instance_size_to_core'
+    Every size is converted once. A MockSize only requires a lookup
+    (on the driver) when it is not in the size_catalog or the DB.
+    Returns a dict: {esh_size.id: core_size}
+    """
+    size_map = {}
+    if size_catalog:
+        for (_, esh_instance, _, _) in esh_instance_list:
+            size_id = esh_instance.size.id
+            if size_id not in size_map:
+                core_size = size_catalog.get_core_size(size_id)
+                if core_size:
+                    size_map[size_id] = core_size
+    esh_sizes = {}
+    for (esh_driver, esh_instance, _, _) in esh_instance_list:
+        esh_size = esh_instance.size
+        if esh_size.id in size_map:
+            continue
+        if esh_size.id not in esh_sizes\
+                or isinstance(esh_sizes[esh_size.id][1], MockSize):
+            esh_sizes[esh_size.id] = (esh_driver, esh_size)
+    if not esh_sizes:
+        return size_map
+    core_sizes = dict(
+        (core_size.alias, core_size) for core_size in Size.objects.filter(
+            alias__in=esh_sizes.keys(), provider__uuid=provider_uuid))
+    for alias, (esh_driver, esh_size) in esh_sizes.items():
+        core_size = core_sizes.get(alias)
+        if core_size and isinstance(esh_size, MockSize):
+            core_size.esh = esh_size
+        else:
+            if isinstance(esh_size, MockSize):
+                esh_size = esh_driver.get_size(esh_size.id)
+            core_size = convert_esh_size(esh_size, provider_uuid)
+        size_map[alias] = core_size
+    return size_map
+
+
+def _esh_instance_size_to_core(esh_driver, esh_instance, provider_uuid,
+                               size_catalog=None):
     # NOTE: Querying for esh_size because esh_instance
     # Only holds the alias, not all the values.
     # As a bonus this is a cached-call
     esh_size = esh_instance.size
+    if size_catalog:
+        core_size = size_catalog.get_core_size(esh_size.id)
+        if core_size:
+            return core_size
     if isinstance(esh_size, MockSize):
         # MockSize includes only the Alias/ID information
         # so a lookup on the size is required to get accurate
         # information.
-        # TODO: Switch to 'get_cached_size!'
         esh_size = esh_driver.get_size(esh_size.id)
     core_size = convert_esh_size(esh_size, provider_uuid)
     return core_size
@@ -4,11 +4,15 @@
 from uuid import uuid4
 from datetime import timedelta
 
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import models, transaction, DatabaseError
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 
 from threepio import logger
 
+from core.models.usage_rollup import UsageRollup
+
 
 class InstanceStatus(models.Model):
 
@@ -40,6 +44,21 @@ class InstanceStatusHistory(models.Model):
     start_date = models.DateTimeField(default=timezone.now)
     end_date = models.DateTimeField(null=True, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        history = super(InstanceStatusHistory, cls).from_db(
+            db, field_names, values)
+        # The saved end date (See '_history_changed')
+        history._saved_end_date = history.__dict__.get('end_date')
+        return history
+
+    def was_closed(self):
+        """
+        True if this history was saved with an end date: It may be counted
+        in an AllocationCheckpoint (See allocation.models.checkpoint)
+        """
+        return bool(getattr(self, '_saved_end_date', None))
+
     @classmethod
     def transaction(cls, status_name, activity, instance, size,
                     start_time=None, last_history=None):
@@ -76,6 +95,60 @@ class InstanceStatusHistory(models.Model):
                 "instance_status_history: Lock is already acquired by"
                 "another transaction.")
 
+    @classmethod
+    def bulk_transaction(cls, changes, start_time=None):
+        """
+        Bulk version of 'transaction'
+        changes - [(status_name, activity, instance, size, last_history), ..]
+        Every last_history that is still open is end-dated, and every new
+        history is created, in a single transaction.
+        Returns the list of new histories
+        """
+        if not changes:
+            return []
+        if not start_time:
+            start_time = timezone.now()
+        statuses = dict(
+            (status.name, status) for status in InstanceStatus.objects.filter(
+                name__in=set(change[0] for change in changes)))
+        with transaction.atomic():
+            # Required to prevent race conditions.
+            open_ids = set(cls.objects.select_for_update().filter(
+                id__in=[change[4].id for change in changes],
+                end_date=None).values_list('id', flat=True))
+            new_histories = []
+            for (status_name, activity, instance, size, last_history)\
+                    in changes:
+                if last_history.id not in open_ids:
+                    logger.warn("Old history already has end date: %s"
+                                % last_history)
+                    continue
+                if status_name not in statuses:
+                    statuses[status_name], _ = InstanceStatus.objects\
+                        .get_or_create(name=status_name)
+                last_history.end_date = start_time
+                new_history = InstanceStatusHistory(
+                    instance=instance, size=size,
+                    status=statuses[status_name], activity=activity,
+                    start_date=start_time)
+                logger.info(
+                    "Status Update - User:%s Instance:%s "
+                    "Old:%s New:%s Time:%s" %
+                    (instance.created_by,
+                     instance.provider_alias,
+                     last_history.status.name,
+                     status_name,
+                     start_time))
+                new_histories.append(new_history)
+            # (Open histories are never part of an AllocationCheckpoint)
+            cls.objects.filter(id__in=open_ids).update(end_date=start_time)
+            cls.objects.bulk_create(new_histories)
+            # Bulk updates do not trigger the save hooks.
+            UsageRollup.mark_dirty(
+                [history.instance.created_by_identity_id
+                 for history in new_histories])
+        return new_histories
+
     @classmethod
     def create_history(cls, status_name, instance, size,
                        start_date=None, end_date=None, activity=None):
@@ -163,3 +236,42 @@ class InstanceStatusHistory(models.Model):
     class Meta:
         db_table = "instance_status_history"
         app_label = "core"
+        # Keyset pagination (See api.pagination.KeysetPagination)
+        index_together = [("start_date", "id")]
+
+
+# Save Hooks Here:
+
+
+def _history_changed(sender, instance=None, created=False, **kwargs):
+    """
+    Any change to the status history (New statuses, end dates) changes
+    the usage of the owner of the instance.
+    A change to a closed history (Or a new, closed history) also changes
+    the time folded into the AllocationCheckpoint of the owner.
+    """
+    UsageRollup.mark_dirty_for_instances([instance.instance_id])
+    if instance.was_closed() or (created and instance.end_date):
+        _invalidate_allocation_checkpoint(instance)
+    instance._saved_end_date = instance.end_date
+
+
+def _history_deleted(sender, instance=None, **kwargs):
+    UsageRollup.mark_dirty_for_instances([instance.instance_id])
+    if instance.was_closed() or instance.end_date:
+        _invalidate_allocation_checkpoint(instance)
+
+
+def _invalidate_allocation_checkpoint(history):
+    from service.cache import invalidate_cached_allocation_checkpoint
+    try:
+        identity = history.instance.created_by_identity
+    except ObjectDoesNotExist:
+        return
+    if identity:
+        invalidate_cached_allocation_checkpoint(identity)
+
+
+# Instantiate the hooks:
+post_save.connect(_history_changed, sender=InstanceStatusHistory)
+post_delete.connect(_history_deleted, sender=InstanceStatusHistory)
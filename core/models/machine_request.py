@@ -442,6 +442,8 @@ class MachineRequest(BaseRequest):
     class Meta:
         db_table = "machine_request"
         app_label = "core"
+        # Keyset pagination (See api.pagination.KeysetPagination)
+        index_together = [("start_date", "id")]
 
 
 def _match_membership_to_access(access_list, membership):
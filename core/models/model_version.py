@@ -0,0 +1,141 @@
+"""
+  Version counters for (cached) models.
+
+Every save or delete of a versioned model increments its counter (in redis),
+so anything derived from the model (Like a cached API response) can tell
+that it is out of date by comparing counters.
+Counters are incremented once the transaction of the change commits,
+otherwise a request could cache the old data under the new version.
+NOTE: Bulk updates do not send signals, call 'bump_model_version' after them.
+"""
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection as db_default_connection, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+import redis
+
+from threepio import logger
+
+from core.models.application import (
+    Application, ApplicationBookmark, ApplicationMembership)
+from core.models.application_version import ApplicationVersion
+from core.models.group import Group, IdentityMembership
+from core.models.identity import Identity
+from core.models.license import License, LicenseType
+from core.models.machine import ProviderMachine
+from core.models.provider import Provider, ProviderType, PlatformType
+from core.models.size import Size
+from core.models.tag import Tag
+from core.models.user import AtmosphereUser
+
+MODEL_VERSION_KEY = "model_version.{0}.{1}"
+
+# Models read by the cached API endpoints
+VERSIONED_MODELS = (
+    Application, ApplicationBookmark, ApplicationMembership,
+    ApplicationVersion, AtmosphereUser, Group, Identity, IdentityMembership,
+    License, LicenseType, PlatformType, Provider, ProviderMachine,
+    ProviderType, Size, Tag,
+)
+
+connection = None
+
+
+def _redis_connection():
+    global connection
+    if not connection:
+        connection = redis.StrictRedis()
+    return connection
+
+
+def model_version_key(model):
+    return MODEL_VERSION_KEY.format(
+        model._meta.app_label, model._meta.model_name)
+
+
+def get_model_versions(models):
+    """
+    Returns the current version of every model in 'models'
+    (Or None if the versions are not available)
+    """
+    keys = [model_version_key(model) for model in models]
+    try:
+        conn = _redis_connection()
+        versions = conn.mget(keys)
+        for key, version in zip(keys, versions):
+            if version is None:
+                # Never start again from a version that was already used
+                # (ex: redis was flushed)
+                conn.setnx(key, int(time.time() * 1000))
+        if None in versions:
+            versions = conn.mget(keys)
+    except redis.exceptions.ConnectionError:
+        logger.warn("Model versions are not available: "
+                    "redis-server is not running")
+        return None
+    return [int(version) for version in versions]
+
+
+def bump_model_version(*models):
+    """
+    Mark every model in 'models' as changed,
+    once the current transaction (if any) commits.
+    """
+    if not getattr(settings, 'API_RESPONSE_CACHE', False):
+        return
+    # See the 'transaction_hooks' database backends
+    transaction.get_connection().on_commit(
+        lambda: _bump_model_version(models))
+
+
+def _bump_model_version(models):
+    try:
+        pipe = _redis_connection().pipeline(transaction=False)
+        for model in models:
+            pipe.incr(model_version_key(model))
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        logger.debug("Could not bump the version of %s: "
+                     "redis-server is not running" % (models,))
+
+
+# Save Hooks Here:
+
+
+def _model_changed(sender, **kwargs):
+    bump_model_version(sender)
+
+
+def _relation_changed(sender, instance=None, model=None, action=None,
+                      **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    bump_model_version(instance.__class__, model)
+
+
+def check_on_commit():
+    """
+    Bumping a version before the transaction commits would let readers
+    cache stale data under the new version: Refuse to start without
+    'on_commit' (i.e. a DATABASES ENGINE that is not 'transaction_hooks')
+    """
+    if getattr(settings, 'API_RESPONSE_CACHE', False) \
+            and not hasattr(db_default_connection, 'on_commit'):
+        raise ImproperlyConfigured(
+            "API_RESPONSE_CACHE requires a 'transaction_hooks' database "
+            "ENGINE (ex: transaction_hooks.backends.postgresql_psycopg2)")
+
+
+check_on_commit()
+
+# Instantiate the hooks:
+for versioned_model in VERSIONED_MODELS:
+    post_save.connect(_model_changed, sender=versioned_model,
+                      dispatch_uid=model_version_key(versioned_model))
+    post_delete.connect(_model_changed, sender=versioned_model,
+                        dispatch_uid=model_version_key(versioned_model))
+m2m_changed.connect(_relation_changed, sender=Application.tags.through)
+m2m_changed.connect(_relation_changed, sender=AtmosphereUser.groups.through)
@@ -0,0 +1,167 @@
+"""
+  Usage rollup model for atmosphere.
+"""
+from datetime import datetime, timedelta
+
+from django.db import models
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+import pytz
+
+from core.models.allocation_strategy import AllocationStrategy
+
+
+class UsageRollup(models.Model):
+
+    """
+    The allocation usage of an identity for a time period (window),
+    as calculated by the allocation engine on 'calculated_at'.
+    The window is current until 'next_window_start' (Forever, when None).
+
+    Usage after 'calculated_at' is extrapolated from the burn rate, which
+    only changes when an instance changes status. Status transitions mark
+    the rollup as 'dirty', so it is re-calculated on the next read.
+
+    All amounts are in seconds (burn_rate is seconds-per-second).
+    """
+    identity = models.ForeignKey("Identity", related_name="usage_rollups")
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField(null=True, blank=True)
+    next_window_start = models.DateTimeField(null=True, blank=True)
+    credit = models.FloatField()
+    used = models.FloatField()
+    # Negative when over allocation
+    remaining = models.FloatField()
+    burn_rate = models.FloatField()
+    calculated_at = models.DateTimeField()
+    dirty = models.BooleanField(default=False)
+
+    @classmethod
+    def update_for(cls, identity, allocation_result, calculated_at=None,
+                   next_window_start=None):
+        """
+        Create (or update) the rollup using 'allocation_result'
+        """
+        if not allocation_result.time_periods:
+            return None
+        if not calculated_at:
+            calculated_at = timezone.now()
+        over_allocation, difference = allocation_result.total_difference()
+        remaining = difference.total_seconds()
+        if over_allocation:
+            remaining = -remaining
+        rollup, _ = cls.objects.update_or_create(
+            identity=identity,
+            window_start=allocation_result.window_start,
+            defaults={
+                "window_end": allocation_result.window_end,
+                "next_window_start": next_window_start,
+                "credit": allocation_result.total_credit().total_seconds(),
+                "used": allocation_result.total_runtime().total_seconds(),
+                "remaining": remaining,
+                "burn_rate": allocation_result.get_burn_rate()
+                .total_seconds(),
+                "calculated_at": calculated_at,
+                "dirty": False,
+            })
+        return rollup
+
+    @classmethod
+    def get_current(cls, identity):
+        """
+        Returns the rollup for the newest window of 'identity' (Or None)
+        """
+        return cls.objects.filter(identity=identity)\
+            .order_by('-window_start').first()
+
+    @classmethod
+    def mark_dirty(cls, identity_ids):
+        """
+        Called when instances of 'identity_ids' change status
+        """
+        identity_ids = [identity_id for identity_id in set(identity_ids)
+                        if identity_id]
+        if not identity_ids:
+            return 0
+        return cls.objects.filter(
+            identity__in=identity_ids, dirty=False).update(dirty=True)
+
+    @classmethod
+    def mark_dirty_for_instances(cls, instance_ids):
+        """
+        Called when the status history of 'instance_ids' changes
+        """
+        from core.models.instance import Instance
+        instance_ids = [instance_id for instance_id in set(instance_ids)
+                        if instance_id]
+        if not instance_ids:
+            return 0
+        return cls.objects.filter(
+            identity__in=Instance.objects.filter(
+                id__in=instance_ids).values('created_by_identity'),
+            dirty=False).update(dirty=True)
+
+    @classmethod
+    def mark_dirty_for_provider(cls, provider_id):
+        """
+        Called when the allocation strategy of 'provider_id' changes
+        """
+        return cls.objects.filter(
+            identity__provider=provider_id, dirty=False).update(dirty=True)
+
+    def is_current_window(self, now=None):
+        if not now:
+            now = timezone.now()
+        if self.window_start > now:
+            return False
+        return not self.next_window_start or now < self.next_window_start
+
+    def _elapsed(self, now=None):
+        if not now:
+            now = timezone.now()
+        return max((now - self.calculated_at).total_seconds(), 0)
+
+    def current_used(self, now=None):
+        return self.used + self.burn_rate * self._elapsed(now)
+
+    def current_remaining(self, now=None):
+        return self.remaining - self.burn_rate * self._elapsed(now)
+
+    def time_to_zero(self, now=None):
+        """
+        Same as TimePeriodResult.time_to_zero, as of 'now'
+        """
+        if not now:
+            now = timezone.now()
+        remaining = self.current_remaining(now)
+        if remaining <= 0:
+            return now
+        if not self.burn_rate:
+            return datetime.max.replace(tzinfo=pytz.utc)
+        try:
+            return now + timedelta(seconds=remaining / self.burn_rate)
+        except OverflowError:
+            return datetime.max.replace(tzinfo=pytz.utc)
+
+    def __unicode__(self):
+        return "%s (FROM:%s Used:%s Remaining:%s%s)" % (
+            self.identity_id, self.window_start,
+            self.current_used(), self.current_remaining(),
+            " - Dirty" if self.dirty else "")
+
+    class Meta:
+        db_table = "usage_rollup"
+        app_label = "core"
+        unique_together = ("identity", "window_start")
+
+
+# Save Hooks Here:
+
+
+def _strategy_changed(sender, instance=None, **kwargs):
+    UsageRollup.mark_dirty_for_provider(instance.provider_id)
+
+
+# Instantiate the hooks:
+post_save.connect(_strategy_changed, sender=AllocationStrategy)
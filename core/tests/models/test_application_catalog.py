@@ -0,0 +1,135 @@
+"""
+test application catalog
+"""
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from core.factories import IdentityFactory
+from core.models import Application, AtmosphereUser
+from core.models.application_catalog import (
+    ApplicationCatalogEntry, catalog_rows)
+
+
+class TestCatalogRows(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.past = self.now - timedelta(days=1)
+
+    def _machine(self, machine_id, version_id, app_id, provider_id,
+                 private=False, app_end=None, version_end=None,
+                 source_end=None, provider_active=True, provider_end=None):
+        return (machine_id, version_id, app_id, private, self.past, app_end,
+                self.past, version_end, self.past, source_end,
+                provider_id, provider_active, provider_end)
+
+    def test_public_application(self):
+        rows = catalog_rows(
+            [self._machine(1, 1, 1, 1)], [], [(1, 10)], now=self.now)
+        self.assertEquals(rows, [(1, 1, None, True, True, None)])
+
+    def test_private_application_members(self):
+        rows = catalog_rows(
+            [self._machine(1, 1, 1, 1, private=True),
+             self._machine(2, 2, 1, 2, private=True)],
+            [(1, 10)], [(2, 11)], now=self.now)
+        self.assertEquals(sorted(rows), [
+            (1, 1, None, False, True, None),
+            (1, 1, 10, False, True, None),
+            (1, 1, 11, False, True, None),
+            (1, 2, None, False, True, None),
+            (1, 2, 10, False, True, None),
+            (1, 2, 11, False, True, None),
+        ])
+
+    def test_end_dated_machine(self):
+        rows = catalog_rows(
+            [self._machine(1, 1, 1, 1, private=True, source_end=self.past)],
+            [(1, 10)], [], now=self.now)
+        self.assertEquals(rows, [(1, 1, None, False, False, None)])
+
+    def test_inactive_provider(self):
+        rows = catalog_rows(
+            [self._machine(1, 1, 1, 1, provider_active=False),
+             self._machine(2, 1, 1, 2)], [], [], now=self.now)
+        self.assertEquals(sorted(rows), [
+            (1, 1, None, True, False, None),
+            (1, 2, None, True, True, None),
+        ])
+
+    def test_end_dated_version(self):
+        future = self.now + timedelta(days=1)
+        rows = catalog_rows(
+            [self._machine(1, 1, 1, 1, version_end=self.past),
+             self._machine(2, 2, 2, 1, version_end=future)],
+            [], [], now=self.now)
+        self.assertEquals(sorted(rows), [
+            (1, 1, None, True, False, None),
+            (2, 1, None, True, True, future),
+        ])
+
+    def test_end_date(self):
+        soon = self.now + timedelta(hours=1)
+        later = self.now + timedelta(days=1)
+        rows = catalog_rows(
+            [self._machine(1, 1, 1, 1, private=True, source_end=soon),
+             self._machine(2, 1, 1, 1, private=True, version_end=later,
+                           provider_end=soon + timedelta(hours=1)),
+             self._machine(3, 2, 1, 2, private=True, app_end=later)],
+            [(1, 10)], [(1, 11)], now=self.now)
+        self.assertEquals(sorted(rows), [
+            # The last of the machines to end
+            (1, 1, None, False, True, soon + timedelta(hours=1)),
+            # A member of machine 1 only
+            (1, 1, 10, False, True, soon),
+            # A member of the version (Machines 1 and 2)
+            (1, 1, 11, False, True, soon + timedelta(hours=1)),
+            (1, 2, None, False, True, later),
+            (1, 2, 10, False, True, soon),
+            (1, 2, 11, False, True, soon + timedelta(hours=1)),
+        ])
+
+
+class TestCatalogVisibility(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.identity = IdentityFactory.create()
+
+    def _entry(self, name, end_date):
+        application = Application.objects.create(
+            name=name, created_by=self.identity.created_by,
+            created_by_identity=self.identity)
+        return ApplicationCatalogEntry.objects.create(
+            application=application, provider=self.identity.provider,
+            public=True, current=True, end_date=end_date)
+
+    def test_ended_entries_are_hidden(self):
+        ended = self._entry("ended", self.now - timedelta(minutes=1))
+        ending = self._entry("ending", self.now + timedelta(minutes=1))
+        current = self._entry("current", None)
+        self.assertEquals(
+            sorted(ApplicationCatalogEntry.visible_to().values_list(
+                'id', flat=True)),
+            sorted([ending.id, current.id]))
+        self.assertNotIn(ended, ApplicationCatalogEntry.visible_to())
+
+    def test_staff_do_not_see_applications_before_their_start(self):
+        staff_user = self.identity.created_by
+        self.assertTrue(staff_user.is_staff)
+        other_user = AtmosphereUser.objects.create(username="other")
+        entries = {}
+        for name, start_date in [
+                ("started", self.now - timedelta(minutes=1)),
+                ("starting", self.now + timedelta(minutes=1))]:
+            application = Application.objects.create(
+                name=name, created_by=other_user,
+                created_by_identity=self.identity, start_date=start_date)
+            entries[name] = ApplicationCatalogEntry.objects.create(
+                application=application, provider=self.identity.provider,
+                public=False, current=False)
+        visible = ApplicationCatalogEntry.visible_to(staff_user)
+        self.assertIn(entries["started"], visible)
+        self.assertNotIn(entries["starting"], visible)
@@ -0,0 +1,132 @@
+"""
+test application search
+"""
+from django.test import TestCase
+
+from core.factories import IdentityFactory
+from core.models import Application, ApplicationVersion, Tag
+from core.models.application_search import (
+    ApplicationSearchDocument, rebuild_search_documents, to_prefix_query)
+
+
+class TestPrefixQuery(TestCase):
+
+    def test_words_are_prefixes(self):
+        self.assertEquals(
+            to_prefix_query("Ubuntu deskt"), "ubuntu:* & deskt:*")
+
+    def test_special_characters_are_removed(self):
+        self.assertEquals(
+            to_prefix_query("centos & (7|'!')"), "centos:* & 7:*")
+
+    def test_empty_query(self):
+        self.assertEquals(to_prefix_query(""), None)
+        self.assertEquals(to_prefix_query(" :* "), None)
+
+
+class TestApplicationSearch(TestCase):
+
+    def setUp(self):
+        self.identity = IdentityFactory.create()
+        self.user = self.identity.created_by
+
+    def _application(self, name, description=None):
+        return Application.objects.create(
+            name=name, description=description, created_by=self.user,
+            created_by_identity=self.identity)
+
+    def _version(self, application, change_log):
+        return ApplicationVersion.objects.create(
+            application=application, name="1.0", change_log=change_log,
+            created_by=self.user, created_by_identity=self.identity)
+
+    def _tag(self, name, description=""):
+        return Tag.objects.create(
+            name=name, description=description, user=self.user)
+
+    def _search(self, query):
+        return [application.name for application
+                in ApplicationSearchDocument.search(query)]
+
+    def test_search_document_sql(self):
+        ubuntu = self._application("Ubuntu Desktop", "Gnome and Firefox")
+        ubuntu.tags.add(self._tag("gpu", "CUDA drivers"))
+        self._version(ubuntu, "Kernel update")
+        self._application("CentOS")
+        # Rebuilt from scratch, as in the migration
+        ApplicationSearchDocument.objects.all().delete()
+        rebuild_search_documents()
+        self.assertEquals(ApplicationSearchDocument.objects.count(), 2)
+        for query in ["ubuntu", "desk", "firefox", "gpu", "cuda",
+                      "kernel", "UBUNTU gnome"]:
+            self.assertEquals(self._search(query), ["Ubuntu Desktop"],
+                              "Query: %s" % query)
+        self.assertEquals(self._search("centos"), ["CentOS"])
+
+    def test_words_are_prefixes(self):
+        self._application("Ubuntu")
+        self.assertEquals(self._search("ubu"), ["Ubuntu"])
+        # Unlike the substring match this replaced
+        self.assertEquals(self._search("buntu"), [])
+
+    def test_every_word_must_match(self):
+        self._application("Ubuntu Desktop")
+        self._application("Ubuntu Server")
+        self.assertEquals(self._search("ubuntu serv"), ["Ubuntu Server"])
+        self.assertEquals(self._search("ubuntu fedora"), [])
+
+    def test_name_change(self):
+        application = self._application("Ubuntu")
+        application.name = "Fedora"
+        application.save()
+        self.assertEquals(self._search("ubuntu"), [])
+        self.assertEquals(self._search("fedora"), ["Fedora"])
+
+    def test_tag_changes(self):
+        application = self._application("Ubuntu")
+        tag = self._tag("gpu")
+        application.tags.add(tag)
+        self.assertEquals(self._search("gpu"), ["Ubuntu"])
+        application.tags.clear()
+        self.assertEquals(self._search("gpu"), [])
+        tag.application_set.add(application)
+        self.assertEquals(self._search("gpu"), ["Ubuntu"])
+        tag.name = "cuda"
+        tag.save()
+        self.assertEquals(self._search("gpu"), [])
+        self.assertEquals(self._search("cuda"), ["Ubuntu"])
+        tag.application_set.clear()
+        self.assertEquals(self._search("cuda"), [])
+
+    def test_version_changes(self):
+        application = self._application("Ubuntu")
+        version = self._version(application, "Kernel update")
+        self.assertEquals(self._search("kernel"), ["Ubuntu"])
+        version.change_log = "Security update"
+        version.save()
+        self.assertEquals(self._search("kernel"), [])
+        self.assertEquals(self._search("security"), ["Ubuntu"])
+        version.delete()
+        self.assertEquals(self._search("security"), [])
+
+    def test_ranking(self):
+        # Name > Tags > Description > Change logs, then by name
+        self._version(self._application("Change log"), "Gromacs 5")
+        self._application("Description", "Includes gromacs")
+        self._application("Tag").tags.add(self._tag("gromacs"))
+        self._application("Gromacs B")
+        self._application("Gromacs A")
+        self.assertEquals(
+            self._search("gromacs"),
+            ["Gromacs A", "Gromacs B", "Tag", "Description", "Change log"])
+
+    def test_stop_words(self):
+        # The 'simple' configuration keeps stop words, so they are
+        # searched for like any other word.
+        self._application("The Ubuntu")
+        self._application("Theano")
+        self._application("Ubuntu")
+        self.assertEquals(sorted(self._search("the")),
+                          ["The Ubuntu", "Theano"])
+        self.assertEquals(self._search("the ubuntu"), ["The Ubuntu"])
+        self.assertEquals(self._search("a of"), [])
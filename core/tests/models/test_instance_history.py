@@ -0,0 +1,202 @@
+"""
+test the bulk conversion of (esh) instances and their status histories
+"""
+from datetime import timedelta
+
+import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from core.factories import IdentityFactory
+from core.models import (
+    Instance, InstanceSource, InstanceStatus, InstanceStatusHistory, Size)
+from core.models.instance import convert_esh_instances
+
+
+class InstanceHistoryTestCase(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.identity = IdentityFactory.create()
+        self.provider = self.identity.provider
+        self.user = self.identity.created_by
+        self.source = InstanceSource.objects.create(
+            provider=self.provider, identifier="image-1",
+            created_by=self.user, created_by_identity=self.identity)
+        self.tiny = self._size("1", "tiny")
+        self.small = self._size("2", "small")
+        self.active = InstanceStatus.objects.create(name="active")
+
+    def _size(self, alias, name):
+        return Size.objects.create(
+            alias=alias, name=name, provider=self.provider,
+            cpu=1, disk=0, root=0, mem=512)
+
+    def _instance(self, alias):
+        instance = Instance.objects.create(
+            name=alias, provider_alias=alias, source=self.source,
+            ip_address="10.0.0.1", created_by=self.user,
+            created_by_identity=self.identity,
+            start_date=self.now - timedelta(hours=2))
+        history = InstanceStatusHistory.objects.create(
+            instance=instance, size=self.tiny, status=self.active,
+            start_date=instance.start_date)
+        return instance, history
+
+    def _open_histories(self, instance):
+        return list(InstanceStatusHistory.objects.filter(
+            instance=instance, end_date=None))
+
+
+class TestBulkTransaction(InstanceHistoryTestCase):
+
+    def test_new_statuses(self):
+        vm1, history1 = self._instance("vm-1")
+        vm2, history2 = self._instance("vm-2")
+        new_histories = InstanceStatusHistory.bulk_transaction(
+            [("suspended", "suspending", vm1, self.tiny, history1),
+             ("active", None, vm2, self.small, history2)],
+            start_time=self.now)
+        self.assertEquals(len(new_histories), 2)
+        self.assertTrue(
+            InstanceStatus.objects.filter(name="suspended").exists())
+        for history in (history1, history2):
+            self.assertEquals(
+                InstanceStatusHistory.objects.get(id=history.id).end_date,
+                self.now)
+        [last_history] = self._open_histories(vm1)
+        self.assertEquals(
+            (last_history.status.name, last_history.activity,
+             last_history.start_date),
+            ("suspended", "suspending", self.now))
+        [last_history] = self._open_histories(vm2)
+        self.assertEquals(last_history.size, self.small)
+
+    def test_closed_history_is_skipped(self):
+        vm1, history1 = self._instance("vm-1")
+        vm2, history2 = self._instance("vm-2")
+        # Closed by another transaction (After it was read)
+        closed_at = self.now - timedelta(minutes=1)
+        InstanceStatusHistory.objects.filter(id=history1.id).update(
+            end_date=closed_at)
+        new_histories = InstanceStatusHistory.bulk_transaction(
+            [("suspended", None, vm1, self.tiny, history1),
+             ("suspended", None, vm2, self.tiny, history2)],
+            start_time=self.now)
+        self.assertEquals([history.instance for history in new_histories],
+                          [vm2])
+        self.assertEquals(self._open_histories(vm1), [])
+        self.assertEquals(
+            InstanceStatusHistory.objects.get(id=history1.id).end_date,
+            closed_at)
+
+    def test_no_changes(self):
+        self.assertEquals(InstanceStatusHistory.bulk_transaction([]), [])
+
+
+class TestConvertEshInstances(InstanceHistoryTestCase):
+
+    def _esh_instance(self, alias, status, size, ip="10.0.0.1"):
+        esh_instance = mock.Mock(id=alias, ip=ip, extra={'status': status})
+        esh_instance.size.id = size.alias
+        esh_instance.get_status.return_value = status
+        return esh_instance
+
+    @mock.patch('core.models.instance.convert_esh_instance')
+    def test_convert(self, convert_esh_instance):
+        vm1, _ = self._instance("vm-1")
+        vm2, _ = self._instance("vm-2")
+        vm3, history3 = self._instance("vm-3")
+        # Without a current history, converted on its own.
+        InstanceStatusHistory.objects.filter(id=history3.id).update(
+            end_date=self.now)
+        convert_esh_instance.side_effect = \
+            lambda driver, esh_instance, *args, **kwargs: esh_instance.id
+        size_catalog = mock.Mock()
+        size_catalog.get_core_size.side_effect = \
+            lambda alias: {"1": self.tiny, "2": self.small}[alias]
+        esh_instances = [
+            self._esh_instance("vm-1", "suspended", self.tiny),
+            self._esh_instance("vm-2", "active", self.small, ip="1.2.3.4"),
+            self._esh_instance("vm-3", "active", self.tiny),
+            self._esh_instance("vm-4", "active", self.tiny),
+        ]
+        driver = mock.Mock()
+        results = convert_esh_instances(
+            [(driver, esh_instance, self.identity.uuid, self.user)
+             for esh_instance in esh_instances],
+            self.provider.uuid, size_catalog)
+
+        self.assertEquals(
+            [getattr(result, 'id', result) for result in results],
+            [vm1.id, vm2.id, "vm-3", "vm-4"])
+        self.assertEquals(results[0].esh, esh_instances[0])
+        self.assertEquals(convert_esh_instance.call_count, 2)
+        [last_history] = self._open_histories(vm1)
+        self.assertEquals(
+            (last_history.status.name, last_history.size),
+            ("suspended", self.tiny))
+        # A new size is a new history, a new IP is saved.
+        [last_history] = self._open_histories(vm2)
+        self.assertEquals(
+            (last_history.status.name, last_history.size),
+            ("active", self.small))
+        self.assertEquals(
+            Instance.objects.get(id=vm2.id).ip_address, "1.2.3.4")
+
+    def test_unchanged(self):
+        vm1, history1 = self._instance("vm-1")
+        convert_esh_instances(
+            [(mock.Mock(), self._esh_instance("vm-1", "active", self.tiny),
+              self.identity.uuid, self.user)],
+            self.provider.uuid,
+            mock.Mock(get_core_size=mock.Mock(return_value=self.tiny)))
+        self.assertEquals(self._open_histories(vm1), [history1])
+
+
+@mock.patch('service.cache.invalidate_cached_allocation_checkpoint')
+class TestAllocationCheckpointInvalidation(InstanceHistoryTestCase):
+
+    def test_open_history(self, invalidate):
+        vm1, history1 = self._instance("vm-1")
+        history1.end_date = self.now
+        history1.save()
+        # An open history is never part of a checkpoint.
+        self.assertFalse(invalidate.called)
+
+    def test_closed_history(self, invalidate):
+        vm1, history1 = self._instance("vm-1")
+        history1.end_date = self.now
+        history1.save()
+        history1.end_date = self.now - timedelta(minutes=30)
+        history1.save()
+        invalidate.assert_called_once_with(self.identity)
+
+    def test_loaded_closed_history(self, invalidate):
+        vm1, history1 = self._instance("vm-1")
+        InstanceStatusHistory.objects.filter(id=history1.id).update(
+            end_date=self.now)
+        history = InstanceStatusHistory.objects.get(id=history1.id)
+        history.end_date = None
+        history.save()
+        invalidate.assert_called_once_with(self.identity)
+        invalidate.reset_mock()
+        history.delete()
+        self.assertFalse(invalidate.called)
+
+    def test_new_closed_history(self, invalidate):
+        vm1, history1 = self._instance("vm-1")
+        InstanceStatusHistory.objects.create(
+            instance=vm1, size=self.tiny, status=self.active,
+            start_date=self.now - timedelta(days=2),
+            end_date=self.now - timedelta(days=1))
+        invalidate.assert_called_once_with(self.identity)
+
+    def test_bulk_transaction(self, invalidate):
+        vm1, history1 = self._instance("vm-1")
+        InstanceStatusHistory.bulk_transaction(
+            [("suspended", None, vm1, self.tiny, history1)],
+            start_time=self.now)
+        self.assertFalse(invalidate.called)
+
@@ -0,0 +1,187 @@
+"""
+test usage rollup models
+"""
+from datetime import datetime, timedelta
+
+import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+import pytz
+
+from core.factories import IdentityFactory
+from core.models import (
+    AllocationStrategy, Instance, InstanceSource, InstanceStatus,
+    InstanceStatusHistory, Size, UsageRollup)
+from core.models.allocation_strategy import CountingBehavior
+from service.monitoring import get_usage_rollup
+
+
+class TestUsageRollup(TestCase):
+
+    def setUp(self):
+        self.calculated_at = timezone.now()
+        self.rollup = UsageRollup(
+            window_start=self.calculated_at - timedelta(days=10),
+            credit=100 * 3600.0, used=40 * 3600.0, remaining=60 * 3600.0,
+            burn_rate=2.0, calculated_at=self.calculated_at)
+
+    def test_extrapolated_usage(self):
+        one_hour_later = self.calculated_at + timedelta(hours=1)
+        self.assertEquals(
+            self.rollup.current_used(one_hour_later), 42 * 3600.0)
+        self.assertEquals(
+            self.rollup.current_remaining(one_hour_later), 58 * 3600.0)
+
+    def test_time_to_zero(self):
+        self.assertEquals(
+            self.rollup.time_to_zero(self.calculated_at),
+            self.calculated_at + timedelta(hours=30))
+
+    def test_time_to_zero_no_burn_rate(self):
+        self.rollup.burn_rate = 0.0
+        self.assertEquals(
+            self.rollup.time_to_zero(self.calculated_at),
+            datetime.max.replace(tzinfo=pytz.utc))
+
+    def test_time_to_zero_over_allocation(self):
+        self.rollup.remaining = -3600.0
+        self.assertEquals(
+            self.rollup.time_to_zero(self.calculated_at), self.calculated_at)
+
+    def test_is_current_window(self):
+        window_start = self.rollup.window_start
+        self.rollup.next_window_start = window_start + timedelta(days=30)
+        self.assertTrue(self.rollup.is_current_window(window_start))
+        self.assertTrue(self.rollup.is_current_window(self.calculated_at))
+        self.assertFalse(self.rollup.is_current_window(
+            window_start - timedelta(seconds=1)))
+        self.assertFalse(self.rollup.is_current_window(
+            self.rollup.next_window_start))
+        # The window never ends
+        self.rollup.next_window_start = None
+        self.assertTrue(self.rollup.is_current_window(
+            self.calculated_at + timedelta(days=365)))
+
+
+class TestNextWindowStart(TestCase):
+
+    def setUp(self):
+        self.identity = IdentityFactory.create()
+        self.identity.created_by.date_joined = datetime(
+            2016, 1, 20, tzinfo=pytz.utc)
+        self.now = datetime(2016, 3, 10, 12, tzinfo=pytz.utc)
+
+    def _next_window_start(self, counting_behavior):
+        strategy = AllocationStrategy(
+            provider=self.identity.provider,
+            counting_behavior=CountingBehavior(name=counting_behavior))
+        return strategy.get_next_window_start(self.identity, self.now)
+
+    def test_calendar_window(self):
+        self.assertEquals(
+            self._next_window_start("1 Month - Calendar Window"),
+            datetime(2016, 4, 1, tzinfo=pytz.utc))
+
+    def test_anniversary_window(self):
+        self.assertEquals(
+            self._next_window_start(
+                "1 Month - Calendar Window - Anniversary"),
+            datetime(2016, 3, 20, tzinfo=pytz.utc))
+        self.now = datetime(2016, 3, 20, tzinfo=pytz.utc)
+        self.assertEquals(
+            self._next_window_start(
+                "1 Month - Calendar Window - Anniversary"),
+            datetime(2016, 4, 20, tzinfo=pytz.utc))
+
+    def test_count_all_time(self):
+        self.assertIsNone(self._next_window_start("Count all time"))
+
+
+class TestUsageRollupDirty(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.identity = IdentityFactory.create()
+        provider = self.identity.provider
+        user = self.identity.created_by
+        source = InstanceSource.objects.create(
+            provider=provider, identifier="image-1", created_by=user,
+            created_by_identity=self.identity)
+        self.instance = Instance.objects.create(
+            name="vm-1", provider_alias="vm-1", source=source,
+            created_by=user, created_by_identity=self.identity,
+            start_date=self.now - timedelta(hours=2))
+        self.size = Size.objects.create(
+            alias="1", name="tiny", provider=provider,
+            cpu=1, disk=0, root=0, mem=512)
+        self.history = InstanceStatusHistory.objects.create(
+            instance=self.instance, size=self.size,
+            status=InstanceStatus.objects.create(name="active"),
+            start_date=self.instance.start_date)
+        self.rollup = UsageRollup.objects.create(
+            identity=self.identity, window_start=self.now - timedelta(days=1),
+            credit=100 * 3600.0, used=2 * 3600.0, remaining=98 * 3600.0,
+            burn_rate=1.0, calculated_at=self.now)
+
+    def _is_dirty(self):
+        return UsageRollup.objects.get(id=self.rollup.id).dirty
+
+    def test_status_change_marks_the_rollup_dirty(self):
+        InstanceStatusHistory.transaction(
+            "suspended", None, self.instance, self.size,
+            start_time=self.now, last_history=self.history)
+        self.assertTrue(self._is_dirty())
+
+    def test_bulk_status_change_marks_the_rollup_dirty(self):
+        InstanceStatusHistory.bulk_transaction(
+            [("suspended", None, self.instance, self.size, self.history)],
+            start_time=self.now)
+        self.assertTrue(self._is_dirty())
+
+    def test_end_date_all_marks_the_rollup_dirty(self):
+        self.instance.end_date_all(self.now)
+        self.assertTrue(self._is_dirty())
+
+    def test_strategy_change_marks_the_rollup_dirty(self):
+        AllocationStrategy.objects.create(
+            provider=self.identity.provider,
+            counting_behavior=CountingBehavior.objects.create(
+                name="Count all time"))
+        self.assertTrue(self._is_dirty())
+
+    @mock.patch('service.monitoring._get_allocation_result')
+    def test_rollup_from_a_previous_window_is_recalculated(
+            self, get_allocation_result):
+        UsageRollup.objects.filter(id=self.rollup.id).update(
+            next_window_start=self.now + timedelta(days=1))
+        # Reading a current rollup is a single query.
+        with self.assertNumQueries(1):
+            get_usage_rollup(self.identity)
+        self.assertFalse(get_allocation_result.called)
+
+        UsageRollup.objects.filter(id=self.rollup.id).update(
+            next_window_start=timezone.now())
+        get_usage_rollup(self.identity)
+        get_allocation_result.assert_called_once_with(
+            self.identity, incremental=True)
+
+    @mock.patch('service.monitoring._get_allocation_result')
+    def test_dirty_rollup_is_recalculated(self, get_allocation_result):
+        def recalculate(identity, incremental=False):
+            UsageRollup.objects.filter(id=self.rollup.id).update(
+                used=3 * 3600.0, calculated_at=self.now, dirty=False)
+        get_allocation_result.side_effect = recalculate
+
+        self.assertEquals(get_usage_rollup(self.identity).id, self.rollup.id)
+        self.assertFalse(get_allocation_result.called)
+
+        InstanceStatusHistory.transaction(
+            "suspended", None, self.instance, self.size,
+            start_time=self.now, last_history=self.history)
+        rollup = get_usage_rollup(self.identity)
+        get_allocation_result.assert_called_once_with(
+            self.identity, incremental=True)
+        self.assertFalse(rollup.dirty)
+        self.assertEquals(rollup.used, 3 * 3600.0)
@@ -75,17 +75,24 @@ def main():
 
 def create_accounts(acct_driver, provider, users, rebuild=False, admin=False):
     added = 0
+    new_users = []
     for user in users:
-        # Then add the Openstack Identity
+        id_exists = Identity.objects.filter(
+            created_by__username__iexact=user,
+            provider=provider)
+        if id_exists:
+            if not rebuild:
+                continue
+            print "%s Exists -- Attempting an account rebuild" % user
+        new_users.append(user)
+    # Then add the Openstack Identities
+    results = acct_driver.create_accounts(new_users, max_quota=admin)
+    for user in new_users:
+        if user not in results:
+            continue
         try:
-            id_exists = Identity.objects.filter(
-                created_by__username__iexact=user,
-                provider=provider)
-            if id_exists:
-                if not rebuild:
-                    continue
-                print "%s Exists -- Attempting an account rebuild" % user
-            acct_driver.create_account(user, max_quota=admin)
+            if isinstance(results[user], Exception):
+                raise results[user]
             added += 1
             if admin:
                 make_admin(user)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 import argparse
 from core.models import Provider, Identity
-from service.monitoring import _get_allocation_result
+from service.monitoring import _get_allocation_results
 import django
 django.setup()
 
@@ -64,7 +64,7 @@ def check_allocation_for(provider, idents):
     """
     Get the entire list first then print it all
     """
-    results = _get_results(idents)
+    results = _get_results(provider, idents)
     print "Username, AU Allowed, AU  Used, AU Burn Rate,"\
         " Instance(s) Contributing to BurnRate"
     for ident, result in results:
@@ -87,19 +87,12 @@ def check_allocation_for(provider, idents):
     return results
 
 
-def _get_results(idents):
-    results = []
-    total = len(idents)
-    for idx, ident in enumerate(idents):
-        try:
-            result = _get_allocation_result(ident)
-            results.append((ident, result))
-        except Exception as exc:
-            print "Error calculating for identity: %s" % ident
-            print exc
-
-        if total > 10 and idx % int(total / 10) == 0:
-            print "Calculating %s/%s.." % (idx, total)
+def _get_results(provider, idents):
+    print "Calculating %s allocations.." % len(idents)
+    results = _get_allocation_results(provider, idents)
+    if len(results) != len(idents):
+        print "Error calculating for %s identities"\
+            % (len(idents) - len(results))
     return results
 
 if __name__ == "__main__":
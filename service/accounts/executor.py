@@ -0,0 +1,170 @@
+"""
+Concurrent, rate-limited calls to the cloud for the account drivers.
+
+    executor = account_driver.executor
+    members = executor.map(
+        lambda image_id: image_manager.shared_images_for(image_id=image_id),
+        image_ids)
+
+* Calls run on a bounded thread pool (settings.ACCOUNT_DRIVER_WORKERS)
+* Calls to a provider share one rate limit, in each process
+  (settings.ACCOUNT_DRIVER_RATE_LIMIT calls per second)
+* Calls that fail with a transient error (Connection errors, 'over limit'
+  and 5xx responses) are retried with exponential backoff
+"""
+from multiprocessing.pool import ThreadPool
+import random
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from novaclient.exceptions import OverLimit
+from requests.exceptions import ConnectionError
+
+from threepio import logger
+
+# Exceptions that are always worth a retry
+RETRY_EXCEPTIONS = (ConnectionError, socket.error, OverLimit)
+# ... and the HTTP status codes (From any of the openstack clients)
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+def _is_transient(exc):
+    if isinstance(exc, RETRY_EXCEPTIONS):
+        return True
+    for attr in ('http_status', 'status_code', 'code'):
+        if getattr(exc, attr, None) in RETRY_STATUS_CODES:
+            return True
+    return False
+
+
+class RateLimiter(object):
+
+    """
+    Token bucket: Allow 'rate' calls per second (With bursts of 'burst')
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a call is allowed.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider_id, rate):
+    """
+    Returns the (process wide) RateLimiter of a provider
+    (Or None when 'rate' is not set)
+    """
+    if not rate:
+        return None
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(provider_id)
+        if not limiter or limiter.rate != rate:
+            limiter = RateLimiter(rate)
+            _rate_limiters[provider_id] = limiter
+        return limiter
+
+
+class CloudExecutor(object):
+
+    """
+    Run cloud calls for a provider concurrently, with a rate limit
+    and retries. See 'call' and 'map'.
+    """
+
+    def __init__(self, provider=None, max_workers=None, rate_limit=None,
+                 retries=None, backoff=None):
+        self.provider = provider
+        self.max_workers = max_workers or getattr(
+            settings, 'ACCOUNT_DRIVER_WORKERS', 8)
+        if rate_limit is None:
+            rate_limit = getattr(settings, 'ACCOUNT_DRIVER_RATE_LIMIT', None)
+        self.limiter = get_rate_limiter(
+            provider.id if provider else None, rate_limit)
+        self.retries = retries if retries is not None else getattr(
+            settings, 'ACCOUNT_DRIVER_RETRIES', 3)
+        self.backoff = backoff if backoff is not None else getattr(
+            settings, 'ACCOUNT_DRIVER_BACKOFF', 1.0)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Returns func(*args, **kwargs), retrying transient errors.
+        """
+        attempt = 0
+        while True:
+            if self.limiter:
+                self.limiter.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as exc:
+                if attempt >= self.retries or not _is_transient(exc):
+                    raise
+                delay = self.backoff * (2 ** attempt) \
+                    + random.uniform(0, self.backoff)
+                attempt += 1
+                logger.warn("Retrying %s (%s/%s) in %.1fs: %r"
+                            % (getattr(func, '__name__', func), attempt,
+                               self.retries, delay, exc))
+                time.sleep(delay)
+
+    def _call_item(self, func, item, return_exceptions):
+        try:
+            return self.call(func, item)
+        except Exception as exc:
+            if not return_exceptions:
+                raise
+            return exc
+
+    def _call_in_thread(self, args):
+        try:
+            return self._call_item(*args)
+        finally:
+            # Each thread has its own database connection.
+            connection.close()
+
+    def map(self, func, items, return_exceptions=False):
+        """
+        Returns [func(item) for item in items], running up to
+        'max_workers' calls at a time.
+        If return_exceptions=True, a failed call returns its exception
+        (Instead of raising it).
+        """
+        items = list(items)
+        if not items:
+            return []
+        workers = min(self.max_workers, len(items))
+        call_args = [(func, item, return_exceptions) for item in items]
+        if workers <= 1:
+            return [self._call_item(*args) for args in call_args]
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(self._call_in_thread, call_args)
+        finally:
+            pool.close()
+            pool.join()
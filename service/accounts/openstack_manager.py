@@ -34,6 +34,7 @@ from core.ldap import get_uid_number
 from core.models.identity import Identity
 
 from service.accounts.base import BaseAccountDriver
+from service.accounts.executor import CloudExecutor
 
 
 def get_unique_id(userid):
@@ -55,6 +56,7 @@ class AccountDriver(BaseAccountDriver):
     image_manager = None
     network_manager = None
     core_provider = None
+    _executor = None
 
     MASTER_RULES_LIST = [
         ("ICMP", -1, -1),
@@ -95,6 +97,15 @@ class AccountDriver(BaseAccountDriver):
 
     ]
 
+    @property
+    def executor(self):
+        """
+        Concurrent, rate-limited (and retried) cloud calls for this provider
+        """
+        if not self._executor:
+            self._executor = CloudExecutor(self.core_provider)
+        return self._executor
+
     def clear_cache(self):
         self.admin_driver.provider.machineCls.invalidate_provider_cache(
                 self.admin_driver.provider)
@@ -151,6 +162,43 @@ class AccountDriver(BaseAccountDriver):
         self.network_manager = NetworkManager(**net_creds)
         self.openstack_sdk = _connect_to_openstack_sdk(**sdk_creds)
 
+    def create_accounts(self, usernames, password=None, role_name=None,
+                        quota=None, max_quota=False):
+        """
+        'create_account' for every user in 'usernames'.
+        Returns {username: Identity (Or the exception raised)}
+        NOTE: Only the cloud calls ('build_account') are made concurrently.
+        The identities are created afterwards, one at a time, on this thread
+        (Not on a connection per thread, racing for the default quota..)
+        """
+        if not self.core_provider:
+            raise Exception("AccountDriver not initialized by provider,"
+                            " cannot create identity. For account creation use"
+                            " build_account()")
+        admin_names = self.core_provider.list_admin_names()
+        usernames = [username for username in usernames
+                     if username not in admin_names]
+        accounts = self.executor.map(
+            lambda username: self.build_account(
+                username, password, role_name=role_name,
+                max_quota=max_quota),
+            usernames, return_exceptions=True)
+        results = {}
+        for username, account in zip(usernames, accounts):
+            if isinstance(account, Exception):
+                results[username] = account
+                continue
+            (username, account_password, project) = account
+            try:
+                results[username] = self.create_identity(
+                    username, account_password, project.name,
+                    quota=quota, max_quota=max_quota)
+            except Exception as exc:
+                logger.exception("Could not create the identity of %s"
+                                 % username)
+                results[username] = exc
+        return results
+
     def create_account(self, username, password=None, project_name=None,
                        role_name=None, quota=None, max_quota=False):
         """
@@ -324,7 +372,7 @@ class AccountDriver(BaseAccountDriver):
 
     def add_rules_to_security_groups(self, core_identity_list,
                                      security_group_name, rules_list):
-        for identity in core_identity_list:
+        def _add_rules(identity):
             creds = self.parse_identity(identity)
             sec_group = self.user_manager.find_security_group(
                 creds["username"], creds["password"], creds["tenant_name"],
@@ -335,6 +383,7 @@ class AccountDriver(BaseAccountDriver):
             self.user_manager.add_security_group_rules(
                 creds["username"], creds["password"], creds["tenant_name"],
                 security_group_name, rules_list)
+        self.executor.map(_add_rules, core_identity_list)
 
     def get_or_create_keypair(self, username, password, project_name,
                               keyname, public_key):
@@ -545,6 +594,35 @@ class AccountDriver(BaseAccountDriver):
         """
         return username
 
+    def shared_images_for_many(self, image_ids):
+        """
+        Returns {image_id: set(member_id, ...)} for every image in 'image_ids'
+        NOTE: The value is None when the members could not be listed.
+        """
+        image_ids = list(image_ids)
+        results = self.executor.map(
+            lambda image_id: set(
+                member.member_id for member in
+                self.image_manager.shared_images_for(image_id=image_id)),
+            image_ids, return_exceptions=True)
+        image_members = {}
+        for image_id, result in zip(image_ids, results):
+            if isinstance(result, Exception):
+                logger.warn("Could not list the members of image %s: %r"
+                            % (image_id, result))
+                result = None
+            image_members[image_id] = result
+        return image_members
+
+    def share_images(self, shares):
+        """
+        Share every (glance_image, project_name) in 'shares', concurrently.
+        Returns a list with the result (Or the exception raised) of each.
+        """
+        return self.executor.map(
+            lambda share: self.image_manager.share_image(*share),
+            shares, return_exceptions=True)
+
     def _get_image(self, *args, **kwargs):
         return self.image_manager.get_image(*args, **kwargs)
 
@@ -565,6 +643,7 @@ class AccountDriver(BaseAccountDriver):
         * include_empty (bool) - If True, include ALL tenants in the map.
         """
         all_projects = self.list_projects()
+        projects_by_id = {proj.id: proj for proj in all_projects}
         all_instances = self.list_all_instances()
         if include_empty:
             project_map = {proj: [] for proj in all_projects}
@@ -575,7 +654,7 @@ class AccountDriver(BaseAccountDriver):
                 # NOTE: will someday be 'projectId'
                 tenant_id = instance.extra['tenantId']
 
-                project = [p for p in all_projects if p.id == tenant_id][0]
+                project = projects_by_id[tenant_id]
             except (ValueError, KeyError):
                 raise Exception(
                     "The implementaion for recovering a tenant id has changed. Update the code base above this line!")
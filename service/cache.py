@@ -1,16 +1,36 @@
 import cPickle as pickle
+from collections import OrderedDict
+import copy
+from datetime import datetime
+from importlib import import_module
+import json
+import threading
+import time
+import uuid
+import zlib
+
+from dateutil import parser as date_parser
+
+from django import db
 from django.conf import settings
 from django.utils import timezone
 
 import redis
 
+from rtwo.instance import Instance as EshInstance
+from rtwo.machine import BaseMachine
+from rtwo.size import BaseSize
+from rtwo.volume import BaseVolume
+
 from threepio import logger
 
-from service.driver import get_esh_driver, get_admin_driver
+from core.models.size import Size, convert_esh_size
+from core.query import only_current
+
+from service.driver import get_account_driver, get_esh_driver,\
+    get_admin_driver, invalidate_esh_driver
 
 
-admin_drivers = {}
-drivers = {}
 connection = None
 
 INSTANCES_KEY_PROVIDER = "instances.{0}"
@@ -19,20 +39,118 @@ VOLUMES_KEY_PROVIDER = "volumes.{0}"
 VOLUMES_KEY_IDENTITY = "volumes.{0}.{1}"
 MACHINES_KEY_PROVIDER = "machines.{0}"
 MACHINES_KEY_IDENTITY = "machines.{0}.{1}"
-
-
-def _get_cached_admin_driver(provider, force=True):
-    if not admin_drivers.get(provider) or force:
-        admin_drivers[provider] = get_admin_driver(provider)
-    return admin_drivers[provider]
-
-
-def _get_cached_driver(provider=None, identity=None, force=True):
+SIZES_KEY_PROVIDER = "sizes.{0}"
+PROJECTS_KEY_PROVIDER = "projects.{0}"
+PROJECTS_REFRESHED_KEY_PROVIDER = "projects.{0}.refreshed"
+ALLOCATION_CHECKPOINT_KEY_IDENTITY = "allocation_checkpoint.{0}"
+# Number of values cached with pickle (See '_serialize')
+PICKLE_FALLBACKS_KEY = "cache.pickle_fallbacks"
+# A checkpoint is only useful for the current allocation window.
+# (Invalidated when a closed history of the identity changes)
+ALLOCATION_CHECKPOINT_EXPIRES = 31 * 24 * 60 * 60
+# key_type: (Seconds a value is fresh,
+#            Seconds a value may be served stale, while it is refreshed)
+# Override with settings.DRIVER_CACHE_TTLS
+DRIVER_CACHE_TTLS = {
+    "instances": (30, 5 * 60),
+    "volumes": (30, 5 * 60),
+    "machines": (5 * 60, 60 * 60),
+    # Refreshed by 'monitor_sizes_for' (Every 30 minutes)
+    "sizes": (35 * 60, 60 * 60),
+    # Refreshed by 'refresh_project_directory_for' (Every 15 minutes)
+    "projects": (20 * 60, 60 * 60),
+}
+# Number of keys kept in the in-process tier
+LOCAL_CACHE_SIZE = 256
+# Seconds a caller may hold the lock to refresh a key
+REFRESH_LOCK_TIMEOUT = 60
+# Seconds between two refreshes of a ProjectDirectory for an unknown id
+# Override with settings.PROJECT_DIRECTORY_MISS_INTERVAL
+PROJECT_DIRECTORY_MISS_INTERVAL = 60
+# Cloud (rtwo) objects are cached as compact JSON: Only the fields read
+# by callers are kept, and they are loaded as read-only copies
+# (See CachedCloudObject)
+CACHED_FIELDS = (
+    (EshInstance, ("id", "alias", "name", "owner", "ip", "extra", "size",
+                   "source")),
+    (BaseSize, ("id", "alias", "name", "price", "ram", "disk", "cpu",
+                "ephemeral", "bandwidth", "extra")),
+    (BaseMachine, ("id", "alias", "name")),
+    (BaseVolume, ("id", "alias", "name", "size", "attachment_set",
+                  "extra")),
+)
+# Scrubbed fields (See '_scrub'), always None on a cached object
+CACHED_SCRUBBED_FIELDS = ("_connection", "_node", "_volume", "_image",
+                          "_size")
+# The raw API response in 'extra' is only read for these keys
+CACHED_EXTRA_OBJECT_KEYS = ("OS-EXT-SRV-ATTR:hypervisor_hostname",
+                            "os-extended-volumes:volumes_attached")
+# Keys that mark an encoded (non-JSON) value
+CACHED_MARKER_KEYS = ("__datetime__", "__tuple__", "__items__", "__class__")
+
+
+class _LRUCache(object):
+
+    """
+    A thread-safe, in-process LRU (The front tier of '_get_cached')
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+local_cache = _LRUCache(LOCAL_CACHE_SIZE)
+# Keys (and lock tokens) being refreshed by this process
+refreshing = {}
+refreshing_lock = threading.Lock()
+
+
+def _get_cached_admin_driver(provider, force=False):
+    return get_admin_driver(provider, force=force)
+
+
+def _get_cached_driver(provider=None, identity=None, force=False):
+    """
+    Drivers are pooled by service.driver (See DriverPool).
+    If force=True, the pooled driver is NOT re-used.
+    """
     if provider:
         return _get_cached_admin_driver(provider, force)
-    if not drivers.get(identity) or force:
-        drivers[identity] = get_esh_driver(identity)
-    return drivers[identity]
+    if force:
+        invalidate_esh_driver(identity)
+    return get_esh_driver(identity)
+
+
+def _driver_method(provider, identity, method_name):
+    """
+    Returns a data method that calls 'method_name' on the driver of the
+    thread running it: A background refresh must not share the (not
+    thread-safe) driver of the caller.
+    """
+    def _call_driver():
+        driver = _get_cached_driver(provider=provider, identity=identity)
+        return getattr(driver, method_name)()
+    return _call_driver
 
 
 def redis_connection():
@@ -42,32 +160,340 @@ def redis_connection():
     return connection
 
 
+def _redis_not_running():
+    logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                 "Somebody should turn it on!")
+
+
 def _invalidate(key):
-    r = redis_connection()
-    if key:
-        r.delete(key)
+    if not key:
+        return
+    local_cache.delete(key)
+    try:
+        redis_connection().delete(key)
+    except redis.exceptions.ConnectionError:
+        _redis_not_running()
+
+
+def _cache_ttl(key):
+    """
+    Returns (fresh, stale) seconds for the key type (The prefix of 'key')
+    """
+    key_type = key.split(".")[0]
+    cache_ttls = getattr(settings, "DRIVER_CACHE_TTLS", {})
+    return cache_ttls.get(key_type,
+                          DRIVER_CACHE_TTLS.get(key_type, (30, 0)))
 
 
 def _get_cached(key, data_method, scrub_method, force=False):
+    """
+    Two-tier cache for driver results: An in-process LRU, then redis.
+    * A fresh value is returned as-is.
+    * A stale value is returned while ONE caller refreshes it in the
+      background.
+    * On a miss, ONE caller calls 'data_method' while the others wait
+      for its result.
+    """
+    if force:
+        _invalidate(key)
+        return _refresh_cached(key, data_method, scrub_method)
+    entry = _get_entry(key)
+    now = time.time()
+    if entry and now < entry[0]:
+        return _deserialize(entry[2])
+    if entry and now < entry[1]:
+        if _acquire_refresh(key):
+            refresh = threading.Thread(
+                target=_background_refresh,
+                args=(key, data_method, scrub_method))
+            refresh.daemon = True
+            refresh.start()
+        return _deserialize(entry[2])
+    if _acquire_refresh(key):
+        try:
+            return _refresh_cached(key, data_method, scrub_method)
+        finally:
+            _release_refresh(key)
+    data = _wait_for_refresh(key)
+    if data is not None:
+        return data
+    logger.warn("Timed out waiting for redis({0}) to be refreshed"
+                .format(key))
+    return _refresh_cached(key, data_method, scrub_method)
+
+
+def _get_entry(key):
+    """
+    Returns the entry (fresh_until, stale_until, payload) for 'key'
+    from the in-process tier, or from redis (Or None)
+    """
+    entry = local_cache.get(key)
+    if entry and time.time() < entry[0]:
+        return entry
     try:
-        r = redis_connection()
-        if force:
-            _invalidate(key)
-        data = r.get(key)
+        data = redis_connection().get(key)
     except redis.exceptions.ConnectionError:
-        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
-                     "Somebody should turn it on!")
-        data = None
+        _redis_not_running()
+        return entry
     if not data:
-        data = data_method()
-        scrub_method(data)
-        logger.debug("Updated redis({0}) using {1} and {2}".format(
-            key, data_method, scrub_method))
-        r.set(key, pickle.dumps(data))
-        r.expire(key, 30)
-        return data
-    logger.debug("Actual type {0}".format(type(data)))
-    return pickle.loads(data)
+        # Invalidated (Or expired) by another process.
+        local_cache.delete(key)
+        return None
+    try:
+        entry = pickle.loads(data)
+    except Exception:
+        logger.exception("Could not load redis({0})".format(key))
+        return None
+    if not isinstance(entry, tuple):
+        # Saved without fresh/stale dates -- Treat as a miss.
+        return None
+    local_cache.set(key, entry)
+    return entry
+
+
+def _refresh_cached(key, data_method, scrub_method):
+    data = data_method()
+    scrub_method(data)
+    (fresh, stale) = _cache_ttl(key)
+    now = time.time()
+    entry = (now + fresh, now + fresh + stale, _serialize(data))
+    local_cache.set(key, entry)
+    try:
+        redis_connection().set(
+            key, pickle.dumps(entry, pickle.HIGHEST_PROTOCOL),
+            ex=int(fresh + stale))
+    except redis.exceptions.ConnectionError:
+        _redis_not_running()
+    logger.debug("Updated redis({0}) using {1} and {2}".format(
+        key, data_method, scrub_method))
+    return data
+
+
+def _background_refresh(key, data_method, scrub_method):
+    try:
+        _refresh_cached(key, data_method, scrub_method)
+    except Exception:
+        logger.exception("Could not refresh redis({0})".format(key))
+    finally:
+        _release_refresh(key)
+        # Each thread has its own database connection.
+        db.connection.close()
+
+
+def _acquire_refresh(key):
+    """
+    Single-flight: Returns True if this caller should refresh 'key'
+    """
+    token = uuid.uuid4().hex
+    with refreshing_lock:
+        if key in refreshing:
+            return False
+        refreshing[key] = token
+    try:
+        acquired = redis_connection().set(
+            key + ".lock", token, nx=True, ex=REFRESH_LOCK_TIMEOUT)
+    except redis.exceptions.ConnectionError:
+        _redis_not_running()
+        acquired = True
+    if not acquired:
+        with refreshing_lock:
+            refreshing.pop(key, None)
+    return bool(acquired)
+
+
+def _release_refresh(key):
+    with refreshing_lock:
+        token = refreshing.pop(key, None)
+    try:
+        r = redis_connection()
+        if token and r.get(key + ".lock") == token:
+            r.delete(key + ".lock")
+    except redis.exceptions.ConnectionError:
+        _redis_not_running()
+
+
+def _wait_for_refresh(key, interval=0.25):
+    """
+    Wait for another caller to refresh 'key'.
+    Returns the refreshed data (Or None, if the refresh did not finish)
+    """
+    waited = 0
+    while waited < REFRESH_LOCK_TIMEOUT:
+        time.sleep(interval)
+        waited += interval
+        entry = _get_entry(key)
+        if entry and time.time() < entry[1]:
+            return _deserialize(entry[2])
+    return None
+
+
+def _serialize(data):
+    """
+    Returns the payload for 'data':
+    'J' + compressed, compact JSON (Or 'P' + pickle, when the data
+    includes objects that can not be encoded)
+    """
+    try:
+        return "J" + zlib.compress(
+            json.dumps(_encode(data), separators=(",", ":")), 1)
+    except (TypeError, ValueError, RuntimeError) as exc:
+        # Objects that are not cached as JSON (TypeError), or data that
+        # is circular/nested too deep to encode (RuntimeError, ValueError)
+        logger.error("Could not encode %s, using pickle: %s"
+                     % (type(data), exc))
+        _count_pickle_fallback()
+        return "P" + pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+
+def _count_pickle_fallback():
+    try:
+        redis_connection().incr(PICKLE_FALLBACKS_KEY)
+    except redis.exceptions.ConnectionError:
+        _redis_not_running()
+
+
+def _deserialize(payload):
+    if payload[0] == "P":
+        return pickle.loads(payload[1:])
+    return _decode(json.loads(zlib.decompress(payload[1:])))
+
+
+class CachedCloudObject(object):
+
+    """
+    A read-only copy of a cloud (rtwo) object, loaded from the cache.
+    Only the fields in CACHED_FIELDS are set (Fields that were not, read
+    the class attribute). It is an instance of a subclass of the original
+    class, so 'isinstance' checks and methods that read those fields
+    (i.e. get_status) work as before. See 'copy_with' to change a field.
+    """
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is a read-only copy from the cache"
+                             % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        self.__setattr__(name, None)
+
+    def __getattr__(self, name):
+        if name in CACHED_SCRUBBED_FIELDS:
+            return None
+        raise AttributeError("'%s' is not cached for %s"
+                             % (name, self.__class__.__name__))
+
+    def __reduce__(self):
+        # The (generated) class can not be pickled by name.
+        return (_cached_copy, (_cloud_class(self), self.__dict__))
+
+
+_cached_classes = {}
+
+
+def _cached_class(cls):
+    """
+    Returns the CachedCloudObject subclass of 'cls'
+    """
+    cached_cls = _cached_classes.get(cls)
+    if not cached_cls:
+        cached_cls = type(cls)(cls.__name__, (CachedCloudObject, cls),
+                               {"__module__": cls.__module__})
+        _cached_classes[cls] = cached_cls
+    return cached_cls
+
+
+def _cached_copy(cls, fields):
+    """
+    Returns the read-only copy of a 'cls' object with 'fields'
+    """
+    instance = object.__new__(_cached_class(cls))
+    instance.__dict__.update(fields)
+    return instance
+
+
+def _cloud_class(obj):
+    """
+    Returns the (rtwo) class of 'obj' (And of its cached copy)
+    """
+    cls = obj.__class__
+    if isinstance(obj, CachedCloudObject):
+        return cls.__bases__[1]
+    return cls
+
+
+def _cached_fields(cls):
+    for base, fields in CACHED_FIELDS:
+        if issubclass(cls, base):
+            return fields
+    return None
+
+
+def copy_with(obj, **fields):
+    """
+    Returns a copy of the cloud object 'obj' (Cached, or not), where
+    'fields' are replaced.
+    """
+    new_obj = copy.copy(obj)
+    new_obj.__dict__.update(fields)
+    return new_obj
+
+
+def _encode(obj, name=None):
+    if obj is None or isinstance(obj, (basestring, bool, int, long, float)):
+        return obj
+    if isinstance(obj, datetime):
+        return {"__datetime__": obj.isoformat()}
+    if isinstance(obj, dict):
+        if name == "extra" and "object" in obj:
+            obj = dict(obj)
+            obj["object"] = dict(
+                (key, value) for key, value in obj["object"].items()
+                if key in CACHED_EXTRA_OBJECT_KEYS)
+        if all(isinstance(key, basestring) and key not in CACHED_MARKER_KEYS
+               for key in obj):
+            return dict((key, _encode(value, key))
+                        for key, value in obj.items())
+        # JSON keys are strings, keep the keys as they are.
+        return {"__items__": [[_encode(key), _encode(value, key)]
+                              for key, value in obj.items()]}
+    if isinstance(obj, tuple):
+        return {"__tuple__": [_encode(value) for value in obj]}
+    if isinstance(obj, list):
+        return [_encode(value) for value in obj]
+    cls = _cloud_class(obj)
+    cached_fields = _cached_fields(cls)
+    if cached_fields is None:
+        raise TypeError("%s can not be cached" % cls)
+    fields = dict((field, _encode(obj.__dict__[field], field))
+                  for field in cached_fields if field in obj.__dict__)
+    return {"__class__": "%s.%s" % (cls.__module__, cls.__name__),
+            "__fields__": fields}
+
+
+def _decode(obj):
+    if isinstance(obj, list):
+        return [_decode(value) for value in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if "__datetime__" in obj:
+        return date_parser.parse(obj["__datetime__"])
+    if "__tuple__" in obj:
+        return tuple(_decode(value) for value in obj["__tuple__"])
+    if "__items__" in obj:
+        return dict((_decode(key), _decode(value))
+                    for key, value in obj["__items__"])
+    if "__class__" not in obj:
+        return dict((key, _decode(value)) for key, value in obj.items())
+    (module_name, class_name) = obj["__class__"].rsplit(".", 1)
+    cls = getattr(import_module(module_name), class_name, None)\
+        if module_name.startswith("rtwo.") else None
+    cached_fields = _cached_fields(cls) if isinstance(cls, type) else None
+    if cached_fields is None:
+        raise ValueError("%s can not be loaded from the cache"
+                         % obj["__class__"])
+    return _cached_copy(cls, dict(
+        (str(field), _decode(value))
+        for field, value in obj["__fields__"].items()
+        if field in cached_fields))
 
 
 def _scrub(objects):
@@ -81,12 +507,16 @@ def _scrub(objects):
                 o.size._size = None
 
 
+def _no_scrub(data):
+    pass
+
+
 def _validate_parameters(provider, identity):
     if provider and identity:
         raise Exception("Use either provider or identity but not both.")
 
 
-def get_cached_driver(provider=None, identity=None, force=True):
+def get_cached_driver(provider=None, identity=None, force=False):
     _validate_parameters(provider, identity)
     return _get_cached_driver(provider=provider,
                               identity=identity,
@@ -95,17 +525,16 @@ def get_cached_driver(provider=None, identity=None, force=True):
 
 def get_cached_instances(provider=None, identity=None, force=False):
     _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
 
     #NOTE: THIS IS A HACK -- The 'admin' user should be able to see "All the things" -- HOWEVER
     # In the current implementation of liberty on jetstream, a call to 'list_all_tenants'
     # Made by a user with a single tenant will produce *IDENTICAL* results to that same call made by admin.
     # THIS IS CONSIDERED HARMFUL! So we have blocked all users except the admin accounts from making this call.
     if identity and identity.created_by and identity.created_by.username in ['atmoadmin', 'admin']:
-        instances_method = cached_driver.list_all_instances
+        instances_method = _driver_method(
+            provider, identity, "list_all_instances")
     else:
-        instances_method = cached_driver.list_instances
+        instances_method = _driver_method(provider, identity, "list_instances")
 
     if provider:
         key = INSTANCES_KEY_PROVIDER.format(provider.id)
@@ -129,9 +558,7 @@ def invalidate_cached_instances(provider=None, identity=None):
 
 def get_cached_volumes(provider=None, identity=None, force=False):
     _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
-    volumes_method = cached_driver.list_all_volumes
+    volumes_method = _driver_method(provider, identity, "list_all_volumes")
     if provider:
         key = VOLUMES_KEY_PROVIDER.format(provider.id)
     else:
@@ -154,9 +581,7 @@ def invalidate_cached_volumes(provider=None, identity=None):
 
 def get_cached_machines(provider=None, identity=None, force=False):
     _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
-    machines_method = cached_driver.list_machines
+    machines_method = _driver_method(provider, identity, "list_machines")
     if provider:
         key = MACHINES_KEY_PROVIDER.format(provider.id)
     else:
@@ -175,3 +600,184 @@ def invalidate_cached_machines(provider=None, identity=None):
         key = MACHINES_KEY_IDENTITY.format(identity.created_by.username,
                                            identity.id)
     _invalidate(key)
+
+
+class SizeCatalog(object):
+
+    """
+    The sizes (flavors) of a provider, keyed by flavor id.
+    Holds the esh size and the core Size, so flavor lookups during a
+    monitoring sweep do not require the driver (or a query per instance).
+    """
+
+    def __init__(self, provider, esh_sizes):
+        self.provider = provider
+        self.esh_sizes = dict((esh_size.id, esh_size)
+                              for esh_size in esh_sizes)
+        self.core_sizes = None
+
+    def get_esh_size(self, size_id):
+        return self.esh_sizes.get(size_id)
+
+    def get_core_size(self, size_id):
+        """
+        Returns the core Size for 'size_id' (Or None, if the flavor is
+        unknown). The core Size is created/updated when it does not match
+        the esh size.
+        """
+        if self.core_sizes is None:
+            self.core_sizes = dict(
+                (core_size.alias, core_size)
+                for core_size in Size.objects.filter(
+                    only_current(), provider=self.provider))
+        esh_size = self.esh_sizes.get(size_id)
+        core_size = self.core_sizes.get(size_id)
+        if not esh_size:
+            return core_size
+        if not core_size or not _size_matches(core_size, esh_size):
+            core_size = convert_esh_size(esh_size, self.provider.uuid)
+            self.core_sizes[size_id] = core_size
+        core_size.esh = esh_size
+        return core_size
+
+    def __len__(self):
+        return len(self.esh_sizes)
+
+
+def _size_matches(core_size, esh_size):
+    return (core_size.name == esh_size.name and
+            core_size.disk == esh_size.disk and
+            core_size.root == esh_size.ephemeral and
+            core_size.cpu == esh_size.cpu and
+            core_size.mem == esh_size.ram)
+
+
+def get_cached_size_catalog(provider, force=False):
+    """
+    Returns the SizeCatalog for 'provider'.
+    force=True refreshes the catalog (See 'monitor_sizes_for')
+    """
+    def _list_sizes():
+        return get_admin_driver(provider).list_sizes()
+    key = SIZES_KEY_PROVIDER.format(provider.uuid)
+    return SizeCatalog(provider,
+                       _get_cached(key, _list_sizes, _scrub, force=force))
+
+
+def invalidate_cached_size_catalog(provider):
+    _invalidate(SIZES_KEY_PROVIDER.format(provider.uuid))
+
+
+class ProjectDirectory(object):
+
+    """
+    The (Keystone) projects of a provider, as {project_id: project_name}
+    Shared by every task that needs to map tenant ids to names.
+    """
+
+    def __init__(self, provider, project_names):
+        self.provider = provider
+        self.project_names = project_names
+
+    def get_name(self, project_id):
+        return self.project_names.get(project_id)
+
+    def missing(self, project_ids):
+        """
+        Returns the ids in 'project_ids' that are not in the directory
+        """
+        return set(project_ids) - set(self.project_names)
+
+    def __contains__(self, project_id):
+        return project_id in self.project_names
+
+    def __len__(self):
+        return len(self.project_names)
+
+
+def get_cached_project_directory(provider, account_driver=None,
+                                 project_ids=None, force=False):
+    """
+    Returns the ProjectDirectory for 'provider'.
+    The directory is refreshed (once) when any of 'project_ids' is unknown,
+    so new projects are found before the next periodic refresh.
+    These refreshes are limited to one per provider every
+    PROJECT_DIRECTORY_MISS_INTERVAL seconds (Ids that are never found,
+    like deleted projects, would otherwise re-list Keystone every call)
+    force=True refreshes the directory (See 'refresh_project_directory_for')
+    """
+    caller = threading.current_thread()
+
+    def _list_projects():
+        # (In a background refresh, use an account driver of its own)
+        driver = account_driver \
+            if threading.current_thread() is caller else None
+        driver = driver or get_account_driver(provider)
+        return dict((project.id, project.name)
+                    for project in driver.list_projects())
+    key = PROJECTS_KEY_PROVIDER.format(provider.uuid)
+    directory = ProjectDirectory(
+        provider, _get_cached(key, _list_projects, _no_scrub, force=force))
+    if not force and project_ids and directory.missing(project_ids) \
+            and _acquire_miss_refresh(provider):
+        directory = ProjectDirectory(
+            provider, _get_cached(key, _list_projects, _no_scrub, force=True))
+    return directory
+
+
+def _acquire_miss_refresh(provider):
+    """
+    Returns True if the ProjectDirectory of 'provider' should be refreshed
+    for an unknown project id (Not refreshed for one in the last interval)
+    """
+    interval = getattr(settings, "PROJECT_DIRECTORY_MISS_INTERVAL",
+                       PROJECT_DIRECTORY_MISS_INTERVAL)
+    try:
+        return bool(redis_connection().set(
+            PROJECTS_REFRESHED_KEY_PROVIDER.format(provider.uuid), "1",
+            nx=True, ex=interval))
+    except redis.exceptions.ConnectionError:
+        _redis_not_running()
+        return True
+
+
+def invalidate_cached_project_directory(provider):
+    _invalidate(PROJECTS_KEY_PROVIDER.format(provider.uuid))
+
+
+def get_cached_allocation_checkpoint(identity):
+    """
+    Returns the last AllocationCheckpoint saved for 'identity' (Or None)
+    """
+    key = ALLOCATION_CHECKPOINT_KEY_IDENTITY.format(identity.uuid)
+    try:
+        data = redis_connection().get(key)
+    except redis.exceptions.ConnectionError:
+        _redis_not_running()
+        return None
+    if not data:
+        return None
+    try:
+        return pickle.loads(data)
+    except Exception:
+        logger.exception("Could not load allocation checkpoint %s" % key)
+        _invalidate(key)
+        return None
+
+
+def set_cached_allocation_checkpoint(identity, checkpoint):
+    key = ALLOCATION_CHECKPOINT_KEY_IDENTITY.format(identity.uuid)
+    try:
+        r = redis_connection()
+        if not checkpoint:
+            _invalidate(key)
+            return
+        r.set(key, pickle.dumps(checkpoint, pickle.HIGHEST_PROTOCOL))
+        r.expire(key, ALLOCATION_CHECKPOINT_EXPIRES)
+    except redis.exceptions.ConnectionError:
+        _redis_not_running()
+
+
+def invalidate_cached_allocation_checkpoint(identity):
+    key = ALLOCATION_CHECKPOINT_KEY_IDENTITY.format(identity.uuid)
+    _invalidate(key)
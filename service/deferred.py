@@ -0,0 +1,31 @@
+"""
+Finish celery tasks whose work was handed off to a batch.
+
+A task that hands its work off (i.e. to the InstanceWatcher, or to a
+deploy batch) ends with 'celery.exceptions.Ignore': Celery does not
+store its result, and does not run its callbacks (links) or errbacks.
+The batch does both, once the work is done, with these.
+"""
+from celery import current_app as app
+from celery import signature
+
+
+def complete_deferred_task(task_id, callbacks, result):
+    """
+    Store the result of 'task_id', then run its callbacks
+    (Each with 'result', as Celery would)
+    """
+    app.backend.mark_as_done(task_id, result)
+    for callback in callbacks or []:
+        signature(callback, app=app).apply_async((result,))
+
+
+def fail_deferred_task(task_id, errbacks, exc):
+    """
+    Store the failure of 'task_id', then run its errbacks
+    (Each with 'task_id', as Celery would. i.e. deploy_failed looks up
+    the failure with it)
+    """
+    app.backend.mark_as_failure(task_id, exc)
+    for errback in errbacks or []:
+        signature(errback, app=app).apply_async((task_id,))
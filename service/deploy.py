@@ -2,9 +2,13 @@
 Deploy methods for Atmosphere
 """
 from functools import wraps
+import json
 import os
 import re
+import shutil
 import subprocess
+import tempfile
+import threading
 import time
 
 from django.template import Context
@@ -113,26 +117,100 @@ def deploy_to(instance_ip, username, instance_id):
     deploy_playbooks = settings.ANSIBLE_PLAYBOOKS_DIR
     host_list = settings.ANSIBLE_HOST_FILE
 
-    user_keys = []
-    user = User.objects.get(username=username)
-    if user.userprofile.use_ssh_keys:
-        user_keys = [ k.pub_key for k in get_user_ssh_keys(username)]
-
-    extra_vars = {"ATMOUSERNAME": username,
-                  "VNCLICENSE": secrets.ATMOSPHERE_VNC_LICENSE,
-                  "USERSSHKEYS": user_keys
-                 }
+    extra_vars = _deploy_vars(username)
 
-    pbs = subspace.playbook.get_playbooks(deploy_playbooks,
-                                          host_list=host_list,
-                                          limit=my_limit,
-                                          extra_vars=extra_vars)
+    pbs = get_playbooks(deploy_playbooks,
+                        host_list=host_list,
+                        limit=my_limit,
+                        extra_vars=extra_vars)
     [pb.run() for pb in pbs]
     log_playbook_summaries(logger, pbs, hostname)
     raise_playbook_errors(pbs, hostname)
     cache_bust(hostname)
     return pbs
 
+
+def deploy_to_many(deployments):
+    """
+    Use service.ansible to deploy to many instances, with one run of
+    each playbook.
+    'deployments' is a list of (instance_ip, username, instance_id)
+    Returns {instance_id: None (deployed) or AnsibleDeployException}
+    """
+    if not check_ansible():
+        return {}
+    hosts = []
+    for instance_ip, username, instance_id in deployments:
+        hostname = build_host_name(instance_ip)
+        cache_bust(hostname)
+        hosts.append((hostname, instance_ip, username, instance_id))
+    configure_ansible(deploy_logger)
+    # The vars of each user go in the inventory, as host vars.
+    inventory_dir = tempfile.mkdtemp(prefix="atmo_deploy_")
+    try:
+        host_list = _write_batch_inventory(inventory_dir, hosts)
+        pbs = get_playbooks(
+            settings.ANSIBLE_PLAYBOOKS_DIR,
+            host_list=host_list,
+            limit=[{"hostname": host_name, "ip": host_ip}
+                   for host_name, host_ip, _, _ in hosts],
+            extra_vars={"VNCLICENSE": secrets.ATMOSPHERE_VNC_LICENSE})
+        # NOTE: subspace does not pass 'forks' on to the PlayBook.
+        forks = min(len(hosts), getattr(settings, 'ANSIBLE_FORKS', 20))
+        for pb in pbs:
+            pb.forks = forks
+        [pb.run() for pb in pbs]
+    finally:
+        shutil.rmtree(inventory_dir, ignore_errors=True)
+    results = {}
+    for hostname, instance_ip, username, instance_id in hosts:
+        logger = create_instance_logger(
+            deploy_logger, instance_ip, username, instance_id)
+        log_playbook_summaries(logger, pbs, hostname)
+        try:
+            raise_playbook_errors(pbs, hostname)
+            results[instance_id] = None
+        except AnsibleDeployException as exc:
+            results[instance_id] = exc
+        cache_bust(hostname)
+    return results
+
+
+def _write_batch_inventory(inventory_dir, hosts):
+    """
+    Write an inventory of 'hosts' [(hostname, ip, username, instance_id)]
+    (And the vars of each host) to 'inventory_dir'.
+    Returns the path to the inventory.
+    """
+    host_vars_dir = os.path.join(inventory_dir, "host_vars")
+    os.mkdir(host_vars_dir)
+    vars_by_username = {}
+    inventory_path = os.path.join(inventory_dir, "hosts")
+    with open(inventory_path, 'w') as inventory:
+        inventory.write("[atmosphere]\n")
+        for hostname, instance_ip, username, instance_id in hosts:
+            inventory.write(
+                "%s ansible_ssh_host=%s\n" % (hostname, instance_ip))
+            if username not in vars_by_username:
+                vars_by_username[username] = _deploy_vars(username)
+            host_vars = dict(vars_by_username[username])
+            host_vars.pop("VNCLICENSE", None)
+            # JSON is valid YAML
+            with open(os.path.join(host_vars_dir, hostname), 'w') as f:
+                json.dump(host_vars, f)
+    return inventory_path
+
+
+def _deploy_vars(username):
+    user_keys = []
+    user = User.objects.get(username=username)
+    if user.userprofile.use_ssh_keys:
+        user_keys = [ k.pub_key for k in get_user_ssh_keys(username)]
+
+    return {"ATMOUSERNAME": username,
+            "VNCLICENSE": secrets.ATMOSPHERE_VNC_LICENSE,
+            "USERSSHKEYS": user_keys}
+
 def run_utility_playbooks(instance_ip, username, instance_id, limit_playbooks=[]):
     """
     Use service.ansible to deploy utility_playbooks to an instance.
@@ -162,11 +240,11 @@ def run_utility_playbooks(instance_ip, username, instance_id, limit_playbooks=[]
                   "VNCLICENSE": secrets.ATMOSPHERE_VNC_LICENSE,
                   "USERSSHKEYS": user_keys}
 
-    pbs = subspace.playbook.get_playbooks(deploy_playbooks,
-                                          host_list=host_list,
-                                          limit=my_limit,
-                                          extra_vars=extra_vars)
-    pbs = [pb for pb in pbs if pb.filename.split('/')[-1] in limit_playbooks]
+    pbs = get_playbooks(deploy_playbooks,
+                        names=limit_playbooks,
+                        host_list=host_list,
+                        limit=my_limit,
+                        extra_vars=extra_vars)
     [pb.run() for pb in pbs]
     log_playbook_summaries(logger, pbs, hostname)
     raise_playbook_errors(pbs, hostname, allow_failures=True)
@@ -203,12 +281,11 @@ def ready_to_deploy(instance_ip, username, instance_id):
                   "VNCLICENSE": secrets.ATMOSPHERE_VNC_LICENSE,
                   "USERSSHKEYS": user_keys}
 
-    pbs = subspace.playbook.get_playbooks(deploy_playbooks,
-                                          host_list=host_list,
-                                          limit=my_limit,
-                                          extra_vars=extra_vars)
-    #FIXME: Replace this HACK with a proper playbook return
-    pbs = [pb for pb in pbs if '00_check_networking' in pb.filename]
+    pbs = get_playbooks(deploy_playbooks,
+                        names=['00_check_networking'],
+                        host_list=host_list,
+                        limit=my_limit,
+                        extra_vars=extra_vars)
     [pb.run() for pb in pbs]
     log_playbook_summaries(logger, pbs, hostname)
     raise_playbook_errors(pbs, hostname)
@@ -243,17 +320,80 @@ def ready_to_deploy(instance_ip, username, instance_id):
                   "VNCLICENSE": secrets.ATMOSPHERE_VNC_LICENSE,
                   "USERSSHKEYS": user_keys}
 
-    pbs = subspace.playbook.get_playbooks(deploy_playbooks,
-                                          host_list=host_list,
-                                          limit=my_limit,
-                                          extra_vars=extra_vars)
-    [pb.run() for pb in pbs if '05_ssh_setup' in pb.filename]  # FIXME: this is a HACK
+    pbs = get_playbooks(deploy_playbooks,
+                        names=['05_ssh_setup'],
+                        host_list=host_list,
+                        limit=my_limit,
+                        extra_vars=extra_vars)
+    [pb.run() for pb in pbs]
     log_playbook_summaries(logger, pbs, hostname)
     raise_playbook_errors(pbs, hostname)
     cache_bust(hostname)
     return pbs
 
 
+class PlaybookRegistry(object):
+
+    """
+    The playbook files of a directory, in the order subspace runs them.
+
+    The directory is searched once per worker, and again only when one of
+    its (sub)directories changes (mtime). A PlayBook holds the state of its
+    run (inventory, stats..) so it is built (and its file parsed) for
+    each run, but only for the playbooks that are selected.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._mtimes = None
+        self._files = []
+        self._lock = threading.Lock()
+
+    def _directory_mtimes(self):
+        return dict((dirpath, os.path.getmtime(dirpath))
+                    for dirpath, _, _ in os.walk(self.directory))
+
+    def files(self, names=None):
+        """
+        Returns the playbook files
+        (Or those whose file name contains one of 'names')
+        """
+        mtimes = self._directory_mtimes()
+        with self._lock:
+            if mtimes != self._mtimes:
+                # Same files (and order) as subspace.playbook.get_playbooks
+                self._files = subspace.playbook._get_files(self.directory)
+                self._mtimes = mtimes
+            files = list(self._files)
+        if names is None:
+            return files
+        return [filename for filename in files
+                if any(name in os.path.basename(filename) for name in names)]
+
+    def get_playbooks(self, names=None, **kwargs):
+        """
+        Returns the (selected) PlayBooks, built with 'kwargs'
+        See subspace.PlayBook.factory
+        """
+        return [subspace.PlayBook.factory(filename, **kwargs)
+                for filename in self.files(names)]
+
+
+_playbook_registries = {}
+
+
+def get_playbooks(directory, names=None, **kwargs):
+    """
+    Returns the PlayBooks of 'directory' (Or those whose file name contains
+    one of 'names'). See PlaybookRegistry.
+    """
+    registry = _playbook_registries.get(directory)
+    if not registry:
+        registry = _playbook_registries.setdefault(
+            directory, PlaybookRegistry(directory))
+    return registry.get_playbooks(names, **kwargs)
+
+
 def check_ansible():
     """
     If the playbooks and roles directory exist then ANSIBLE_* settings
@@ -371,10 +511,10 @@ def execution_has_failures(pbs, hostname):
 def raise_playbook_errors(pbs, hostname, allow_failures=False):
     error_message = ""
     for pb in pbs:
-        if pb.stats.dark:
+        if hostname in pb.stats.dark:
             error_message += playbook_error_message(
                 pb.stats.dark[hostname], "Unreachable", pb)
-        if not allow_failures and pb.stats.failures:
+        if not allow_failures and hostname in pb.stats.failures:
             error_message += playbook_error_message(
                 pb.stats.failures[hostname], "Failures", pb)
     if error_message:
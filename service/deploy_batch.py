@@ -0,0 +1,131 @@
+"""
+Batch the Ansible deployments of instances that become ready together.
+
+With settings.ANSIBLE_DEPLOY_BATCH, '_deploy_init_to' adds its deployment
+to the batch (in redis) and ends, without running its callbacks
+(See service.deferred). The first deployment added schedules the
+'deploy_batch' task, ANSIBLE_DEPLOY_BATCH_WINDOW seconds later. That
+task takes (up to ANSIBLE_DEPLOY_BATCH_SIZE) deployments and runs each
+playbook once for all of them (service.deploy.deploy_to_many), with
+ANSIBLE_FORKS hosts at a time.
+
+A batch moves its deployments to a processing list of its own, and
+removes each one once its task is completed (or retried). The
+deployments of a batch that did not finish (i.e. its worker died) are
+put back in the next batch, once the batch is past its deadline
+('deploy_batch' also runs periodically, for these).
+"""
+import cPickle as pickle
+import time
+
+from django.conf import settings
+
+import redis
+
+from service.cache import redis_connection
+
+DEPLOY_BATCH_KEY = "deploy_batch"
+DEPLOY_BATCH_SCHEDULED_KEY = "deploy_batch.scheduled"
+# The processing lists of the batches, scored by their deadline
+DEPLOY_BATCH_PROCESSING_KEY = "deploy_batch.processing"
+DEPLOY_BATCH_PROCESSING_LIST_KEY = "deploy_batch.processing.{0}"
+# The time limit of the 'deploy_batch' task
+DEPLOY_BATCH_TIME_LIMIT = 60 * 60
+
+
+def _window():
+    return getattr(settings, 'ANSIBLE_DEPLOY_BATCH_WINDOW', 30)
+
+
+def _batch_size():
+    return getattr(settings, 'ANSIBLE_DEPLOY_BATCH_SIZE', 50)
+
+
+def add_deployment(deployment):
+    """
+    Add 'deployment' (A dict: instance_ip, username, instance_id, ...)
+    to the next batch.
+    Returns False if the deployment could not be added.
+    """
+    if not getattr(settings, 'ANSIBLE_DEPLOY_BATCH', False):
+        return False
+    try:
+        # (Batches take the oldest deployments first, from the right)
+        redis_connection().lpush(
+            DEPLOY_BATCH_KEY,
+            pickle.dumps(deployment, pickle.HIGHEST_PROTOCOL))
+        schedule_deploy_batch()
+    except redis.exceptions.ConnectionError:
+        return False
+    return True
+
+
+def schedule_deploy_batch():
+    """
+    Schedule the 'deploy_batch' task (Unless it is scheduled)
+    """
+    from service.tasks.driver import deploy_batch
+    if redis_connection().set(
+            DEPLOY_BATCH_SCHEDULED_KEY, 1, ex=_window() * 4, nx=True):
+        deploy_batch.apply_async(countdown=_window())
+
+
+def take_deployments(batch_id):
+    """
+    Move the deployments of the next batch to the processing list of
+    'batch_id', and return them: [(payload, deployment), ...]
+    Each one stays there until 'finish_deployment' is called.
+    """
+    conn = redis_connection()
+    # Deployments added from now on schedule the next batch.
+    conn.delete(DEPLOY_BATCH_SCHEDULED_KEY)
+    requeue_expired_batches()
+    processing_key = DEPLOY_BATCH_PROCESSING_LIST_KEY.format(batch_id)
+    # A batch that has not finished by its deadline is put back
+    # (Twice the time limit of the task)
+    conn.zadd(DEPLOY_BATCH_PROCESSING_KEY,
+              **{processing_key: time.time() + 2 * DEPLOY_BATCH_TIME_LIMIT})
+    pipe = conn.pipeline()
+    for _ in range(_batch_size()):
+        pipe.rpoplpush(DEPLOY_BATCH_KEY, processing_key)
+    payloads = [payload for payload in pipe.execute() if payload]
+    if conn.llen(DEPLOY_BATCH_KEY):
+        schedule_deploy_batch()
+    return [(payload, pickle.loads(payload)) for payload in payloads]
+
+
+def finish_deployment(batch_id, payload):
+    """
+    Remove the deployment 'payload' from the processing list of 'batch_id'
+    """
+    redis_connection().lrem(
+        DEPLOY_BATCH_PROCESSING_LIST_KEY.format(batch_id), 1, payload)
+
+
+def release_batch(batch_id):
+    """
+    Put the deployments that 'batch_id' did not finish back in the
+    next batch.
+    """
+    if _requeue(DEPLOY_BATCH_PROCESSING_LIST_KEY.format(batch_id)):
+        schedule_deploy_batch()
+
+
+def requeue_expired_batches():
+    """
+    Put the deployments of the batches past their deadline back in the
+    next batch. Returns the number of deployments put back.
+    """
+    expired = redis_connection().zrangebyscore(
+        DEPLOY_BATCH_PROCESSING_KEY, 0, time.time())
+    return sum(_requeue(processing_key) for processing_key in expired)
+
+
+def _requeue(processing_key):
+    conn = redis_connection()
+    requeued = 0
+    # (Atomically: A deployment is always in one of the lists)
+    while conn.rpoplpush(processing_key, DEPLOY_BATCH_KEY):
+        requeued += 1
+    conn.zrem(DEPLOY_BATCH_PROCESSING_KEY, processing_key)
+    return requeued
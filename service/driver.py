@@ -1,5 +1,12 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from hashlib import md5
+import threading
+import time
 import uuid
 
+from django.utils import timezone
+
 from core.exceptions import ProviderNotActive
 from core.models import AtmosphereUser as User
 from core.models.identity import Identity as CoreIdentity
@@ -25,6 +32,132 @@ from libcloud.compute.types import Provider
 from libcloud.compute.providers import get_driver as fetch_driver
 
 
+# Number of drivers kept by 'driver_pool'
+DRIVER_POOL_SIZE = 100
+# Seconds a driver is re-used for
+DRIVER_POOL_MAX_AGE = 60 * 60
+# A driver is NOT re-used if its auth token expires within this window
+DRIVER_POOL_TOKEN_GRACE = timedelta(minutes=5)
+
+
+class DriverPool(object):
+
+    """
+    An LRU of rtwo drivers, per thread.
+    Entries are keyed by identity, username and credentials, so a change
+    in credentials creates a new driver. A driver is re-used until it is
+    DRIVER_POOL_MAX_AGE seconds old, or its auth token is about to expire.
+    (libcloud) connections are not thread-safe, so a driver is only
+    re-used by the thread that created it. Invalidation applies to the
+    drivers of every thread.
+    """
+
+    def __init__(self, max_size=DRIVER_POOL_SIZE,
+                 max_age=DRIVER_POOL_MAX_AGE):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Drivers created before an invalidation (of ALL drivers, or of
+        # their identity uuid) are not re-used, in any thread.
+        self._generation = 0
+        self._cleared = 0
+        self._invalidated = {}
+
+    @property
+    def _drivers(self):
+        """
+        The drivers of this thread: key -> (generation, created, driver)
+        """
+        drivers = getattr(self._local, "drivers", None)
+        if drivers is None:
+            drivers = self._local.drivers = OrderedDict()
+        return drivers
+
+    @classmethod
+    def key_for(cls, core_identity, username, provider_creds,
+                identity_creds):
+        credentials = repr((sorted(provider_creds.items()),
+                            sorted(identity_creds.items())))
+        return (str(core_identity.uuid), username,
+                md5(credentials).hexdigest())
+
+    def get(self, key):
+        drivers = self._drivers
+        entry = drivers.pop(key, None)
+        if not entry:
+            return None
+        (generation, created, driver) = entry
+        if not self._is_reusable(key, generation, created, driver):
+            return None
+        drivers[key] = entry
+        return driver
+
+    def put(self, key, driver):
+        drivers = self._drivers
+        drivers.pop(key, None)
+        drivers[key] = (self._next_generation(), time.time(), driver)
+        while len(drivers) > self.max_size:
+            drivers.popitem(last=False)
+
+    def invalidate(self, core_identity=None):
+        """
+        Remove the drivers of 'core_identity' (Or ALL drivers)
+        """
+        drivers = self._drivers
+        with self._lock:
+            self._generation += 1
+            if not core_identity:
+                self._cleared = self._generation
+                self._invalidated.clear()
+                drivers.clear()
+                return
+            identity_uuid = str(core_identity.uuid)
+            self._invalidated[identity_uuid] = self._generation
+        for key in drivers.keys():
+            if key[0] == identity_uuid:
+                del drivers[key]
+
+    def _next_generation(self):
+        with self._lock:
+            self._generation += 1
+            return self._generation
+
+    def _is_reusable(self, key, generation, created, driver):
+        if generation < max(self._cleared,
+                            self._invalidated.get(key[0], 0)):
+            return False
+        if time.time() - created > self.max_age:
+            return False
+        token_expires = _token_expires(driver)
+        if not token_expires:
+            return True
+        if timezone.is_naive(token_expires):
+            now = datetime.utcnow()
+        else:
+            now = timezone.now()
+        return now + DRIVER_POOL_TOKEN_GRACE < token_expires
+
+    def __len__(self):
+        """
+        The number of drivers (of this thread)
+        """
+        return len(self._drivers)
+
+
+def _token_expires(driver):
+    """
+    Returns the expiration date of the (libcloud) auth token used
+    by 'driver' (Or None)
+    """
+    lc_driver = getattr(driver, "_connection", None)
+    connection = getattr(lc_driver, "connection", None)
+    return getattr(connection, "auth_token_expires", None)
+
+
+driver_pool = DriverPool()
+
+
 PROVIDER_DEFAULTS = {
     "openstack": {
         "secure": False,
@@ -80,13 +213,16 @@ def get_driver(driverCls, provider, identity, **provider_credentials):
         return driver
 
 
-def get_admin_driver(provider):
+def get_admin_driver(provider, force=False):
     """
     Create an admin driver for a given provider.
+    If force=True, the pooled driver is NOT re-used.
     """
     try:
-        return get_esh_driver(
-            provider.accountprovider_set.all().first().identity)
+        admin_identity = provider.accountprovider_set.all().first().identity
+        if force:
+            invalidate_esh_driver(admin_identity)
+        return get_esh_driver(admin_identity)
     except:
         logger.info("Admin driver for provider %s not found." %
                     (provider.location))
@@ -184,14 +320,27 @@ def get_esh_driver(core_identity, username=None, **kwargs):
         provider_creds = core_identity.provider.get_esh_credentials(provider)
         provider_creds.update(kwargs)
         identity_creds = core_identity.get_credentials()
+        pool_key = DriverPool.key_for(
+            core_identity, user.username, provider_creds, identity_creds)
+        driver = driver_pool.get(pool_key)
+        if driver:
+            return driver
         identity = esh_map['identity'](provider, user=user, **identity_creds)
         driver = esh_map['driver'](provider, identity, **provider_creds)
+        driver_pool.put(pool_key, driver)
         return driver
     except Exception as e:
         logger.exception(e)
         raise
 
 
+def invalidate_esh_driver(core_identity=None):
+    """
+    Remove the pooled driver(s) for 'core_identity' (Or ALL drivers)
+    """
+    driver_pool.invalidate(core_identity)
+
+
 def prepare_driver(request, provider_uuid, identity_uuid,
                    raise_exception=False):
     """
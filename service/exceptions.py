@@ -33,6 +33,13 @@ class InstanceDoesNotExist(ServiceException):
         super(InstanceDoesNotExist, self).__init__()
 
 
+class InstanceTerminalState(ServiceException):
+    """
+    The instance reached a status that it will not leave on its own
+    (While waiting for another status)
+    """
+
+
 class UnderThresholdError(ServiceException):
 
     def __init__(self, message):
@@ -0,0 +1,325 @@
+"""
+Synchronize the membership of (Glance) images with ApplicationMembership.
+
+The sync for a provider is done in bulk:
+* Image members are fetched (and images shared) concurrently, with the
+  executor of the account driver (Bounded by ACCOUNT_DRIVER_WORKERS,
+  rate limited and retried)
+* Tenant ids are resolved to names with the (shared) ProjectDirectory
+* Tenant names are resolved to identities (and groups)
+  with one query each, instead of one query per member
+* The desired and actual ApplicationMembership sets are compared,
+  and the difference is applied with bulk inserts and deletes
+"""
+from django.db import transaction
+
+from glanceclient.exc import HTTPConflict, HTTPForbidden
+from threepio import celery_logger
+
+from core.models.application import Application, ApplicationMembership
+from core.models.application_catalog import ApplicationCatalogEntry
+from core.models.credential import Credential
+from core.models.group import IdentityMembership
+from core.models.machine import (
+    ProviderMachine, get_or_create_provider_machine)
+from core.models.model_version import bump_model_version
+from core.query import only_current_source
+from service.cache import get_cached_project_directory
+
+SKIPPED_IMAGE_PREFIXES = ['eri-', 'eki-', 'ChromoSnapShot']
+
+
+def _is_public(cloud_machine):
+    if hasattr(cloud_machine, 'is_public'):
+        return cloud_machine.is_public
+    return cloud_machine.get('visibility') == 'public'
+
+
+class ImageMembershipSync(object):
+
+    """
+    Sync the images of 'provider' (as seen by 'account_driver'):
+    * Private images: Share each image with every tenant that can see
+      another image of the same application, and give every group of
+      those tenants an ApplicationMembership.
+    * Public images: Collect the (private) applications that should be
+      made public. See 'make_machines_public'.
+    """
+
+    def __init__(self, provider, account_driver, dry_run=False):
+        self.provider = provider
+        self.account_driver = account_driver
+        self.dry_run = dry_run
+
+    def run(self):
+        """
+        Returns a summary (dict) of the changes
+        """
+        cloud_machines = [
+            cloud_machine for cloud_machine
+            in self.account_driver.list_all_images()
+            if not any(cloud_machine.name.startswith(prefix)
+                       for prefix in SKIPPED_IMAGE_PREFIXES)]
+        db_machines = self._load_machines(cloud_machines)
+
+        public_apps = {}
+        private_images = {}  # application_id -> [cloud_machine, ...]
+        applications = {}
+        for cloud_machine in cloud_machines:
+            application = db_machines[cloud_machine.id]\
+                .application_version.application
+            applications[application.id] = application
+            if _is_public(cloud_machine):
+                if application.private:
+                    public_apps[application.id] = application
+            else:
+                private_images.setdefault(
+                    application.id, []).append(cloud_machine)
+
+        conflicts = set(public_apps.keys()) & set(private_images.keys())
+        if conflicts:
+            celery_logger.error(
+                "These applications were listed as BOTH public && private "
+                "apps. Manual conflict correction required: %s"
+                % [applications[app_id] for app_id in conflicts])
+        for app_id in conflicts:
+            del public_apps[app_id]
+            del private_images[app_id]
+
+        image_members = self._fetch_members(
+            [cloud_machine for machines in private_images.values()
+             for cloud_machine in machines])
+        tenant_names = self._tenant_names(image_members)
+        tenant_identities = self._tenant_identities(tenant_names)
+        identity_groups = self._identity_groups(tenant_identities)
+
+        desired = set()
+        app_tenants = {}
+        incomplete = set()
+        for app_id, machines in private_images.items():
+            tenants = app_tenants.setdefault(app_id, set())
+            for cloud_machine in machines:
+                members = image_members.get(cloud_machine.id)
+                if members is None:
+                    incomplete.add(app_id)
+                    continue
+                tenants.update(tenant_names[member] for member in members
+                               if member in tenant_names)
+            for tenant_name in tenants:
+                for identity_id, provider_id in tenant_identities.get(
+                        tenant_name, []):
+                    if provider_id != self.provider.id:
+                        continue
+                    for group_id in identity_groups.get(identity_id, []):
+                        desired.add((app_id, group_id))
+
+        shared = self._share_images(
+            private_images, image_members, tenant_names,
+            tenant_identities, app_tenants)
+        created, deleted = self._apply_memberships(
+            private_images.keys(), desired, incomplete)
+        made_private = self._make_private(private_images.keys())
+        return {
+            "images": len(cloud_machines),
+            "private_applications": len(private_images),
+            "public_applications": public_apps.values(),
+            "conflicts": len(conflicts),
+            "shared": shared,
+            "created": created,
+            "deleted": deleted,
+            "made_private": made_private,
+        }
+
+    def _load_machines(self, cloud_machines):
+        """
+        Returns {image_id: ProviderMachine}, creating the new ones.
+        """
+        db_machines = {}
+        for machine in ProviderMachine.objects.filter(
+                instance_source__provider=self.provider).select_related(
+                'instance_source', 'application_version__application'):
+            db_machines[machine.instance_source.identifier] = machine
+        for cloud_machine in cloud_machines:
+            if cloud_machine.id in db_machines:
+                continue
+            db_machines[cloud_machine.id] = get_or_create_provider_machine(
+                cloud_machine.id, cloud_machine.name, self.provider.uuid)
+        return db_machines
+
+    def _fetch_members(self, cloud_machines):
+        """
+        Returns {image_id: set(tenant_id, ...)}
+        NOTE: The value is None when the members could not be listed.
+        """
+        return self.account_driver.shared_images_for_many(
+            [cloud_machine.id for cloud_machine in cloud_machines])
+
+    def _tenant_names(self, image_members):
+        """
+        Returns {tenant_id: tenant_name} for every tenant_id that is known.
+        """
+        member_ids = set(
+            tenant_id for members in image_members.values()
+            for tenant_id in members or [])
+        tenant_id_name_map = get_cached_project_directory(
+            self.provider, self.account_driver,
+            project_ids=member_ids).project_names
+        tenant_names = {}
+        for image_id, members in image_members.items():
+            for tenant_id in members or []:
+                tenant_name = tenant_id_name_map.get(tenant_id)
+                if not tenant_name:
+                    celery_logger.warn("TENANT ID: %s NOT FOUND - Image %s"
+                                       % (tenant_id, image_id))
+                    continue
+                tenant_names[tenant_id] = tenant_name
+        return tenant_names
+
+    def _tenant_identities(self, tenant_names):
+        """
+        Returns {tenant_name: [(identity_id, provider_id), ...]}
+        """
+        tenant_identities = {}
+        # NOTE: Not limited to this provider when replicating clouds!
+        matching_creds = Credential.objects.filter(
+            key='ex_tenant_name',  # TODO: ex_project_name on next OStack update.
+            value__in=set(tenant_names.values())
+        ).values_list('value', 'identity', 'identity__provider')
+        for tenant_name, identity_id, provider_id in matching_creds:
+            tenant_identities.setdefault(tenant_name, []).append(
+                (identity_id, provider_id))
+        return tenant_identities
+
+    def _identity_groups(self, tenant_identities):
+        """
+        Returns {identity_id: [group_id, ...]}
+        """
+        identity_ids = set(
+            identity_id for identities in tenant_identities.values()
+            for identity_id, _ in identities)
+        identity_groups = {}
+        if not identity_ids:
+            return identity_groups
+        for identity_id, group_id in IdentityMembership.objects.filter(
+                identity__in=identity_ids
+        ).values_list('identity', 'member'):
+            identity_groups.setdefault(identity_id, []).append(group_id)
+        return identity_groups
+
+    def _is_shared(self, cloud_machine, result):
+        """
+        True if the image was shared (Or already was).
+        'result' is the exception raised by 'share_image', if any.
+        """
+        if not isinstance(result, Exception):
+            return True
+        if isinstance(result, HTTPConflict) and \
+                'already associated with image' in result.message:
+            return True
+        if isinstance(result, HTTPForbidden):
+            if 'Public images do not have members' in result.message:
+                celery_logger.warn(
+                    "CONFLICT -- This image should have been marked "
+                    "'private'! %s" % cloud_machine)
+            return False
+        celery_logger.error(
+            "Could not share image %s: %r" % (cloud_machine.id, result))
+        return False
+
+    def _share_images(self, private_images, image_members, tenant_names,
+                      tenant_identities, app_tenants):
+        """
+        Share every image of an application with the tenants (of this
+        provider) that can see any of its images.
+        Returns the number of new shares.
+        """
+        share_args = []
+        for app_id, machines in private_images.items():
+            tenants = set(
+                tenant_name for tenant_name in app_tenants[app_id]
+                if any(provider_id == self.provider.id for _, provider_id
+                       in tenant_identities.get(tenant_name, [])))
+            for cloud_machine in machines:
+                members = image_members.get(cloud_machine.id)
+                if members is None:
+                    continue
+                current_tenants = set(tenant_names[member]
+                                      for member in members
+                                      if member in tenant_names)
+                for tenant_name in sorted(tenants - current_tenants):
+                    celery_logger.info(
+                        "Sharing image %s<%s>: %s with %s"
+                        % (cloud_machine.id, cloud_machine.name,
+                           self.provider.location, tenant_name))
+                    share_args.append((cloud_machine, tenant_name))
+        if self.dry_run:
+            return len(share_args)
+        results = self.account_driver.share_images(share_args)
+        return len([
+            result for (cloud_machine, _), result in zip(share_args, results)
+            if self._is_shared(cloud_machine, result)])
+
+    def _apply_memberships(self, app_ids, desired, incomplete):
+        """
+        Create the missing ApplicationMemberships in 'desired'.
+        Remove (view only) memberships that are not in 'desired', unless:
+        * The members of an image could not be listed ('incomplete')
+        * The application has machines on another provider
+        Returns a 2-tuple (created, deleted)
+        """
+        if not app_ids:
+            return (0, 0)
+        shared_apps = set(ProviderMachine.objects.filter(
+            only_current_source(),
+            application_version__application__in=app_ids,
+        ).exclude(
+            instance_source__provider=self.provider
+        ).values_list('application_version__application', flat=True))
+        actual = set()
+        stale_ids = []
+        for membership_id, app_id, group_id, can_edit in \
+                ApplicationMembership.objects.filter(
+                    application__in=app_ids
+                ).values_list('id', 'application', 'group', 'can_edit'):
+            actual.add((app_id, group_id))
+            if (app_id, group_id) in desired or can_edit:
+                continue
+            if app_id in incomplete or app_id in shared_apps:
+                continue
+            stale_ids.append(membership_id)
+        missing = sorted(desired - actual)
+        celery_logger.info(
+            "Provider %s: Adding %s and removing %s ApplicationMemberships"
+            % (self.provider, len(missing), len(stale_ids)))
+        if self.dry_run:
+            return (len(missing), len(stale_ids))
+        with transaction.atomic():
+            ApplicationMembership.objects.bulk_create([
+                ApplicationMembership(application_id=app_id,
+                                      group_id=group_id)
+                for app_id, group_id in missing])
+            if stale_ids:
+                ApplicationMembership.objects.filter(
+                    id__in=stale_ids).delete()
+        if missing:
+            # bulk_create does not trigger the model version hooks.
+            bump_model_version(ApplicationMembership)
+        return (len(missing), len(stale_ids))
+
+    def _make_private(self, app_ids):
+        """
+        All the cloud work has been completed,
+        so "lock down" the applications.
+        """
+        if not app_ids:
+            return 0
+        public_app_ids = list(Application.objects.filter(
+            id__in=app_ids, private=False).values_list('id', flat=True))
+        if self.dry_run or not public_app_ids:
+            return len(public_app_ids)
+        Application.objects.filter(
+            id__in=public_app_ids).update(private=True)
+        # Bulk updates do not trigger the catalog and model version hooks.
+        ApplicationCatalogEntry.rebuild(public_app_ids)
+        bump_model_version(Application)
+        return len(public_app_ids)
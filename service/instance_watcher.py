@@ -0,0 +1,269 @@
+"""
+Wait for instances to become ready, per provider (instead of per instance).
+
+'wait_for_instance' used to retry (up to 250 times, every 15 seconds)
+until its instance was ready: A new driver and a call to the cloud for
+every instance, every 15 seconds. Instead, the task registers a 'waiter'
+with the InstanceWatcher of the provider (in redis) and ends without
+running its callbacks. Every settings.INSTANCE_WATCHER_INTERVAL seconds,
+the watcher:
+* Lists every instance of the provider (One call to the cloud)
+* Runs the callbacks of each waiter whose instance reached its
+  'status_query', with the result 'wait_for_instance' would return
+* Runs the errbacks of each waiter whose instance reached a terminal
+  status (See TERMINAL_STATUSES) or that timed out.
+The watcher reschedules itself for as long as there are waiters.
+Only the chain of tasks that owns the lock of the provider (a token, see
+'start') polls and reschedules itself, so a late task can not start a
+second chain.
+"""
+import cPickle as pickle
+import time
+import uuid
+
+from django.conf import settings
+
+import redis
+
+from threepio import celery_logger
+
+from core.models.instance import Instance
+from core.models.provider import Provider
+from service.cache import redis_connection
+from service.deferred import complete_deferred_task, fail_deferred_task
+from service.driver import get_account_driver
+from service.exceptions import InstanceTerminalState
+from service.retry_policy import record_ready_time
+
+WAITERS_KEY = "instance_waiters.{0}"
+WATCHER_KEY = "instance_watcher.{0}"
+
+# An instance in one of these will not reach any other status on its own.
+TERMINAL_STATUSES = ('error', 'deleted', 'soft_deleted')
+
+READY = 'ready'
+WAITING = 'waiting'
+TERMINAL = 'terminal'
+
+# Compare-and-set/delete of the lock, for its owner only.
+REFRESH_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('set', KEYS[1], ARGV[1], 'ex', ARGV[2])
+end
+return nil
+"""
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _interval():
+    return getattr(settings, 'INSTANCE_WATCHER_INTERVAL', 15)
+
+
+def instance_readiness(esh_instance, status_query, tasks_allowed=False):
+    """
+    Returns READY, WAITING or TERMINAL (The instance will never be ready)
+
+    status_query = "active" Match only one value, active
+    status_query = ["active","suspended"] or match multiple values.
+    """
+    i_status = esh_instance._node.extra['status'].lower()
+    i_task = esh_instance._node.extra['task']
+    if i_status in status_query:
+        if i_task and not tasks_allowed:
+            return WAITING
+        return READY
+    if i_status in TERMINAL_STATUSES:
+        return TERMINAL
+    return WAITING
+
+
+def _instance_state(esh_instance):
+    return "%s - %s" % (esh_instance._node.extra['status'].lower(),
+                        esh_instance._node.extra['task'])
+
+
+def get_instance_watcher(instance_alias, esh_provider):
+    """
+    Returns the InstanceWatcher for the provider of 'instance_alias'
+    (Or None, when the instance should be polled instead)
+    """
+    if not getattr(settings, 'INSTANCE_WATCHER', False):
+        return None
+    instance = Instance.objects.filter(provider_alias=instance_alias)\
+        .select_related('source__provider__type').first()
+    if instance:
+        provider = instance.source.provider
+    else:
+        # i.e. Instances launched by the imaging tasks.
+        location = getattr(esh_provider, 'identifier', '').split('+')[0]
+        providers = list(Provider.objects.filter(
+            location=location, active=True).select_related('type'))
+        if len(providers) != 1:
+            return None
+        provider = providers[0]
+    if 'openstack' not in provider.get_type_name().lower():
+        return None
+    return InstanceWatcher(provider)
+
+
+class InstanceWatcher(object):
+
+    """
+    The waiters of a provider. See the module docstring.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.key = WAITERS_KEY.format(provider.uuid)
+        self.lock_key = WATCHER_KEY.format(provider.uuid)
+
+    def add(self, task_id, instance_alias, status_query,
+            tasks_allowed=False, return_id=False,
+            callbacks=None, errbacks=None, timeout=None):
+        """
+        Wait for 'instance_alias' on behalf of the task 'task_id'.
+        Returns False if the waiter could not be added.
+        """
+        waiter = {
+            'instance_alias': instance_alias,
+            'status_query': status_query,
+            'tasks_allowed': tasks_allowed,
+            'return_id': return_id,
+            'callbacks': callbacks or [],
+            'errbacks': errbacks or [],
+            'deadline': time.time() + (timeout or 60 * 60),
+        }
+        try:
+            redis_connection().hset(
+                self.key, task_id,
+                pickle.dumps(waiter, pickle.HIGHEST_PROTOCOL))
+            self.start()
+        except redis.exceptions.ConnectionError:
+            return False
+        return True
+
+    def start(self):
+        """
+        Schedule the watcher of the provider (Unless it is scheduled)
+        """
+        from service.tasks.driver import watch_instances_for
+        token = uuid.uuid4().hex
+        if redis_connection().set(
+                self.lock_key, token, ex=_interval() * 4, nx=True):
+            watch_instances_for.apply_async(
+                args=[self.provider.uuid, token], countdown=_interval())
+
+    def waiters(self):
+        """
+        Returns {task_id: waiter}
+        """
+        return dict(
+            (task_id, pickle.loads(waiter)) for task_id, waiter
+            in redis_connection().hgetall(self.key).items())
+
+    def run(self, token=None):
+        """
+        Poll once, then schedule the next poll while waiters remain.
+        Nothing is done unless 'token' owns the lock (Or can take it,
+        after it expired).
+        """
+        conn = redis_connection()
+        token = token or uuid.uuid4().hex
+        if not conn.set(self.lock_key, token, ex=_interval() * 4, nx=True)\
+                and conn.get(self.lock_key) != token:
+            celery_logger.debug("The watcher of %s is owned by another task"
+                                % self.provider)
+            return
+        try:
+            self.poll()
+        finally:
+            if conn.hlen(self.key):
+                if conn.eval(REFRESH_LOCK_SCRIPT, 1, self.lock_key,
+                             token, _interval() * 4):
+                    from service.tasks.driver import watch_instances_for
+                    watch_instances_for.apply_async(
+                        args=[self.provider.uuid, token],
+                        countdown=_interval())
+            else:
+                conn.eval(RELEASE_LOCK_SCRIPT, 1, self.lock_key, token)
+                # A waiter added since 'hlen' could have missed the lock.
+                if conn.hlen(self.key):
+                    self.start()
+
+    def poll(self):
+        """
+        List the instances of the provider and resolve the waiters.
+        Returns the number of waiters resolved.
+        """
+        waiters = self.waiters()
+        if not waiters:
+            return 0
+        try:
+            instances = dict(
+                (instance.id, instance) for instance in
+                get_account_driver(self.provider).list_all_instances())
+        except Exception:
+            celery_logger.exception(
+                "Could not list the instances of %s" % self.provider)
+            instances = None
+        now = time.time()
+        resolved = 0
+        for task_id, waiter in waiters.items():
+            if instances is not None:
+                resolved += self._check(
+                    task_id, waiter, instances.get(waiter['instance_alias']))
+            elif waiter['deadline'] < now:
+                resolved += self._fail(task_id, waiter, Exception(
+                    "Instance: %s - Timed out" % waiter['instance_alias']))
+        return resolved
+
+    def _check(self, task_id, waiter, esh_instance):
+        alias = waiter['instance_alias']
+        if not esh_instance:
+            celery_logger.debug("Instance has been terminated: %s." % alias)
+            return self._succeed(
+                task_id, waiter, None if waiter['return_id'] else False)
+        readiness = instance_readiness(
+            esh_instance, waiter['status_query'], waiter['tasks_allowed'])
+        if readiness == READY:
+            celery_logger.debug("Instance %s: Status: (%s) - Ready"
+                                % (alias, _instance_state(esh_instance)))
+            if 'active' in waiter['status_query']:
+                record_ready_time('wait_for_instance', alias)
+            return self._succeed(
+                task_id, waiter,
+                esh_instance.id if waiter['return_id'] else True)
+        if readiness == TERMINAL:
+            return self._fail(task_id, waiter, InstanceTerminalState(
+                "Instance: %s: Status: (%s) - Will not become %s"
+                % (alias, _instance_state(esh_instance),
+                   waiter['status_query'])))
+        if waiter['deadline'] < time.time():
+            return self._fail(task_id, waiter, Exception(
+                "Instance: %s: Status: (%s) - Timed out"
+                % (alias, _instance_state(esh_instance))))
+        return 0
+
+    def _claim(self, task_id):
+        """
+        True for the one watcher that removed the waiter.
+        """
+        return redis_connection().hdel(self.key, task_id) == 1
+
+    def _succeed(self, task_id, waiter, result):
+        if not self._claim(task_id):
+            return 0
+        complete_deferred_task(task_id, waiter['callbacks'], result)
+        return 1
+
+    def _fail(self, task_id, waiter, exc):
+        if not self._claim(task_id):
+            return 0
+        celery_logger.error(str(exc))
+        fail_deferred_task(task_id, waiter['errbacks'], exc)
+        return 1
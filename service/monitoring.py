@@ -3,7 +3,7 @@ import time
 from datetime import timedelta
 from django.core.exceptions import ObjectDoesNotExist
 import pytz
-from django.db.models import Q
+from django.db.models import F, Prefetch, Q
 from django.utils import timezone
 from threepio import logger
 from core.models import AtmosphereUser as User
@@ -17,12 +17,19 @@ from core.models.instance import (
     convert_esh_instance, _esh_instance_size_to_core
 )
 from core.models.size import convert_esh_size
+from core.models.usage_rollup import UsageRollup
 from allocation.models import Allocation, AllocationResult
-from service.cache import get_cached_instances, get_cached_driver
+from service.cache import get_cached_instances, get_cached_driver,\
+    get_cached_project_directory, get_cached_size_catalog,\
+    get_cached_allocation_checkpoint, set_cached_allocation_checkpoint,\
+    copy_with
 from service.instance import suspend_instance, stop_instance, destroy_instance, shelve_instance, offload_instance
-from allocation.engine import calculate_allocation
+from allocation.engine import calculate_allocation, calculate_allocations
 from django.conf import settings
 
+# Re-calculate rollups older than this (Even if they are not 'dirty')
+USAGE_ROLLUP_MAX_AGE = timedelta(hours=2)
+
 
 # Private
 def _include_all_idents(identities, owner_map):
@@ -69,16 +76,15 @@ def _select_identities(provider, users=None):
     return provider.identity_set.all()
 
 
-def _convert_tenant_id_to_names(instances, tenants):
-    for i in instances:
-        for tenant in tenants:
-            if type(tenant) == dict:
-                if tenant['id'] == i.owner:
-                    i.owner = tenant['name']
-            else:
-                if tenant.id == i.owner:
-                    i.owner = tenant.name
-    return instances
+def _convert_tenant_id_to_names(instances, tenant_names):
+    """
+    Replace instance.owner (tenant id) by the tenant name
+    'tenant_names' - {tenant_id: tenant_name} (See ProjectDirectory)
+    Returns the instances (Copies, where the owner was replaced)
+    """
+    return [copy_with(i, owner=tenant_names[i.owner])
+            if i.owner in tenant_names else i
+            for i in instances]
 
 
 def _get_identity_from_tenant_name(provider, username):
@@ -108,19 +114,21 @@ def _get_identity_from_tenant_name(provider, username):
 
 
 def get_allocation_result_for(
-        provider, username, print_logs=False, start_date=None, end_date=None):
+        provider, username, print_logs=False, start_date=None, end_date=None,
+        incremental=False):
     """
     Given provider and username:
     * Find the correct identity for the user
     * Create 'Allocation' using core representation
     * Calculate the 'AllocationResult' and return both
+    If incremental=True, resume from the identity's last checkpoint.
     """
     identity = _get_identity_from_tenant_name(provider, username)
     # Attempt to run through the allocation engine
     try:
         allocation_result = _get_allocation_result(
             identity, start_date, end_date,
-            print_logs=print_logs)
+            print_logs=print_logs, incremental=incremental)
         logger.debug("Result for Username %s: %s"
                      % (username, allocation_result))
         return allocation_result
@@ -136,7 +144,8 @@ def get_allocation_result_for(
 
 
 def user_over_allocation_enforcement(
-        provider, username, print_logs=False, start_date=None, end_date=None):
+        provider, username, print_logs=False, start_date=None, end_date=None,
+        incremental=False):
     """
     Begin monitoring 'username' on 'provider'.
     * Calculate allocation from START of month to END of month
@@ -145,7 +154,7 @@ def user_over_allocation_enforcement(
     identity = _get_identity_from_tenant_name(provider, username)
     allocation_result = get_allocation_result_for(
         provider, username,
-        print_logs, start_date, end_date)
+        print_logs, start_date, end_date, incremental=incremental)
     # ASSERT: allocation_result has been retrieved successfully
     # Make some enforcement decision based on the allocation_result's output.
 
@@ -290,6 +299,7 @@ def update_instances(driver, identity, esh_list, core_list):
     && Update the values of instances that do
     """
     esh_ids = [instance.id for instance in esh_list]
+    size_catalog = get_cached_size_catalog(identity.provider)
     # logger.info('%s Instances for Identity %s: %s'
     #            % (len(esh_ids), identity, esh_ids))
     for core_instance in core_list:
@@ -301,8 +311,10 @@ def update_instances(driver, identity, esh_list, core_list):
             core_instance.end_date_all()
             continue
         esh_instance = esh_list[index]
-        esh_size = driver.get_size(esh_instance.size.id)
-        core_size = convert_esh_size(esh_size, identity.provider.uuid)
+        core_size = size_catalog.get_core_size(esh_instance.size.id)
+        if not core_size:
+            esh_size = driver.get_size(esh_instance.size.id)
+            core_size = convert_esh_size(esh_size, identity.provider.uuid)
         core_instance.update_history(
             esh_instance.extra['status'],
             core_size,
@@ -403,11 +415,9 @@ def _get_instance_owner_map(provider, users=None):
     NOTE: This is KEYSTONE && NOVA specific. the 'instance owner' here is the
           username // ex_tenant_name
     """
-    from service.driver import get_account_driver
-
     admin_driver = get_cached_driver(provider=provider)
-    accounts = get_account_driver(provider=provider)
     all_identities = _select_identities(provider, users)
+    core_provider = provider
     acct_providers = AccountProvider.objects.filter(provider=provider)
     if acct_providers:
         account_identity = acct_providers[0].identity
@@ -417,10 +427,12 @@ def _get_instance_owner_map(provider, users=None):
 
 
     all_instances = get_cached_instances(provider=provider, identity=account_identity, force=True)
-    #all_tenants = admin_driver._connection._keystone_list_tenants()
-    all_tenants = accounts.list_projects()
+    # Shared by every task (See ProjectDirectory)
+    project_directory = get_cached_project_directory(
+        core_provider, project_ids=[i.owner for i in all_instances])
     # Convert instance.owner from tenant-id to tenant-name all at once
-    all_instances = _convert_tenant_id_to_names(all_instances, all_tenants)
+    all_instances = _convert_tenant_id_to_names(
+        all_instances, project_directory.project_names)
     # Make a mapping of owner-to-instance
     instance_map = _make_instance_owner_map(all_instances, users=users)
     logger.info("Instance owner map created")
@@ -492,10 +504,13 @@ def _empty_allocation_result():
 
 
 def _get_allocation_result(identity, start_date=None, end_date=None,
-                           print_logs=False):
+                           print_logs=False, incremental=False):
     """
     Given an identity, retrieve the provider strategy and apply the strategy
     to this identity.
+
+    If incremental=True, the engine resumes from the AllocationCheckpoint
+    saved by the previous run, and saves a new one when finished.
     """
 
     if not identity:
@@ -505,14 +520,259 @@ def _get_allocation_result(identity, start_date=None, end_date=None,
     if not core_allocation:
         logger.warn("User:%s Identity:%s does not have an allocation assigned"
                     % (username, identity))
-    allocation_input = apply_strategy(identity, core_allocation)
+    checkpoint = None
+    if incremental:
+        checkpoint = get_cached_allocation_checkpoint(identity)
+    allocation_input = apply_strategy(identity, core_allocation, checkpoint)
     allocation_result = calculate_allocation(
         allocation_input,
         print_logs=print_logs)
+    if incremental:
+        set_cached_allocation_checkpoint(
+            identity, allocation_result.checkpoint)
+    if not start_date and not end_date:
+        # Current window -- Keep the UsageRollup up to date.
+        now = timezone.now()
+        UsageRollup.update_for(
+            identity, allocation_result, now,
+            get_next_window_start(identity, now))
     return allocation_result
 
 
-def apply_strategy(identity, core_allocation):
+def get_allocation_result(identity):
+    """
+    Returns the detailed AllocationResult (Every time period and instance)
+    for the current window of 'identity'. A UsageRollup only holds the
+    totals, so this always runs the allocation engine, and brings the
+    rollup up to date while it is at it.
+    """
+    return _get_allocation_result(identity)
+
+
+def _fresh_usage_rollup(identity, now):
+    """
+    Returns the current UsageRollup of 'identity', unless it is
+    missing, dirty, too old, or from a previous window.
+    """
+    rollup = UsageRollup.get_current(identity)
+    if rollup and not rollup.dirty\
+            and now - rollup.calculated_at < USAGE_ROLLUP_MAX_AGE\
+            and rollup.is_current_window(now):
+        return rollup
+    return None
+
+
+def get_usage_rollup(identity):
+    """
+    Returns the current UsageRollup for 'identity'.
+    The allocation engine only runs (incrementally) when the rollup is
+    missing, dirty, too old, or from a previous window.
+    """
+    rollup = _fresh_usage_rollup(identity, timezone.now())
+    if rollup:
+        return rollup
+    _get_allocation_result(identity, incremental=True)
+    return UsageRollup.get_current(identity)
+
+
+def get_allocation_usage(identity):
+    """
+    Returns a 4-tuple for 'identity' (Amounts in hours):
+    (credit, used, remaining, time_to_zero)
+    Read from the UsageRollup, or from the allocation engine when it
+    does not produce a rollup (i.e. No time periods)
+    """
+    rollup = _fresh_usage_rollup(identity, timezone.now())
+    if not rollup:
+        allocation_result = _get_allocation_result(
+            identity, incremental=True)
+        if not allocation_result.time_periods:
+            over_allocation, diff_amount = \
+                allocation_result.total_difference()
+            return (
+                int(allocation_result.total_credit().total_seconds()
+                    / 3600.0),
+                int(allocation_result.total_runtime().total_seconds()
+                    / 3600.0),
+                int(diff_amount.total_seconds() / 3600.0),
+                allocation_result.time_to_zero())
+        rollup = UsageRollup.get_current(identity)
+    return (int(rollup.credit / 3600.0),
+            int(rollup.current_used() / 3600.0),
+            int(abs(rollup.current_remaining()) / 3600.0),
+            rollup.time_to_zero())
+
+
+def get_next_window_start(identity, now=None, strategy=None):
+    """
+    Returns when the current window of 'identity' ends (Or None, if it
+    never does). Saved on the UsageRollup, so reads do not re-parse the
+    strategy.
+    """
+    if not strategy:
+        strategy = _get_strategy(identity)
+    if not strategy:
+        return None
+    return strategy.get_next_window_start(identity, now)
+
+
+def _get_allocation_results(provider, identities=None, print_logs=False):
+    """
+    Given a provider (and optionally, a list of its identities), calculate
+    every 'AllocationResult' in a single batch
+    (See allocation.engine.calculate_allocations).
+    Returns a list of 2-tuples: (identity, allocation_result)
+    (Identities whose allocation could not be calculated are left out)
+    """
+    identity_inputs = _get_allocation_inputs(provider, identities)
+    calculated_identities = [identity for (identity, _) in identity_inputs]
+    allocation_inputs = [allocation for (_, allocation) in identity_inputs]
+    allocation_results = calculate_allocations(
+        allocation_inputs, print_logs=print_logs)
+    identity_results = []
+    for identity, allocation_result in zip(calculated_identities,
+                                           allocation_results):
+        if allocation_result is None:
+            logger.warn("Could not calculate the allocation of %s"
+                        % identity)
+            continue
+        identity_results.append((identity, allocation_result))
+    return identity_results
+
+
+def _get_allocation_inputs(provider, identities=None):
+    """
+    Given a provider (and optionally, a list of its identities), create the
+    'Allocation' input for every identity using a fixed number of queries:
+    * Identities (with user and provider)
+    * The provider's strategy (with its behaviors)
+    * Every membership (with its allocation)
+    * Every instance (with source) that could have an impact
+    * The instance status history (with status and size) of those instances
+    Returns a list of 2-tuples: (identity, allocation_input)
+    """
+    identities = provider.identity_set.all()\
+        if identities is None else identities
+    identities = list(
+        Identity.objects.filter(id__in=[ident.id for ident in identities])
+        .select_related('created_by', 'provider'))
+    if not identities:
+        return []
+    try:
+        strategy = CoreAllocationStrategy.objects\
+            .select_related('counting_behavior')\
+            .prefetch_related('refresh_behaviors', 'rules_behaviors')\
+            .get(provider=provider)
+    except CoreAllocationStrategy.DoesNotExist:
+        strategy = None
+    core_allocations = _core_allocations_by_identity(provider, identities)
+    instance_map = {}
+    if strategy:
+        instance_map = _core_instances_by_identity(
+            identities, _earliest_start_date(strategy, identities))
+    identity_inputs = []
+    for identity in identities:
+        try:
+            core_allocation = core_allocations.get(identity.id)
+            if not core_allocation:
+                logger.warn("User:%s Identity:%s does not have an "
+                            "allocation assigned"
+                            % (identity.created_by.username, identity))
+            if not strategy:
+                allocation_input = Allocation(
+                    credits=[], rules=[], instances=[],
+                    start_date=None, end_date=None, interval_delta=None)
+            else:
+                allocation_input = strategy.apply(
+                    identity, core_allocation,
+                    core_instances=instance_map.get(identity.id, []))
+            identity_inputs.append((identity, allocation_input))
+        except Exception:
+            logger.exception("Unable to create allocation for Identity:%s"
+                             % (identity,))
+    return identity_inputs
+
+
+def _earliest_start_date(strategy, identities):
+    """
+    Return the earliest date that 'strategy' will count from for any of
+    the 'identities' (Or None, to count all time)
+    """
+    now = timezone.now()
+    start_dates = []
+    for identity in identities:
+        counting_behavior = strategy._parse_counting_behavior(identity, now)
+        if not counting_behavior or not counting_behavior.start_date:
+            return None
+        start_dates.append(counting_behavior.start_date)
+    return min(start_dates)
+
+
+def _core_allocations_by_identity(provider, identities):
+    """
+    Bulk version of 'get_allocation'.
+    Returns a dict: {identity.id: core_allocation}
+    """
+    memberships = IdentityMembership.objects.filter(
+        identity__in=identities,
+        member__name=F('identity__created_by__username'))\
+        .select_related('allocation')
+    membership_map = dict((membership.identity_id, membership)
+                          for membership in memberships)
+    core_allocations = {}
+    def_allocation = None
+    for identity in identities:
+        user = identity.created_by
+        membership = membership_map.get(identity.id)
+        if not membership:
+            logger.warn(
+                "WARNING: User %s does not"
+                "have IdentityMembership on this database" % (user.username, ))
+            core_allocations[identity.id] = None
+        elif not user.is_staff and not membership.allocation:
+            if not def_allocation:
+                def_allocation = CoreAllocation.default_allocation(provider)
+            logger.warn("%s is MISSING an allocation. Default Allocation"
+                        " assigned:%s" % (user, def_allocation))
+            core_allocations[identity.id] = def_allocation
+        else:
+            core_allocations[identity.id] = membership.allocation
+    return core_allocations
+
+
+def _core_instances_by_identity(identities, start_date=None):
+    """
+    Bulk version of '_core_instances_for'. Every instance is returned with
+    the status history that ended after 'start_date' already retrieved.
+    Returns a dict: {identity.id: [core_instance, ...]}
+    """
+    if not start_date:
+        # Can't use 'None' as a query value
+        start_date = timezone.datetime(1970, 1, 1).replace(tzinfo=pytz.utc)
+    history_list = InstanceStatusHistory.objects.filter(
+        Q(end_date=None) | Q(end_date__gt=start_date))\
+        .select_related('status', 'size').order_by('start_date')
+    core_instances = CoreInstance.objects.filter(
+        Q(instancestatushistory__end_date=None) |
+        Q(instancestatushistory__end_date__gt=start_date) |
+        Q(end_date=None) | Q(end_date__gt=start_date),
+        # NOTE: Same as '_core_instances_for'
+        created_by=F('created_by_identity__created_by'),
+        created_by_identity__in=identities).distinct()\
+        .select_related(
+            'source__provider',
+            'source__volume',
+            'source__providermachine__application_version__application')\
+        .prefetch_related(
+            Prefetch('instancestatushistory_set', queryset=history_list))
+    instance_map = {}
+    for core_instance in core_instances:
+        instance_map.setdefault(
+            core_instance.created_by_identity_id, []).append(core_instance)
+    return instance_map
+
+
+def apply_strategy(identity, core_allocation, checkpoint=None):
     """
     Given identity and core allocation, grab the ProviderStrategy
     and apply it. Returns an "AllocationInput"
@@ -521,7 +781,7 @@ def apply_strategy(identity, core_allocation):
     if not strategy:
         return Allocation(credits=[], rules=[], instances=[],
                           start_date=None, end_date=None, interval_delta=None)
-    return strategy.apply(identity, core_allocation)
+    return strategy.apply(identity, core_allocation, checkpoint)
 
 
 def _get_strategy(identity):
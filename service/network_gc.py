@@ -0,0 +1,203 @@
+"""
+Release the IPs (and networks) of a provider that are not in use, in bulk.
+
+'clear_empty_ips_for' does this for one identity, with its own drivers and
+calls to Nova/Neutron for its tenant. NetworkGC lists the instances, ports,
+floating IPs, subnets, networks, routers and security groups of a provider
+once (with the admin credentials) and then, for each tenant of an identity
+of the provider, does what 'clear_empty_ips_for' would:
+* Release the floating IPs that are not associated (with a port)
+* Remove the (floating and fixed) IPs of its inactive instances
+* Remove its network and security groups when none of its instances are
+  active, but not all of them are inactive (suspended/stopped/..)
+"""
+from collections import defaultdict
+
+from neutronclient.common.exceptions import NeutronClientException
+from threepio import celery_logger
+
+from core.models.credential import Credential
+from service.cache import get_cached_project_directory
+from service.driver import get_account_driver
+from service.instance import _update_instance_metadata
+
+
+class NetworkGC(object):
+
+    """
+    See the module docstring. 'run' returns the number of floating IPs
+    released, instances whose IPs were removed and networks removed.
+    """
+
+    def __init__(self, provider, account_driver=None, dry_run=False):
+        self.provider = provider
+        self.account_driver = account_driver or get_account_driver(provider)
+        self.network_manager = self.account_driver.network_manager
+        self.neutron = self.network_manager.neutron
+        self.driver = self.account_driver.admin_driver
+        self.dry_run = dry_run
+
+    def _tenants(self):
+        """
+        Returns {tenant_id: tenant_name} of the identities of the provider
+        """
+        tenant_names = set(Credential.objects.filter(
+            identity__provider=self.provider,
+            key='ex_tenant_name',  # TODO: ex_project_name on next OStack update.
+        ).values_list('value', flat=True))
+        directory = get_cached_project_directory(
+            self.provider, account_driver=self.account_driver)
+        return dict((project_id, project_name) for project_id, project_name
+                    in directory.project_names.items()
+                    if project_name in tenant_names)
+
+    def run(self):
+        tenants = self._tenants()
+        summary = {'floating_ips': 0, 'instances': 0, 'networks': 0}
+        if not tenants:
+            return summary
+        instances = defaultdict(list)
+        for instance in self.account_driver.list_all_instances():
+            tenant_id = instance.extra.get('tenantId')
+            if tenant_id in tenants:
+                instances[tenant_id].append(instance)
+        ports = self.neutron.list_ports()['ports']
+        floating_ips = self.neutron.list_floatingips()['floatingips']
+
+        summary['floating_ips'] = self.release_floating_ips(
+            [fip for fip in floating_ips
+             if not fip.get('port_id') and fip['tenant_id'] in tenants])
+        inactive = [instance for tid in tenants
+                    for instance in instances[tid]
+                    if self.driver._is_inactive_instance(instance)
+                    and instance.ip]
+        summary['instances'] = self.remove_instance_ips(
+            inactive, ports,
+            [fip for fip in floating_ips if fip.get('port_id')])
+
+        empty_tenants = dict(
+            (tenant_id, tenant_name)
+            for tenant_id, tenant_name in tenants.items()
+            if self._network_is_unused(instances[tenant_id]))
+        if empty_tenants:
+            summary['networks'] = self.remove_networks(empty_tenants)
+        return summary
+
+    def _network_is_unused(self, instances):
+        # Active True IFF ANY instance is 'active'
+        if any(self.driver._is_active_instance(inst) for inst in instances):
+            return False
+        # The network of suspended/stopped instances is kept.
+        # (Including the tenants without instances)
+        return not all(self.driver._is_inactive_instance(inst)
+                       for inst in instances)
+
+    def release_floating_ips(self, floating_ips):
+        released = 0
+        for fip in floating_ips:
+            celery_logger.info("Releasing floating IP %s of tenant %s"
+                               % (fip['floating_ip_address'],
+                                  fip['tenant_id']))
+            if self.dry_run:
+                released += 1
+                continue
+            try:
+                self.neutron.delete_floatingip(fip['id'])
+                released += 1
+            except NeutronClientException:
+                celery_logger.exception(
+                    "Could not release floating IP %s" % fip['id'])
+        return released
+
+    def remove_instance_ips(self, instances, ports, floating_ips):
+        """
+        Remove the floating and fixed IPs of (inactive) 'instances'
+        """
+        ports_by_device = defaultdict(list)
+        for port in ports:
+            ports_by_device[port['device_id']].append(port)
+        floating_ips_by_port = dict(
+            (fip['port_id'], fip) for fip in floating_ips)
+        removed = 0
+        for instance in instances:
+            celery_logger.info("Removing the IPs of inactive instance %s"
+                               % instance.id)
+            if self.dry_run:
+                removed += 1
+                continue
+            try:
+                self._remove_instance_ips(
+                    instance, ports_by_device[instance.id],
+                    floating_ips_by_port)
+                removed += 1
+            except Exception:
+                celery_logger.exception(
+                    "Could not remove the IPs of instance %s" % instance.id)
+        return removed
+
+    def _remove_instance_ips(self, instance, instance_ports,
+                             floating_ips_by_port):
+        for port in instance_ports:
+            fip = floating_ips_by_port.get(port['id'])
+            if fip:
+                self.neutron.delete_floatingip(fip['id'])
+        _update_instance_metadata(
+            self.driver, instance,
+            {'public-ip': '', 'public-hostname': ''}, replace=False)
+        if instance_ports:
+            fixed_ips = instance_ports[0].get('fixed_ips', [])
+            if fixed_ips:
+                self.driver._connection.ex_remove_fixed_ip(
+                    instance, fixed_ips[0]['ip_address'])
+
+    def remove_networks(self, tenants):
+        """
+        Remove the security groups, subnet (and router interface) and
+        network of each tenant in {tenant_id: tenant_name}
+        """
+        subnets = dict((subnet['name'], subnet) for subnet
+                       in self.neutron.list_subnets()['subnets'])
+        networks = dict((network['name'], network) for network
+                        in self.neutron.list_networks()['networks'])
+        router_ids = [router['id'] for router
+                      in self.neutron.list_routers()['routers']
+                      if router['name'] == self.network_manager.default_router]
+        security_groups = defaultdict(list)
+        for sec_group in self.neutron.list_security_groups()[
+                'security_groups']:
+            security_groups[sec_group['tenant_id']].append(sec_group)
+        removed = 0
+        for tenant_id, tenant_name in tenants.items():
+            network = networks.get('%s-net' % tenant_name)
+            if not network:
+                celery_logger.info(
+                    "No Network found. Skipping %s" % tenant_name)
+                continue
+            celery_logger.info("Removing project network for %s" % tenant_name)
+            if self.dry_run:
+                removed += 1
+                continue
+            try:
+                self._remove_network(
+                    network, subnets.get('%s-subnet' % tenant_name),
+                    router_ids[0] if router_ids else None,
+                    security_groups[tenant_id])
+                removed += 1
+            except NeutronClientException:
+                celery_logger.exception(
+                    "Could not remove the network of %s" % tenant_name)
+        return removed
+
+    def _remove_network(self, network, subnet, router_id, security_groups):
+        for sec_group in security_groups:
+            self.neutron.delete_security_group(sec_group['id'])
+        if subnet:
+            if router_id:
+                try:
+                    self.neutron.remove_interface_router(
+                        router_id, {"subnet_id": subnet['id']})
+                except NeutronClientException as exc:
+                    if 'no interface on subnet' not in str(exc):
+                        raise
+            self.neutron.delete_subnet(subnet['id'])
+        self.neutron.delete_network(network['id'])
@@ -0,0 +1,195 @@
+"""
+Reconcile cloud inventory (images, sizes) with the database.
+
+Both sides are reduced to sets of identifiers, so a sweep is linear in
+the size of the inventory. Anything that has to be end-dated is updated
+in bulk (one query per model) instead of one save per object.
+"""
+from django.db.models import Q
+from django.utils import timezone
+
+from threepio import logger
+
+from core.models.application import Application
+from core.models.application_catalog import ApplicationCatalogEntry
+from core.models.application_version import ApplicationVersion
+from core.models.instance_source import InstanceSource
+from core.models.machine import ProviderMachine
+from core.models.model_version import bump_model_version
+from core.models.size import Size, convert_esh_size
+from core.query import only_current
+
+# Keep the 'id__in' lists of a single UPDATE to a reasonable size
+BULK_UPDATE_CHUNK_SIZE = 1000
+
+
+class ReconcileResult(object):
+
+    """
+    The outcome of a reconciliation:
+    * added - in the cloud but not (yet) in the database
+    * removed - in the database but no longer in the cloud (end-dated)
+    * unchanged - found in both
+    * versions/applications - end-dated because their last machine was
+    """
+
+    def __init__(self, added=0, removed=0, unchanged=0,
+                 versions=0, applications=0):
+        self.added = added
+        self.removed = removed
+        self.unchanged = unchanged
+        self.versions = versions
+        self.applications = applications
+
+    def __repr__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return "<ReconcileResult: Added:%s Removed:%s Unchanged:%s "\
+            "Versions:%s Applications:%s>"\
+            % (self.added, self.removed, self.unchanged,
+               self.versions, self.applications)
+
+
+def diff_inventory(cloud_ids, db_ids):
+    """
+    Returns a 3-tuple of sets: (added, removed, unchanged)
+    """
+    cloud_ids = set(cloud_ids)
+    db_ids = set(db_ids)
+    return (cloud_ids - db_ids, db_ids - cloud_ids, cloud_ids & db_ids)
+
+
+def _bulk_end_date(queryset, ids, now):
+    count = 0
+    ids = list(ids)
+    for idx in xrange(0, len(ids), BULK_UPDATE_CHUNK_SIZE):
+        count += queryset.filter(
+            id__in=ids[idx:idx + BULK_UPDATE_CHUNK_SIZE]
+        ).update(end_date=now)
+    return count
+
+
+def _versions_without_machines(version_ids, removed_source_ids, now):
+    """
+    Of 'version_ids', return the (still current) versions that will have
+    no current machine once 'removed_source_ids' are end-dated.
+    """
+    if not version_ids:
+        return set()
+    versions_with_machines = set(
+        ProviderMachine.objects.filter(
+            Q(instance_source__end_date__isnull=True) |
+            Q(instance_source__end_date__gt=now),
+            application_version__in=version_ids,
+        ).exclude(
+            instance_source__in=removed_source_ids
+        ).values_list('application_version', flat=True))
+    return set(
+        ApplicationVersion.objects.filter(
+            only_current(now), id__in=version_ids - versions_with_machines
+        ).values_list('id', flat=True))
+
+
+def _applications_without_versions(removed_version_ids, now):
+    """
+    Of the applications that own 'removed_version_ids', return the
+    (still current) applications that will have no current version once
+    'removed_version_ids' are end-dated.
+    """
+    if not removed_version_ids:
+        return set()
+    application_ids = set(
+        ApplicationVersion.objects.filter(
+            id__in=removed_version_ids
+        ).values_list('application', flat=True))
+    applications_with_versions = set(
+        ApplicationVersion.objects.filter(
+            only_current(now), application__in=application_ids
+        ).exclude(
+            id__in=removed_version_ids
+        ).values_list('application', flat=True))
+    return set(
+        Application.objects.filter(
+            Q(end_date__isnull=True) | Q(end_date__gt=now),
+            id__in=application_ids - applications_with_versions
+        ).values_list('id', flat=True))
+
+
+def reconcile_machines(db_machines, cloud_machines, now=None, dry_run=False):
+    """
+    End-date every machine in 'db_machines' (a ProviderMachine queryset)
+    that can NOT be found in 'cloud_machines'.
+    Versions left without a current machine, and applications left without
+    a current version, are end-dated in the same pass.
+    """
+    if not now:
+        now = timezone.now()
+    db_inventory = {}
+    for identifier, source_id, version_id, app_id in db_machines.values_list(
+            'instance_source__identifier', 'instance_source',
+            'application_version', 'application_version__application'):
+        db_inventory[identifier] = (source_id, version_id, app_id)
+    added, removed, unchanged = diff_inventory(
+        [cloud_machine.id for cloud_machine in cloud_machines],
+        db_inventory.keys())
+
+    removed_source_ids = set()
+    affected_version_ids = set()
+    affected_app_ids = set()
+    for identifier in removed:
+        source_id, version_id, app_id = db_inventory[identifier]
+        removed_source_ids.add(source_id)
+        if version_id:
+            affected_version_ids.add(version_id)
+            affected_app_ids.add(app_id)
+    removed_version_ids = _versions_without_machines(
+        affected_version_ids, removed_source_ids, now)
+    removed_application_ids = _applications_without_versions(
+        removed_version_ids, now)
+
+    logger.info("End dating %s machines, %s versions and %s applications"
+                % (len(removed), len(removed_version_ids),
+                   len(removed_application_ids)))
+    logger.debug("End dated machines: %s" % sorted(removed))
+    if not dry_run:
+        _bulk_end_date(InstanceSource.objects.all(), removed_source_ids, now)
+        _bulk_end_date(
+            ApplicationVersion.objects.all(), removed_version_ids, now)
+        _bulk_end_date(
+            Application.objects.all(), removed_application_ids, now)
+        # Bulk updates do not trigger the catalog and model version hooks.
+        ApplicationCatalogEntry.rebuild(affected_app_ids)
+        if removed_source_ids:
+            bump_model_version(
+                ProviderMachine, ApplicationVersion, Application)
+    return ReconcileResult(
+        added=len(added), removed=len(removed), unchanged=len(unchanged),
+        versions=len(removed_version_ids),
+        applications=len(removed_application_ids))
+
+
+def reconcile_sizes(provider, esh_sizes, now=None):
+    """
+    Create/Update a Size for every size in 'esh_sizes'
+    and end-date the current sizes of 'provider' that are no longer listed.
+    """
+    if not now:
+        now = timezone.now()
+    db_sizes = dict(
+        Size.objects.filter(
+            only_current(now), provider=provider
+        ).values_list('alias', 'id'))
+    added, removed, unchanged = diff_inventory(
+        [esh_size.id for esh_size in esh_sizes], db_sizes.keys())
+    for esh_size in esh_sizes:
+        convert_esh_size(esh_size, provider.uuid)
+    removed_size_ids = set(db_sizes[alias] for alias in removed)
+    if removed_size_ids:
+        logger.debug("End dating inactive sizes: %s"
+                     % sorted(removed_size_ids))
+        _bulk_end_date(Size.objects.all(), removed_size_ids, now)
+        bump_model_version(Size)
+    return ReconcileResult(
+        added=len(added), removed=len(removed_size_ids),
+        unchanged=len(unchanged))
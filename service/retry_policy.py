@@ -0,0 +1,159 @@
+"""
+Retry policies for the polling tasks of service.tasks.driver.
+
+'next_retry_delay' returns the countdown of a task's next retry:
+* Exponential backoff (with jitter), per task.
+  See DEFAULT_RETRY_POLICIES (and settings.TASK_RETRY_POLICIES)
+* If the image of the instance usually takes longer to be ready
+  (The settings.READY_TIME_PERCENTILE of the times recorded with
+  'record_ready_time'), wait until then instead.
+* If a provider has more than settings.TASK_RETRIES_IN_FLIGHT retries
+  scheduled, its retries are spread out
+  (So that about that many are sent to the broker per delay)
+"""
+import math
+import random
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+import redis
+
+from core.models.instance import Instance
+from service.cache import redis_connection
+
+DEFAULT_RETRY_POLICIES = {
+    # Was: 15 seconds, 250 times
+    "wait_for_instance": {
+        "delay": 5, "factor": 1.5, "max_delay": 15, "max_wait": 5 * 60},
+    # Was: 64 seconds, 300 times
+    "deploy_ready_test": {
+        "delay": 8, "factor": 1.5, "max_delay": 64, "max_wait": 10 * 60},
+}
+
+READY_TIMES_KEY = "ready_times.{0}.{1}"
+READY_TIMES_KEPT = 100
+# Fewer samples are not worth a percentile.
+READY_TIMES_MIN_SAMPLES = 5
+# Longer times are not launches (i.e. waiting for a resume)
+READY_TIME_MAX = 60 * 60
+RETRIES_IN_FLIGHT_KEY = "retries_in_flight.{0}"
+
+
+class RetryPolicy(object):
+
+    """
+    Exponential backoff: 'delay' * 'factor' ** retries (Up to 'max_delay')
+    +/- 'jitter' (A fraction of the delay).
+    'max_wait' is the longest delay used to wait for the expected
+    ready time (See next_retry_delay)
+    """
+
+    def __init__(self, delay, factor=2, max_delay=None, max_wait=None,
+                 jitter=0.2):
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay or delay
+        self.max_wait = max_wait or self.max_delay
+        self.jitter = jitter
+
+    def backoff(self, retries):
+        delay = min(self.delay * float(self.factor) ** retries,
+                    self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def get_retry_policy(task_name):
+    policies = dict(DEFAULT_RETRY_POLICIES)
+    policies.update(getattr(settings, 'TASK_RETRY_POLICIES', {}))
+    return RetryPolicy(**policies[task_name])
+
+
+def _instance_info(instance_alias):
+    """
+    Returns (start_date, image_id, provider_uuid) of an instance
+    (Or None)
+    """
+    return Instance.objects.filter(provider_alias=instance_alias)\
+        .values_list('start_date', 'source__identifier',
+                     'source__provider__uuid').first()
+
+
+def _elapsed(start_date):
+    return (timezone.now() - start_date).total_seconds()
+
+
+def record_ready_time(task_name, instance_alias):
+    """
+    Record how long (since its launch) 'instance_alias' took to be ready,
+    for 'task_name'.
+    """
+    info = _instance_info(instance_alias)
+    if not info:
+        return
+    start_date, image_id, _ = info
+    seconds = _elapsed(start_date)
+    if seconds > READY_TIME_MAX:
+        return
+    key = READY_TIMES_KEY.format(task_name, image_id)
+    try:
+        pipe = redis_connection().pipeline()
+        pipe.lpush(key, seconds)
+        pipe.ltrim(key, 0, READY_TIMES_KEPT - 1)
+        pipe.expire(key, 30 * 24 * 60 * 60)
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        pass
+
+
+def expected_ready_time(task_name, image_id):
+    """
+    Returns the READY_TIME_PERCENTILE of the recorded ready times
+    (Or None)
+    """
+    times = sorted(float(seconds) for seconds in redis_connection().lrange(
+        READY_TIMES_KEY.format(task_name, image_id), 0, -1))
+    if len(times) < READY_TIMES_MIN_SAMPLES:
+        return None
+    percentile = getattr(settings, 'READY_TIME_PERCENTILE', 50)
+    return times[int(round(percentile / 100.0 * (len(times) - 1)))]
+
+
+def _spread_retries(provider_uuid, task_id, delay):
+    limit = getattr(settings, 'TASK_RETRIES_IN_FLIGHT', None)
+    if not limit:
+        return delay
+    key = RETRIES_IN_FLIGHT_KEY.format(provider_uuid)
+    now = time.time()
+    conn = redis_connection()
+    conn.zremrangebyscore(key, '-inf', now)
+    in_flight = conn.zcard(key)
+    if in_flight >= limit:
+        delay = delay * in_flight / float(limit)
+    conn.zadd(key, **{task_id: now + delay})
+    conn.expire(key, 2 * 60 * 60)
+    return delay
+
+
+def next_retry_delay(task_name, retries, instance_alias=None, task_id=None):
+    """
+    Returns the countdown (seconds) of the next retry of 'task_name'
+    """
+    policy = get_retry_policy(task_name)
+    delay = policy.backoff(retries)
+    info = _instance_info(instance_alias) if instance_alias else None
+    if not info:
+        return int(math.ceil(delay))
+    start_date, image_id, provider_uuid = info
+    try:
+        expected = expected_ready_time(task_name, image_id)
+        if expected:
+            remaining = expected - _elapsed(start_date)
+            if remaining > delay:
+                delay = min(remaining, policy.max_wait)
+        if task_id:
+            delay = _spread_retries(provider_uuid, task_id, delay)
+    except redis.exceptions.ConnectionError:
+        pass
+    return int(math.ceil(delay))
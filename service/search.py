@@ -11,7 +11,8 @@ from core.models.machine import compare_core_machines, filter_core_machine,\
     ProviderMachine
 from core.models.provider import Provider
 from core.models.application import Application
-from core.query import only_current_source
+from core.models.application_search import ApplicationSearchDocument
+from core.query import only_current_apps, only_current_source
 from functools import reduce
 
 
@@ -81,15 +82,10 @@ class CoreApplicationSearch(BaseSearchProvider):
                 private=False,
                 # Providermachine's provider is active
                 versions__machines__instance_source__provider__in=active_providers)
-        # AND query matches on:
-        query_match = base_apps.filter(
-            # app tag name
-            Q(tags__name__icontains=query)
-            # OR app tag desc
-            | Q(tags__description__icontains=query)
-            # OR app name
-            | Q(name__icontains=query)
-            # OR app desc
-            | Q(description__icontains=query),
-            *only_current_source())
-        return query_match.distinct()
+        base_apps = base_apps.filter(only_current_apps())
+        # AND query matches (as a prefix) on the search document:
+        # app name, app tag names, app desc, app tag desc
+        # and version change logs (Best match first)
+        return ApplicationSearchDocument.search(
+            query,
+            Application.objects.filter(id__in=base_apps.values('id')))
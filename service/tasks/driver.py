@@ -7,12 +7,14 @@ from operator import attrgetter
 import sys
 import re
 import time
+import uuid
 
 from django.conf import settings
 #NOTE: Why are we pulling for this explicitly? Test calling this straight from settings.ATMOSPHERE_PRIVATE_KEYFILE
 from atmosphere.settings.local import ATMOSPHERE_PRIVATE_KEYFILE
 from django.utils.timezone import datetime, timedelta
 from celery.decorators import task
+from celery.exceptions import Ignore
 from celery.task import current
 from celery.result import allow_join_result
 
@@ -25,36 +27,56 @@ from rtwo.exceptions import NonZeroDeploymentException
 from threepio import celery_logger, status_logger, logger
 
 from celery import current_app as app
+from celery import signature
 
 from core.email import send_instance_email
 from core.models.boot_script import get_scripts_for_instance
 from core.models.instance import Instance
 from core.models.identity import Identity
 from core.models.profile import UserProfile
+from core.models.provider import Provider
 
 from service.deploy import (
     inject_env_script, check_process, wrap_script,
-    deploy_to as ansible_deploy_to, build_host_name,
+    deploy_to as ansible_deploy_to, build_host_name, deploy_to_many,
     ready_to_deploy as ansible_ready_to_deploy,
     run_utility_playbooks, execution_has_failures
     )
+from service.deferred import complete_deferred_task
+from service.deploy_batch import (
+    DEPLOY_BATCH_TIME_LIMIT, add_deployment, finish_deployment,
+    release_batch, take_deployments)
 from service.driver import get_driver, get_account_driver
-from service.exceptions import AnsibleDeployException
+from service.exceptions import AnsibleDeployException, InstanceTerminalState
 from service.instance import _update_instance_metadata
+from service.instance_watcher import (
+    get_instance_watcher, instance_readiness, InstanceWatcher,
+    READY, TERMINAL)
+from service.network_gc import NetworkGC
 from service.networking import _generate_ssh_kwargs
+from service.retry_policy import (
+    get_retry_policy, next_retry_delay, record_ready_time)
 
 
 def _update_status_log(instance, status_update):
-    now_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    _write_status_log(_status_log_fields(instance), status_update)
+
+
+def _status_log_fields(instance):
     try:
         user = instance._node.extra['metadata']['creator']
     except KeyError as no_user:
         user = "Unknown -- Metadata missing"
     size_alias = instance._node.extra['flavorId']
     machine_alias = instance._node.extra['imageId']
+    return (user, instance.alias, machine_alias, size_alias)
+
+
+def _write_status_log(status_fields, status_update):
+    now_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     status_logger.debug("%s,%s,%s,%s,%s,%s"
-                        % (now_time, user, instance.alias, machine_alias,
-                           size_alias, status_update))
+                        % ((now_time,) + tuple(status_fields)
+                           + (status_update,)))
 
 
 @task(name="print_debug")
@@ -100,6 +122,8 @@ def wait_for_instance(
     """
     #Task makes 250 attempts to 'look at' the instance, waiting 15sec each try
     Cumulative time == 1 hour 2 minutes 30 seconds before FAILURE
+    NOTE: When the provider has an InstanceWatcher, the task hands its
+    callbacks to the watcher instead (See service.instance_watcher)
 
     status_query = "active" Match only one value, active
     status_query = ["active","suspended"] or match multiple values.
@@ -113,27 +137,56 @@ def wait_for_instance(
                                     instance_alias, status_query,
                                     tasks_allowed, return_id), {})
 
+        watcher = get_instance_watcher(instance_alias, provider)
+        request = wait_for_instance.request
+        if watcher and watcher.add(
+                request.id, instance_alias, status_query,
+                tasks_allowed=tasks_allowed, return_id=return_id,
+                callbacks=request.callbacks, errbacks=request.errbacks,
+                timeout=(wait_for_instance.max_retries - request.retries)
+                * wait_for_instance.default_retry_delay):
+            # The watcher runs the callbacks (or errbacks) of this task.
+            raise Ignore()
+
         result = _is_instance_ready(driverCls, provider, identity,
                                     instance_alias, status_query,
                                     tasks_allowed, return_id)
         return result
+    except Ignore:
+        raise
+    except InstanceTerminalState as exc:
+        celery_logger.error(str(exc))
+        raise
     except Exception as exc:
         if "Not Ready" not in str(exc):
             # Ignore 'normal' errors.
             celery_logger.exception(exc)
 
-        wait_for_instance.retry(exc=exc)
+        _retry(wait_for_instance, exc, instance_alias)
+
+
+def _retry(task_class, exc, instance_alias):
+    """
+    Retry the current task, when its retry policy says so.
+    See service.retry_policy
+    """
+    request = task_class.request
+    task_class.retry(exc=exc, countdown=next_retry_delay(
+        task_class.name, request.retries, instance_alias, request.id))
 
 
 def _eager_override(task_class, run_method, args, kwargs):
     attempts = 0
-    delay = task_class.default_retry_delay or 30  # Seconds
+    policy = get_retry_policy(task_class.name)
     while attempts < task_class.max_retries:
         try:
             result = run_method(*args, **kwargs)
             return result
+        except InstanceTerminalState:
+            raise
         except Exception as exc:
             celery_logger.exception("Encountered error while running eager")
+        delay = policy.backoff(attempts)
         attempts += 1
         celery_logger.info("Waiting %d seconds" % delay)
         time.sleep(delay)
@@ -143,8 +196,6 @@ def _eager_override(task_class, run_method, args, kwargs):
 def _is_instance_ready(driverCls, provider, identity,
                        instance_alias, status_query,
                        tasks_allowed=False, return_id=False):
-    # TODO: Refactor so that terminal states can be found. IE if waiting for
-    # 'active' and in status: Suspended - none - GIVE up!!
     driver = get_driver(driverCls, provider, identity)
     instance = driver.get_instance(instance_alias)
     if not instance:
@@ -154,17 +205,34 @@ def _is_instance_ready(driverCls, provider, identity,
         return False
     i_status = instance._node.extra['status'].lower()
     i_task = instance._node.extra['task']
-    if (i_status not in status_query) or (i_task and not tasks_allowed):
+    readiness = instance_readiness(instance, status_query, tasks_allowed)
+    if readiness == TERMINAL:
+        raise InstanceTerminalState(
+            "Instance: %s: Status: (%s - %s) - Will not become %s"
+            % (instance.id, i_status, i_task, status_query))
+    if readiness != READY:
         raise Exception(
             "Instance: %s: Status: (%s - %s) - Not Ready"
             % (instance.id, i_status, i_task))
     celery_logger.debug("Instance %s: Status: (%s - %s) - Ready"
                  % (instance.id, i_status, i_task))
+    if 'active' in status_query:
+        record_ready_time('wait_for_instance', instance_alias)
     if return_id:
         return instance.id
     return True
 
 
+@task(name="watch_instances_for", ignore_result=True)
+def watch_instances_for(provider_uuid, token=None):
+    """
+    Resolve the 'wait_for_instance' tasks waiting on the provider.
+    (Reschedules itself while tasks are waiting)
+    """
+    provider = Provider.objects.get(uuid=provider_uuid)
+    InstanceWatcher(provider).run(token)
+
+
 @task(name="add_fixed_ip",
       ignore_result=True,
       default_retry_delay=15,
@@ -308,17 +376,35 @@ def clear_empty_ips():
     if settings.DEBUG:
         celery_logger.debug("clear_empty_ips task SKIPPED at %s." % datetime.now())
         return
-    identities = current_openstack_identities()
-    for core_identity in identities:
+    providers = Provider.objects.filter(
+        type__name__iexact='openstack', active=True)
+    for provider in providers:
         try:
-            # TODO: Add some
-            clear_empty_ips_for.apply_async(args=[core_identity.uuid,
-                                                  core_identity.created_by])
+            clear_empty_ips_for_provider.apply_async(args=[provider.uuid])
         except Exception as exc:
             celery_logger.exception(exc)
     celery_logger.debug("clear_empty_ips task finished at %s." % datetime.now())
 
 
+@task(name="clear_empty_ips_for_provider")
+def clear_empty_ips_for_provider(provider_uuid):
+    """
+    'clear_empty_ips_for' every identity of the provider, in bulk.
+    See service.network_gc
+    """
+    provider = Provider.objects.get(uuid=provider_uuid)
+    account_driver = get_account_driver(provider)
+    if not account_driver:
+        return None
+    summary = NetworkGC(provider, account_driver=account_driver).run()
+    celery_logger.info(
+        "clear_empty_ips_for_provider %s: Released %s floating IPs, "
+        "removed the IPs of %s instances and %s networks"
+        % (provider.location, summary['floating_ips'],
+           summary['instances'], summary['networks']))
+    return summary
+
+
 @task(name="_send_instance_email",
       default_retry_delay=10,
       max_retries=2)
@@ -985,15 +1071,16 @@ def deploy_ready_test(driverCls, provider, identity, instance_id,
         celery_logger.exception(exc)
         _deploy_ready_failed_email_test(
             driver, instance_id, exc.message, current.request, deploy_ready_test)
-        deploy_ready_test.retry(exc=exc)
+        _retry(deploy_ready_test, exc, instance_id)
     # USE ANSIBLE
     try:
         username = identity.user.username
         playbooks = ansible_ready_to_deploy(instance.ip, username, instance_id)
         _update_status_log(instance, "Ansible Finished (ready test) for %s." % instance.ip)
+        record_ready_time('deploy_ready_test', instance_id)
         celery_logger.debug("deploy_ready_test task finished at %s." % datetime.now())
     except AnsibleDeployException as exc:
-        deploy_ready_test.retry(exc=exc)
+        _retry(deploy_ready_test, exc, instance_id)
     except DeploymentError as exc:
         celery_logger.exception(exc)
         full_deploy_output = _parse_steps_output(msd)
@@ -1007,10 +1094,10 @@ def deploy_ready_test(driverCls, provider, identity, instance_id,
         # TODO: Check if all exceptions thrown at this time
         # fall in this category, and possibly don't retry if
         # you hit the Exception block below this.
-        deploy_ready_test.retry(exc=exc)
+        _retry(deploy_ready_test, exc, instance_id)
     except (BaseException, Exception) as exc:
         celery_logger.exception(exc)
-        deploy_ready_test.retry(exc=exc)
+        _retry(deploy_ready_test, exc, instance_id)
 
 
 @task(name="_deploy_init_to",
@@ -1019,7 +1106,7 @@ def deploy_ready_test(driverCls, provider, identity, instance_id,
       max_retries=10)
 def _deploy_init_to(driverCls, provider, identity, instance_id,
                     username=None, password=None, token=None, redeploy=False,
-                    **celery_task_args):
+                    batch=True, **celery_task_args):
     # Note: Splitting preperation (Of the MultiScriptDeployment) and execution
     # This makes it easier to output scripts for debugging of users.
     try:
@@ -1039,6 +1126,20 @@ def _deploy_init_to(driverCls, provider, identity, instance_id,
     except (BaseException, Exception) as exc:
         celery_logger.exception(exc)
         _deploy_init_to.retry(exc=exc)
+    request = _deploy_init_to.request
+    if batch and not app.conf.CELERY_ALWAYS_EAGER and add_deployment({
+            'task_id': request.id,
+            'instance_ip': instance.ip,
+            'username': identity.user.username,
+            'instance_id': instance_id,
+            'status_fields': _status_log_fields(instance),
+            'task_args': (driverCls, provider, identity, instance_id),
+            'task_kwargs': {'username': username, 'password': password,
+                            'token': token, 'redeploy': redeploy},
+            'callbacks': request.callbacks,
+            'errbacks': request.errbacks}):
+        # 'deploy_batch' runs the callbacks of this task.
+        raise Ignore()
     try:
         username = identity.user.username
         playbooks = ansible_deploy_to(instance.ip, username, instance_id)
@@ -1066,6 +1167,61 @@ def _deploy_init_to(driverCls, provider, identity, instance_id,
         _deploy_init_to.retry(exc=exc)
 
 
+@task(name="deploy_batch", ignore_result=True,
+      time_limit=DEPLOY_BATCH_TIME_LIMIT)
+def deploy_batch():
+    """
+    Deploy to the instances of the next batch. See service.deploy_batch
+    (A deployment that fails is retried on its own, by '_deploy_init_to')
+    """
+    batch_id = deploy_batch.request.id or uuid.uuid4().hex
+    deployments = take_deployments(batch_id)
+    try:
+        _deploy_batch(batch_id, deployments)
+    finally:
+        release_batch(batch_id)
+
+
+def _deploy_batch(batch_id, deployments):
+    if not deployments:
+        return
+    celery_logger.info("deploy_batch: Deploying to %s instances"
+                       % len(deployments))
+    try:
+        results = deploy_to_many(
+            [(deployment['instance_ip'], deployment['username'],
+              deployment['instance_id']) for _, deployment in deployments])
+    except Exception as exc:
+        celery_logger.exception(exc)
+        results = dict((deployment['instance_id'], exc)
+                       for _, deployment in deployments)
+    for payload, deployment in deployments:
+        exc = results.get(deployment['instance_id'])
+        if not exc:
+            _write_status_log(deployment['status_fields'],
+                              "Ansible Finished for %s."
+                              % deployment['instance_ip'])
+            complete_deferred_task(
+                deployment['task_id'], deployment['callbacks'], None)
+        else:
+            celery_logger.warn(
+                "deploy_batch: Deploy to %s failed, retrying: %s"
+                % (deployment['instance_id'], exc))
+            # The retry takes over the (deferred) task: Same task id.
+            _deploy_init_to.apply_async(
+                deployment['task_args'],
+                dict(deployment['task_kwargs'], batch=False),
+                task_id=deployment['task_id'],
+                link=_signatures(deployment['callbacks']),
+                link_error=_signatures(deployment['errbacks']))
+        finish_deployment(batch_id, payload)
+
+
+def _signatures(task_dicts):
+    return [signature(task_dict, app=app)
+            for task_dict in task_dicts or []] or None
+
+
 def _parse_steps_output(msd):
     output = ""
     length = len(msd.steps)
@@ -1,29 +1,37 @@
 from datetime import timedelta
+from multiprocessing import Pool
 
+from django import db
 from django.conf import settings
 from django.db.models import Q, Count
 from django.utils import timezone
 
+from celery import chord
 from celery.decorators import task
 
 from core.query import (
-    only_current, only_current_source,
-    source_in_range, inactive_versions)
-from core.models.size import Size, convert_esh_size
-from core.models.instance import convert_esh_instance
+    only_current_source, source_in_range, inactive_versions)
+from core.models.instance import convert_esh_instance, convert_esh_instances
 from core.models.provider import Provider
 from core.models.machine import get_or_create_provider_machine, ProviderMachine
 from core.models.application import Application, ApplicationMembership
 from core.models.application_version import ApplicationVersion
-from core.models import Allocation, Credential
+from core.models import (
+    Allocation, AllocationStrategy, ApplicationCatalogEntry, Credential,
+    UsageRollup)
 
 from service.monitoring import (
     _cleanup_missing_instances,
+    _get_allocation_results,
+    get_next_window_start,
     _get_instance_owner_map,
     _get_identity_from_tenant_name)
 from service.monitoring import user_over_allocation_enforcement
 from service.driver import get_account_driver
-from service.cache import get_cached_driver
+from service.cache import (
+    get_cached_driver, get_cached_project_directory, get_cached_size_catalog)
+from service.reconcile import reconcile_machines, reconcile_sizes
+from service.image_membership import ImageMembershipSync
 from glanceclient.exc import HTTPConflict, HTTPForbidden
 
 from threepio import celery_logger
@@ -62,11 +70,11 @@ def strfdate(datetime_o, fmt=None):
 def tenant_id_to_name_map(account_driver):
     """
     INPUT: account driver
-    Get a list of projects
+    Get a list of projects (From the shared ProjectDirectory)
     OUTPUT: A dictionary with keys of ID and values of name
     """
-    all_projects = account_driver.list_projects()
-    return {tenant.id: tenant.name for tenant in all_projects}
+    return get_cached_project_directory(
+        account_driver.core_provider, account_driver).project_names
 
 
 @task(name="monitor_machines")
@@ -126,15 +134,18 @@ def prune_machines_for(
         return
 
     # Loop 1 - End-date All machines in the DB that
-    # can NOT be found in the cloud.
-    mach_count = _end_date_missing_database_machines(
+    # can NOT be found in the cloud (And their versions/applications).
+    machine_result = reconcile_machines(
         db_machines, cloud_machines, now=now, dry_run=dry_run)
+    mach_count = machine_result.removed
 
     # Loop 2 and 3 - Capture all (still-active) versions without machines,
     # and all applications without versions.
     # These are 'outliers' and mainly here for safety-check purposes.
-    ver_count = _remove_versions_without_machines(now=now)
-    app_count = _remove_applications_without_versions(now=now)
+    ver_count = machine_result.versions
+    app_count = machine_result.applications
+    ver_count += _remove_versions_without_machines(now=now)
+    app_count += _remove_applications_without_versions(now=now)
 
     # Loop 4 - All 'Application' DB objects require
     # >=1 Version with >=1 ProviderMachine (ACTIVE!)
@@ -143,8 +154,10 @@ def prune_machines_for(
 
     celery_logger.info(
         "prune_machines completed for Provider %s : "
-        "%s Applications, %s versions and %s machines pruned."
-        % (provider, app_count, ver_count, mach_count))
+        "%s Applications, %s versions and %s machines pruned. "
+        "(%s machines unchanged, %s cloud images not tracked)"
+        % (provider, app_count, ver_count, mach_count,
+           machine_result.unchanged, machine_result.added))
     if print_logs:
         celery_logger.removeHandler(consolehandler)
 
@@ -172,31 +185,25 @@ def monitor_machines_for(provider_id, print_logs=False, dry_run=False):
         consolehandler.setLevel(logging.DEBUG)
         celery_logger.addHandler(consolehandler)
 
-    #STEP 1: get the apps
-    new_public_apps, private_apps = get_public_and_private_apps(provider)
-
-    #STEP 2: Find conflicts and report them.
-    intersection = set(private_apps.keys()) & set(new_public_apps)
-    if intersection:
-        celery_logger.error("These applications were listed as BOTH public && private apps. Manual conflict correction required: %s" % intersection)
-
-    #STEP 3: Apply the changes at app-level
-    #Memoization at this high of a level will help save time
-    account_drivers = {} # Provider -> accountDriver
-    provider_tenant_mapping = {}  # Provider -> [{TenantId : TenantName},...]
-    image_maps = {}
-    for app in new_public_apps:
-        if app in intersection:
-            celery_logger.error("Skipped public app: %s <%s>" % (app, app.id))
-            continue
-        make_machines_public(app, account_drivers, dry_run=dry_run)
+    #STEP 1: Sync private images and ApplicationMemberships (in bulk)
+    #        and find the apps that should be public.
+    account_driver = get_account_driver(provider)
+    summary = ImageMembershipSync(
+        provider, account_driver, dry_run=dry_run).run()
 
-    for app, membership in private_apps.items():
-        if app in intersection:
-            celery_logger.error("Skipped private app: %s <%s>" % (app, app.id))
-            continue
-        make_machines_private(app, membership, account_drivers, provider_tenant_mapping, image_maps, dry_run=dry_run)
+    #STEP 2: Apply the changes to the (new) public apps
+    account_drivers = {provider: account_driver}  # Provider -> accountDriver
+    for app in summary['public_applications']:
+        make_machines_public(app, account_drivers, dry_run=dry_run)
 
+    celery_logger.info(
+        "monitor_machines completed for Provider %s : "
+        "%s images, %s private applications, %s public applications, "
+        "%s conflicts. %s images shared, %s memberships added, "
+        "%s memberships removed."
+        % (provider, summary['images'], summary['private_applications'],
+           len(summary['public_applications']), summary['conflicts'],
+           summary['shared'], summary['created'], summary['deleted']))
     if print_logs:
         celery_logger.removeHandler(consolehandler)
     return
@@ -240,49 +247,7 @@ def get_public_and_private_apps(provider):
     return new_public_apps, private_apps
 
 
-def remove_machine(db_machine, now_time=None, dry_run=False):
-    """
-    End date the DB ProviderMachine
-    If all PMs are end-dated, End date the ApplicationVersion
-    if all Versions are end-dated, End date the Application
-    """
-    if not now_time:
-        now_time = timezone.now()
-
-    db_machine.end_date = now_time
-    celery_logger.info("End dating machine: %s" % db_machine)
-    if not dry_run:
-        db_machine.save()
-
-    db_version = db_machine.application_version
-    if db_version.machines.filter(
-            # Look and see if all machines are end-dated.
-            Q(instance_source__end_date__isnull=True) |
-            Q(instance_source__end_date__gt=now_time)
-            ).count() != 0:
-        # Other machines exist.. No cascade necessary.
-        return True
-    # Version also completely end-dated. End date this version.
-    db_version.end_date = now_time
-    celery_logger.info("End dating version: %s" % db_version)
-    if not dry_run:
-        db_version.save()
-
-    db_application = db_version.application
-    if db_application.versions.filter(
-            # If all versions are end-dated
-            only_current(now_time)
-            ).count() != 0:
-        # Other versions exist.. No cascade necessary..
-        return True
-    db_application.end_date = now_time
-    celery_logger.info("End dating application: %s" % db_application)
-    if not dry_run:
-        db_application.save()
-    return True
-
-
-def make_machines_private(application, identities, account_drivers={}, provider_tenant_mapping={}, image_maps={}, dry_run=False):
+def make_machines_private(application, identities, account_drivers={}, image_maps={}, dry_run=False):
     """
     This method is called when the DB has marked the Machine/Application as PUBLIC
     But the CLOUD states that the machine is really private.
@@ -293,7 +258,8 @@ def make_machines_private(application, identities, account_drivers={}, provider_
             # For each *active* machine in app/version..
             # Loop over each identity and check the list of 'current tenants' as viewed by keystone.
             account_driver = memoized_driver(machine, account_drivers)
-            tenant_name_mapping = memoized_tenant_name_map(account_driver, provider_tenant_mapping)
+            # The (shared) ProjectDirectory is cached per provider.
+            tenant_name_mapping = tenant_id_to_name_map(account_driver)
             current_tenants = get_current_members(
                     account_driver, machine, tenant_name_mapping)
             provider = machine.instance_source.provider
@@ -331,14 +297,6 @@ def memoized_driver(machine, account_drivers={}):
         account_drivers[provider] = account_driver
     return account_driver
 
-def memoized_tenant_name_map(account_driver, tenant_list_maps={}):
-    tenant_id_name_map = tenant_list_maps.get(account_driver.core_provider)
-    if not tenant_id_name_map:
-        tenant_id_name_map = tenant_id_to_name_map(account_driver)
-        tenant_list_maps[account_driver.core_provider] = tenant_id_name_map
-
-    return tenant_id_name_map
-
 def get_current_members(account_driver, machine, tenant_id_name_map):
     current_membership = account_driver.image_manager.shared_images_for(
             image_id=machine.identifier)
@@ -462,6 +420,12 @@ def monitor_instances_for(provider_id, users=None,
     Optionally, provide a list of usernames to monitor
     While debugging, print_logs=True can be very helpful.
     start_date and end_date allow you to search a 'non-standard' window of time.
+
+    Users are split into disjoint shards of MONITOR_INSTANCES_CHUNK_SIZE:
+    * As a celery task, each shard is a 'monitor_instances_for_users' task
+      and 'monitor_instances_summary' logs the per-run summary.
+    * When called directly, shards are run in a pool of
+      MONITOR_INSTANCES_PROCESSES and the per-run summary is returned.
     """
     provider = Provider.objects.get(id=provider_id)
 
@@ -470,6 +434,22 @@ def monitor_instances_for(provider_id, users=None,
         return
 
     instance_map = _get_instance_owner_map(provider, users=users)
+    shards = _shard_instance_map(
+        instance_map, settings.MONITOR_INSTANCES_CHUNK_SIZE)
+
+    if not monitor_instances_for.request.called_directly:
+        if not shards:
+            return 0
+        header = [monitor_instances_for_users.si(
+            provider_id, shard, print_logs=print_logs,
+            check_allocations=check_allocations,
+            start_date=start_date, end_date=end_date)
+            for shard in shards]
+        chord(header)(monitor_instances_summary.s(provider_id))
+        celery_logger.info(
+            "Monitoring %s users of Provider %s in %s shards"
+            % (len(instance_map), provider, len(shards)))
+        return len(shards)
 
     if print_logs:
         import logging
@@ -478,42 +458,217 @@ def monitor_instances_for(provider_id, users=None,
         consolehandler.setLevel(logging.DEBUG)
         celery_logger.addHandler(consolehandler)
 
-    # DEVNOTE: Potential slowdown running multiple functions
-    # Break this out when instance-caching is enabled
-    running_total = 0
-    for username in sorted(instance_map.keys()):
-        running_instances = instance_map[username]
-        running_total += len(running_instances)
+    shard_args = [(provider_id, shard, print_logs, check_allocations,
+                   start_date, end_date) for shard in shards]
+    processes = min(settings.MONITOR_INSTANCES_PROCESSES, len(shards))
+    if processes > 1:
+        # Forked processes can NOT share the database connection.
+        db.connections.close_all()
+        pool = Pool(processes)
+        try:
+            summaries = pool.map(_monitor_instances_shard, shard_args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        summaries = map(_monitor_instances_shard, shard_args)
+    summary = monitor_instances_summary(summaries, provider_id)
+    if print_logs:
+        celery_logger.removeHandler(consolehandler)
+    return summary
+
+
+@task(name="monitor_instances_for_users")
+def monitor_instances_for_users(provider_id, user_instance_map,
+                                print_logs=False, check_allocations=False,
+                                start_date=None, end_date=None):
+    """
+    Monitor a single shard of users for 'monitor_instances_for'.
+    user_instance_map - {username: [running_instance, ...]}
+    Returns the summary for this shard.
+    """
+    provider = Provider.objects.get(id=provider_id)
+    summary = _new_monitoring_summary()
+    identities = {}
+    convert_list = []
+    for username in sorted(user_instance_map.keys()):
+        running_instances = user_instance_map[username]
+        summary['users'] += 1
+        summary['running_instances'] += len(running_instances)
         identity = _get_identity_from_tenant_name(provider, username)
         if identity and running_instances:
             try:
                 driver = get_cached_driver(identity=identity)
-                core_running_instances = [
-                    convert_esh_instance(
-                        driver,
-                        inst,
-                        identity.provider.uuid,
-                        identity.uuid,
-                        identity.created_by) for inst in running_instances]
             except Exception as exc:
                 celery_logger.exception(
                     "Could not convert running instances for %s" %
                     username)
+                summary['errors'].append(username)
                 continue
-        else:
-            # No running instances.
-            core_running_instances = []
-        # Using the 'known' list of running instances, cleanup the DB
-        core_instances = _cleanup_missing_instances(
-            identity,
-            core_running_instances)
-        if check_allocations:
-            allocation_result = user_over_allocation_enforcement(
-                provider, username,
-                print_logs, start_date, end_date)
-    if print_logs:
-        celery_logger.removeHandler(consolehandler)
-    return running_total
+            convert_list.extend(
+                (driver, inst, identity.uuid, identity.created_by)
+                for inst in running_instances)
+        identities[username] = identity
+    core_running_map = _convert_running_instances(
+        provider, convert_list, summary)
+    for username in sorted(identities.keys()):
+        identity = identities[username]
+        if username in summary['errors']:
+            continue
+        core_running_instances = [
+            core_running_map[inst.id]
+            for inst in user_instance_map[username]
+            if identity and inst.id in core_running_map]
+        try:
+            # Using the 'known' list of running instances, cleanup the DB
+            core_instances = _cleanup_missing_instances(
+                identity,
+                core_running_instances)
+            if check_allocations:
+                # Resume from the last checkpoint, unless a non-standard
+                # window of time was requested.
+                incremental = not (start_date or end_date)
+                allocation_result = user_over_allocation_enforcement(
+                    provider, username,
+                    print_logs, start_date, end_date, incremental=incremental)
+                if allocation_result and \
+                        allocation_result.total_difference()[0]:
+                    summary['over_allocation'].append(username)
+        except Exception:
+            celery_logger.exception(
+                "Could not monitor instances for %s" % username)
+            summary['errors'].append(username)
+    return summary
+
+
+def _convert_running_instances(provider, convert_list, summary):
+    """
+    Convert every running instance of the shard in bulk
+    (See core.models.instance.convert_esh_instances).
+    If the bulk conversion fails, convert the instances of each user
+    separately, so one bad instance only affects its owner.
+    Returns a dict: {instance_id: core_instance}
+    """
+    try:
+        size_catalog = get_cached_size_catalog(provider)
+    except Exception:
+        celery_logger.exception(
+            "Could not retrieve the size catalog for %s" % provider)
+        size_catalog = None
+    try:
+        core_instances = convert_esh_instances(
+            convert_list, provider.uuid, size_catalog)
+        return dict((inst.id, core_instance) for ((_, inst, _, _),
+                                                  core_instance)
+                    in zip(convert_list, core_instances))
+    except Exception:
+        celery_logger.exception(
+            "Could not convert running instances in bulk for %s" % provider)
+    core_running_map = {}
+    for (driver, inst, identity_uuid, user) in convert_list:
+        if user.username in summary['errors']:
+            continue
+        try:
+            core_running_map[inst.id] = convert_esh_instance(
+                driver, inst, provider.uuid, identity_uuid, user,
+                size_catalog=size_catalog)
+        except Exception:
+            celery_logger.exception(
+                "Could not convert running instances for %s" %
+                user.username)
+            summary['errors'].append(user.username)
+    return core_running_map
+
+
+@task(name="monitor_instances_summary")
+def monitor_instances_summary(summaries, provider_id):
+    """
+    Aggregate the summary of every shard into the per-run summary
+    """
+    summary = _new_monitoring_summary()
+    for shard_summary in summaries:
+        summary['users'] += shard_summary['users']
+        summary['running_instances'] += shard_summary['running_instances']
+        summary['over_allocation'].extend(shard_summary['over_allocation'])
+        summary['errors'].extend(shard_summary['errors'])
+    celery_logger.info(
+        "Monitored Provider %s: %s users, %s running instances, "
+        "%s over allocation, %s errors(%s)"
+        % (provider_id, summary['users'], summary['running_instances'],
+           len(summary['over_allocation']), len(summary['errors']),
+           ", ".join(summary['errors'])))
+    return summary
+
+
+def _new_monitoring_summary():
+    return {
+        'users': 0,
+        'running_instances': 0,
+        'over_allocation': [],
+        'errors': [],
+    }
+
+
+def _shard_instance_map(instance_map, chunk_size):
+    """
+    Split the instance_map into disjoint shards of (at most) chunk_size users
+    """
+    usernames = sorted(instance_map.keys())
+    return [dict((username, instance_map[username])
+                 for username in usernames[idx:idx + chunk_size])
+            for idx in xrange(0, len(usernames), chunk_size)]
+
+
+def _monitor_instances_shard(args):
+    """
+    Pool.map helper for 'monitor_instances_for_users'
+    """
+    return monitor_instances_for_users(*args)
+
+
+@task(name="rebuild_usage_rollups")
+def rebuild_usage_rollups():
+    """
+    Backstop for the UsageRollup of every identity (Instance status
+    transitions keep them up to date in-between).
+    """
+    for p in Provider.get_active():
+        rebuild_usage_rollups_for.apply_async(args=[p.id])
+
+
+@task(name="rebuild_usage_rollups_for")
+def rebuild_usage_rollups_for(provider_id):
+    """
+    Re-calculate the UsageRollup of every identity on a provider
+    using the batch allocation engine.
+    """
+    provider = Provider.objects.get(id=provider_id)
+    strategy = AllocationStrategy.objects\
+        .select_related('counting_behavior')\
+        .filter(provider=provider).first()
+    now_time = timezone.now()
+    rollups = 0
+    for identity, allocation_result in _get_allocation_results(provider):
+        next_window_start = get_next_window_start(
+            identity, now_time, strategy) if strategy else None
+        if UsageRollup.update_for(identity, allocation_result, now_time,
+                                  next_window_start):
+            rollups += 1
+    celery_logger.info("Rebuilt %s usage rollups for Provider %s"
+                       % (rollups, provider))
+    return rollups
+
+
+@task(name="rebuild_application_catalog")
+def rebuild_application_catalog():
+    """
+    Rebuild the ApplicationCatalogEntry index used to list applications.
+    (Saves keep it up to date in-between, this picks up the start
+    dates that have passed since)
+    """
+    entries = ApplicationCatalogEntry.rebuild()
+    celery_logger.info("Rebuilt %s application catalog entries" % entries)
+    return entries
 
 
 @task(name="monitor_sizes")
@@ -533,8 +688,6 @@ def monitor_sizes_for(provider_id, print_logs=False):
     While debugging, print_logs=True can be very helpful.
     start_date and end_date allow you to search a 'non-standard' window of time.
     """
-    from service.driver import get_admin_driver
-
     if print_logs:
         import logging
         import sys
@@ -543,26 +696,40 @@ def monitor_sizes_for(provider_id, print_logs=False):
         celery_logger.addHandler(consolehandler)
 
     provider = Provider.objects.get(id=provider_id)
-    admin_driver = get_admin_driver(provider)
-    # Non-End dated sizes on this provider
-    db_sizes = Size.objects.filter(only_current(), provider=provider)
-    all_sizes = admin_driver.list_sizes()
-    seen_sizes = []
-    for cloud_size in all_sizes:
-        core_size = convert_esh_size(cloud_size, provider.uuid)
-        seen_sizes.append(core_size)
-
-    now_time = timezone.now()
-    needs_end_date = [size for size in db_sizes if size not in seen_sizes]
-    for size in needs_end_date:
-        celery_logger.debug("End dating inactive size: %s" % size)
-        size.end_date = now_time
-        size.save()
+    # Refresh the catalog used by monitoring, so changed flavors
+    # are picked up.
+    size_catalog = get_cached_size_catalog(provider, force=True)
+    size_result = reconcile_sizes(
+        provider, size_catalog.esh_sizes.values())
+    celery_logger.info("monitor_sizes completed for Provider %s : %s"
+                       % (provider, size_result))
 
     if print_logs:
         celery_logger.removeHandler(consolehandler)
 
 
+@task(name="refresh_project_directories")
+def refresh_project_directories():
+    """
+    Refresh the ProjectDirectory of each active (openstack) provider.
+    """
+    for p in Provider.get_active(type_name='openstack'):
+        refresh_project_directory_for.apply_async(args=[p.id])
+
+
+@task(name="refresh_project_directory_for")
+def refresh_project_directory_for(provider_id):
+    """
+    Re-list the (Keystone) projects of a provider, for every monitoring
+    and membership task to share (See 'get_cached_project_directory')
+    """
+    provider = Provider.objects.get(id=provider_id)
+    directory = get_cached_project_directory(provider, force=True)
+    celery_logger.info("Provider %s: %s projects in the directory"
+                       % (provider, len(directory)))
+    return len(directory)
+
+
 @task(name="monthly_allocation_reset")
 def monthly_allocation_reset():
     """
@@ -613,19 +780,6 @@ def reset_provider_allocation(provider_id, default_allocation_id):
     return (users_reset, memberships_reset)
 
 
-def _end_date_missing_database_machines(db_machines, cloud_machines, now=None, dry_run=False):
-    if not now:
-        now = timezone.now()
-    mach_count = 0
-    cloud_machine_ids = [mach.id for mach in cloud_machines]
-    for machine in db_machines:
-        cloud_match = [mach for mach in cloud_machine_ids if mach == machine.identifier]
-        if not cloud_match:
-            remove_machine(machine, now, dry_run=dry_run)
-            mach_count += 1
-    return mach_count
-
-
 def _remove_versions_without_machines(now=None):
     if not now:
         now = timezone.now()
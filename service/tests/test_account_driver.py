@@ -0,0 +1,88 @@
+"""
+tests for the bulk helpers of the openstack AccountDriver
+"""
+import threading
+
+import mock
+
+from django.test import TestCase
+
+from service.accounts.executor import CloudExecutor
+from service.accounts.openstack_manager import AccountDriver
+
+
+class TestCreateAccounts(TestCase):
+    def setUp(self):
+        self.driver = AccountDriver.__new__(AccountDriver)
+        self.driver.core_provider = mock.Mock()
+        self.driver.core_provider.list_admin_names.return_value = ['admin']
+        self.driver._executor = CloudExecutor(
+            max_workers=4, rate_limit=0, retries=0)
+
+    def _build_account(self, username, password, **kwargs):
+        if username == 'broken':
+            raise ValueError(username)
+        return (username, 'secret', mock.Mock())
+
+    def test_identities_are_created_on_the_calling_thread(self):
+        threads = []
+
+        def create_identity(username, *args, **kwargs):
+            threads.append(threading.current_thread())
+            return "identity-%s" % username
+
+        with mock.patch.object(
+                self.driver, 'build_account',
+                side_effect=self._build_account) as build_account, \
+                mock.patch.object(
+                    self.driver, 'create_identity',
+                    side_effect=create_identity):
+            results = self.driver.create_accounts(
+                ['admin', 'alice', 'bob', 'broken', 'carol'])
+        self.assertEquals(build_account.call_count, 4)
+        self.assertEquals(sorted(results.keys()),
+                          ['alice', 'bob', 'broken', 'carol'])
+        self.assertEquals(results['alice'], 'identity-alice')
+        self.assertIsInstance(results['broken'], ValueError)
+        self.assertEquals(len(threads), 3)
+        self.assertTrue(all(thread is threading.current_thread()
+                            for thread in threads))
+
+    def test_failed_identity_is_returned(self):
+        with mock.patch.object(
+                self.driver, 'build_account',
+                side_effect=self._build_account), \
+                mock.patch.object(
+                    self.driver, 'create_identity',
+                    side_effect=[RuntimeError('alice'), 'identity-bob']):
+            results = self.driver.create_accounts(['alice', 'bob'])
+        self.assertIsInstance(results['alice'], RuntimeError)
+        self.assertEquals(results['bob'], 'identity-bob')
+
+
+class TestImageMembers(TestCase):
+    def setUp(self):
+        self.driver = AccountDriver.__new__(AccountDriver)
+        self.driver._executor = CloudExecutor(
+            max_workers=4, rate_limit=0, retries=0)
+        self.driver.image_manager = mock.Mock()
+
+    def test_shared_images_for_many(self):
+        def shared_images_for(image_id):
+            if image_id == 'image-2':
+                raise ValueError(image_id)
+            return [mock.Mock(member_id='tenant-1'),
+                    mock.Mock(member_id='tenant-2')]
+        self.driver.image_manager.shared_images_for.side_effect = \
+            shared_images_for
+        self.assertEquals(
+            self.driver.shared_images_for_many(['image-1', 'image-2']),
+            {'image-1': set(['tenant-1', 'tenant-2']), 'image-2': None})
+
+    def test_share_images(self):
+        error = ValueError()
+        self.driver.image_manager.share_image.side_effect = ['ok', error]
+        results = self.driver.share_images(
+            [('image-1', 'alice'), ('image-2', 'bob')])
+        self.assertEquals(len(results), 2)
+        self.assertIn(error, results)
@@ -0,0 +1,192 @@
+"""
+tests for the bulk loading of allocation inputs
+"""
+from datetime import datetime
+
+import mock
+import pytz
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.factories.provider import ProviderFactory
+from core.models import (
+    AllocationStrategy, AtmosphereUser, Group, Identity, IdentityMembership,
+    Instance, InstanceSource, InstanceStatus, InstanceStatusHistory, Quota,
+    Size, Volume)
+from core.models.allocation_strategy import (
+    Allocation as CoreAllocation, CountingBehavior, RefreshBehavior)
+from service.monitoring import (
+    _core_allocations_by_identity, _core_instances_by_identity,
+    _get_allocation_inputs, apply_strategy, get_allocation)
+
+
+NOW = datetime(2016, 3, 15, 12, tzinfo=pytz.utc)
+
+
+def _describe(allocation):
+    """
+    Comparable version of an 'Allocation' input
+    """
+    return {
+        "start_date": allocation.start_date,
+        "end_date": allocation.end_date,
+        "interval_delta": allocation.interval_delta,
+        "credits": [repr(credit) for credit in allocation.credits],
+        "instances": sorted(
+            (instance.identifier,
+             [(history.status, history.size.identifier,
+               history.start_date, history.end_date)
+              for history in instance.history])
+            for instance in allocation.instances),
+    }
+
+
+@mock.patch('django.utils.timezone.now', return_value=NOW)
+class TestAllocationInputs(TestCase):
+
+    def setUp(self):
+        # Closed histories invalidate the (cached) allocation checkpoint
+        patcher = mock.patch(
+            'service.cache.invalidate_cached_allocation_checkpoint')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.provider = ProviderFactory.create()
+        strategy = AllocationStrategy.objects.create(
+            provider=self.provider,
+            counting_behavior=CountingBehavior.objects.create(
+                name="1 Month - Calendar Window"))
+        strategy.refresh_behaviors.add(
+            RefreshBehavior.objects.create(name="First of the Month"))
+        self.quota = Quota.objects.create()
+        self.size = Size.objects.create(
+            alias="1", name="tiny", provider=self.provider,
+            cpu=1, disk=0, root=0, mem=512)
+        self.active = InstanceStatus.objects.create(name="active")
+        self.suspended = InstanceStatus.objects.create(name="suspended")
+        self.identities = []
+
+    def _identity(self, allocation=None, is_staff=False):
+        number = len(self.identities)
+        user = AtmosphereUser.objects.create(
+            username="user-%s" % number, is_staff=is_staff,
+            date_joined=datetime(2015, 6, 1, tzinfo=pytz.utc))
+        identity = Identity.objects.create(
+            created_by=user, provider=self.provider)
+        IdentityMembership.objects.create(
+            identity=identity,
+            member=Group.objects.get_or_create(name=user.username)[0],
+            quota=self.quota, allocation=allocation)
+        self._instance(identity, "vm-%s" % number)
+        self.identities.append(identity)
+        return identity
+
+    def _instance(self, identity, alias, created_by=None):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier="volume-%s" % alias,
+            created_by=identity.created_by, created_by_identity=identity)
+        Volume.objects.create(instance_source=source, size=1, name=alias)
+        instance = Instance.objects.create(
+            name=alias, provider_alias=alias, source=source,
+            created_by=created_by or identity.created_by,
+            created_by_identity=identity,
+            start_date=datetime(2016, 1, 1, tzinfo=pytz.utc))
+        for status, start_date, end_date in [
+                # Ended before the window, so it is not counted.
+                (self.active, instance.start_date,
+                 datetime(2016, 2, 20, tzinfo=pytz.utc)),
+                (self.active, datetime(2016, 2, 20, tzinfo=pytz.utc),
+                 datetime(2016, 3, 10, tzinfo=pytz.utc)),
+                (self.suspended, datetime(2016, 3, 10, tzinfo=pytz.utc),
+                 None)]:
+            InstanceStatusHistory.objects.create(
+                instance=instance, size=self.size, status=status,
+                start_date=start_date, end_date=end_date)
+        return instance
+
+    def _create_identities(self):
+        self._identity(CoreAllocation.objects.create(threshold=600))
+        # Missing an allocation -- The default allocation is used
+        self._identity()
+        # Staff without an allocation have unlimited credit
+        self._identity(is_staff=True)
+        # Instances launched by another user are not counted.
+        self._instance(self.identities[0], "shared",
+                       created_by=self.identities[1].created_by)
+
+    def _count_queries(self, identities):
+        with CaptureQueriesContext(connection) as queries:
+            identity_inputs = _get_allocation_inputs(
+                self.provider, identities)
+        self.assertEquals(len(identity_inputs), len(identities))
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_identities(self, now):
+        self._create_identities()
+        # Includes an identity without allocation (i.e. The default, which
+        # is created on first use)
+        CoreAllocation.default_allocation(self.provider)
+        two_identities = self._count_queries(self.identities[:2])
+        every_identity = self._count_queries(self.identities)
+        self.assertEquals(two_identities, every_identity)
+        for _ in range(3):
+            self._identity(CoreAllocation.objects.create(threshold=600))
+        self.assertEquals(self._count_queries(self.identities),
+                          every_identity)
+
+    def test_inputs_match_the_per_identity_inputs(self, now):
+        self._create_identities()
+        identity_inputs = _get_allocation_inputs(self.provider)
+        self.assertEquals(
+            sorted(identity.id for identity, _ in identity_inputs),
+            sorted(identity.id for identity in self.identities))
+        for identity, allocation_input in identity_inputs:
+            expected_input = apply_strategy(
+                identity,
+                get_allocation(identity.created_by.username, identity.uuid))
+            self.assertEquals(_describe(allocation_input),
+                              _describe(expected_input))
+            self.assertEquals(
+                [instance.identifier
+                 for instance in allocation_input.instances],
+                ["vm-%s" % self.identities.index(identity)])
+
+    def test_core_allocations_by_identity(self, now):
+        self._create_identities()
+        core_allocations = _core_allocations_by_identity(
+            self.provider, self.identities)
+        self.assertEquals(
+            core_allocations,
+            dict((identity.id,
+                  get_allocation(identity.created_by.username, identity.uuid))
+                 for identity in self.identities))
+        self.assertEquals(core_allocations[self.identities[1].id],
+                          CoreAllocation.default_allocation(self.provider))
+        self.assertIsNone(core_allocations[self.identities[2].id])
+
+    def test_core_instances_by_identity(self, now):
+        self._create_identities()
+        window_start = datetime(2016, 3, 1, tzinfo=pytz.utc)
+        instance_map = _core_instances_by_identity(
+            self.identities, window_start)
+        for identity in self.identities:
+            core_instances = instance_map[identity.id]
+            self.assertEquals(
+                [core_instance.provider_alias
+                 for core_instance in core_instances],
+                ["vm-%s" % self.identities.index(identity)])
+            # Histories that ended before the window are left out.
+            with self.assertNumQueries(0):
+                histories = list(
+                    core_instances[0].instancestatushistory_set.all())
+            self.assertEquals(
+                [(history.status.name, history.end_date)
+                 for history in histories],
+                [("active", datetime(2016, 3, 10, tzinfo=pytz.utc)),
+                 ("suspended", None)])
+        # Every history is retrieved when counting all time
+        instance_map = _core_instances_by_identity(self.identities[:1])
+        self.assertEquals(
+            len(instance_map[self.identities[0].id][0]
+                .instancestatushistory_set.all()), 3)
@@ -0,0 +1,469 @@
+"""
+tests for the (two-tier) driver cache
+"""
+import cPickle as pickle
+from datetime import datetime
+import time
+
+import mock
+import pytz
+
+from django.test import TestCase
+
+from libcloud.compute.base import Node, NodeImage, NodeSize
+from rtwo.instance import OSInstance
+from rtwo.machine import OSMachine
+from rtwo.size import MockSize, OSSize
+
+from service import cache
+
+
+class FakeRedis(object):
+
+    """
+    The (StrictRedis) calls made by the cache, on a dict
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class CacheTestCase(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        for patcher in [
+                mock.patch.object(cache, 'redis_connection',
+                                  return_value=self.redis),
+                mock.patch.object(cache, 'local_cache', cache._LRUCache(8)),
+                mock.patch.dict(cache.refreshing, clear=True)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _entry(self, data, fresh, stale):
+        now = time.time()
+        return (now + fresh, now + stale, cache._serialize(data))
+
+    def _save(self, key, entry):
+        self.redis.data[key] = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+
+
+class TestLRUCache(TestCase):
+    def test_eviction(self):
+        lru = cache._LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        # 'a' is used, so 'b' is the least recently used.
+        self.assertEquals(lru.get("a"), 1)
+        lru.set("c", 3)
+        self.assertIsNone(lru.get("b"))
+        self.assertEquals((lru.get("a"), lru.get("c")), (1, 3))
+
+    def test_set_and_delete(self):
+        lru = cache._LRUCache(2)
+        lru.set("a", 1)
+        lru.set("a", 2)
+        self.assertEquals(lru.get("a"), 2)
+        lru.delete("a")
+        lru.delete("missing")
+        self.assertIsNone(lru.get("a"))
+
+
+class TestSingleFlight(CacheTestCase):
+    def test_acquire_and_release(self):
+        self.assertTrue(cache._acquire_refresh("instances.1"))
+        # Once per process, and once across processes
+        self.assertFalse(cache._acquire_refresh("instances.1"))
+        cache.refreshing.clear()
+        self.assertFalse(cache._acquire_refresh("instances.1"))
+        self.assertTrue(cache._acquire_refresh("instances.2"))
+        cache._release_refresh("instances.2")
+        self.assertNotIn("instances.2.lock", self.redis.data)
+        self.assertTrue(cache._acquire_refresh("instances.2"))
+
+    def test_release_keeps_the_lock_of_another_caller(self):
+        self.assertTrue(cache._acquire_refresh("instances.1"))
+        # The lock expired and was taken by another process.
+        self.redis.data["instances.1.lock"] = "another-token"
+        cache._release_refresh("instances.1")
+        self.assertEquals(self.redis.data["instances.1.lock"],
+                          "another-token")
+        self.assertNotIn("instances.1", cache.refreshing)
+
+    def test_redis_not_running(self):
+        cache.redis_connection.side_effect = \
+            cache.redis.exceptions.ConnectionError()
+        self.assertTrue(cache._acquire_refresh("instances.1"))
+        self.assertFalse(cache._acquire_refresh("instances.1"))
+
+    @mock.patch('service.cache.time.sleep')
+    def test_wait_for_refresh(self, sleep):
+        def refreshed(interval):
+            if sleep.call_count == 3:
+                self._save("instances.1", self._entry(["vm"], 30, 60))
+        sleep.side_effect = refreshed
+        self.assertEquals(cache._wait_for_refresh("instances.1"), ["vm"])
+        self.assertEquals(sleep.call_count, 3)
+
+    @mock.patch('service.cache.REFRESH_LOCK_TIMEOUT', 1)
+    @mock.patch('service.cache.time.sleep')
+    def test_wait_for_refresh_timeout(self, sleep):
+        self.assertIsNone(cache._wait_for_refresh("instances.1"))
+        self.assertEquals(sleep.call_count, 4)
+
+
+class TestGetCached(CacheTestCase):
+    def setUp(self):
+        super(TestGetCached, self).setUp()
+        self.data_method = mock.Mock(return_value=["vm-1"])
+        self.scrub_method = mock.Mock()
+
+    def _get(self, key="instances.1", force=False):
+        return cache._get_cached(
+            key, self.data_method, self.scrub_method, force=force)
+
+    def test_miss_then_fresh(self):
+        self.assertEquals(self._get(), ["vm-1"])
+        self.assertEquals(self._get(), ["vm-1"])
+        self.assertEquals(self.data_method.call_count, 1)
+        self.scrub_method.assert_called_once_with(["vm-1"])
+        self.assertIn("instances.1", self.redis.data)
+        # The lock is released.
+        self.assertNotIn("instances.1.lock", self.redis.data)
+        self.assertEquals(cache.refreshing, {})
+
+    def test_fresh_in_redis(self):
+        self._save("instances.1", self._entry(["vm-2"], 30, 60))
+        self.assertEquals(self._get(), ["vm-2"])
+        self.assertFalse(self.data_method.called)
+
+    @mock.patch('service.cache.threading.Thread')
+    def test_stale_while_revalidate(self, thread):
+        self._save("instances.1", self._entry(["vm-2"], -1, 60))
+        # The stale value is served, ONE caller refreshes it.
+        self.assertEquals(self._get(), ["vm-2"])
+        self.assertEquals(self._get(), ["vm-2"])
+        self.assertFalse(self.data_method.called)
+        thread.assert_called_once_with(
+            target=cache._background_refresh,
+            args=("instances.1", self.data_method, self.scrub_method))
+        thread.return_value.start.assert_called_once_with()
+        cache._background_refresh(
+            "instances.1", self.data_method, self.scrub_method)
+        self.assertNotIn("instances.1.lock", self.redis.data)
+        self.assertEquals(self._get(), ["vm-1"])
+
+    def test_failed_background_refresh_releases_the_lock(self):
+        self.data_method.side_effect = Exception("Cloud is down")
+        self.assertTrue(cache._acquire_refresh("instances.1"))
+        cache._background_refresh(
+            "instances.1", self.data_method, self.scrub_method)
+        self.assertNotIn("instances.1.lock", self.redis.data)
+
+    @mock.patch('service.cache._wait_for_refresh', return_value=["vm-3"])
+    def test_miss_while_refreshed_by_another(self, wait_for_refresh):
+        self.redis.data["instances.1.lock"] = "another-token"
+        self.assertEquals(self._get(), ["vm-3"])
+        self.assertFalse(self.data_method.called)
+
+    @mock.patch('service.cache._wait_for_refresh', return_value=None)
+    def test_wait_timeout(self, wait_for_refresh):
+        self.redis.data["instances.1.lock"] = "another-token"
+        self.assertEquals(self._get(), ["vm-1"])
+
+    def test_expired(self):
+        self._save("instances.1", self._entry(["vm-2"], -2, -1))
+        self.assertEquals(self._get(), ["vm-1"])
+
+    def test_force(self):
+        self._save("instances.1", self._entry(["vm-2"], 30, 60))
+        self.assertEquals(self._get(force=True), ["vm-1"])
+        self.assertEquals(self._get(), ["vm-1"])
+
+
+class TestDriverMethod(TestCase):
+    @mock.patch('service.cache._get_cached_driver')
+    def test_driver_of_the_running_thread(self, get_cached_driver):
+        identity = mock.Mock()
+        instances_method = cache._driver_method(
+            None, identity, "list_instances")
+        # (The driver is only retrieved by the thread refreshing the data)
+        self.assertFalse(get_cached_driver.called)
+        self.assertEquals(
+            instances_method(),
+            get_cached_driver.return_value.list_instances.return_value)
+        get_cached_driver.assert_called_once_with(
+            provider=None, identity=identity)
+
+
+def _round_trip(data):
+    payload = cache._serialize(data)
+    return payload[0], cache._deserialize(payload)
+
+
+class TestSerialize(TestCase):
+    def setUp(self):
+        self.provider = mock.Mock(identifier="provider-1")
+        self.provider.machineCls = OSMachine
+        self.provider.sizeCls = OSSize
+
+    def _fields(self, obj):
+        """
+        The (cached) fields of 'obj'
+        """
+        return dict((field, obj.__dict__[field])
+                    for field in cache._cached_fields(type(obj))
+                    if field in obj.__dict__)
+
+    def test_size(self):
+        size = OSSize(NodeSize(
+            "1", "m1.tiny", 512, 10, None, 0.0, driver=None,
+            extra={"cpu": 1, "ephemeral": 0}))
+        cache._scrub([size])
+        encoding, loaded = _round_trip([size])
+        self.assertEquals(encoding, "J")
+        self.assertIsInstance(loaded[0], OSSize)
+        self.assertEquals(self._fields(loaded[0]), self._fields(size))
+        self.assertEquals(sorted(loaded[0].__dict__),
+                          sorted(self._fields(size)))
+        self.assertIsNone(loaded[0]._size)
+
+    def test_machine(self):
+        machine = OSMachine(NodeImage(
+            "image-1", "Ubuntu 14.04", driver=None,
+            extra={"status": "active", "min_disk": 0}))
+        cache._scrub([machine])
+        encoding, loaded = _round_trip([machine])
+        self.assertEquals(encoding, "J")
+        self.assertIsInstance(loaded[0], OSMachine)
+        self.assertEquals(self._fields(loaded[0]), self._fields(machine))
+        # Fields that are not cached read the class attribute
+        self.assertIs(loaded[0].machines, OSMachine.machines)
+        self.assertIsNone(loaded[0]._image)
+        with self.assertRaises(AttributeError):
+            loaded[0].not_cached
+
+    def test_instance(self):
+        node = Node(
+            "instance-1", "vm", 0, ["128.196.0.1"], ["10.0.0.1"], None,
+            extra={"tenantId": "tenant-1", "flavorId": "1",
+                   "imageId": "image-1", "status": "active",
+                   "metadata": {"tmp_status": ""},
+                   "created": datetime(2016, 1, 1, tzinfo=pytz.utc),
+                   "object": {
+                       "OS-EXT-SRV-ATTR:hypervisor_hostname": "host-1",
+                       "security_groups": [{"name": "default"}]}})
+        instance = OSInstance(node, self.provider)
+        cache._scrub([instance])
+        encoding, loaded = _round_trip([instance])
+        self.assertEquals(encoding, "J")
+        loaded = loaded[0]
+        self.assertIsInstance(loaded, OSInstance)
+        self.assertEquals(
+            (loaded.id, loaded.name, loaded.ip, loaded.owner),
+            ("instance-1", "vm", "128.196.0.1", "tenant-1"))
+        self.assertEquals(loaded.get_status(), "active")
+        self.assertEquals(loaded.extra["created"], node.extra["created"])
+        # Only the keys of the API response that are read are kept.
+        self.assertEquals(
+            loaded.extra["object"],
+            {"OS-EXT-SRV-ATTR:hypervisor_hostname": "host-1"})
+        self.assertIsInstance(loaded.size, MockSize)
+        self.assertEquals(loaded.size.id, "1")
+        self.assertEquals(loaded.source.id, "image-1")
+        self.assertIsNone(loaded._node)
+        self.assertNotIn("provider", loaded.__dict__)
+
+    def test_read_only(self):
+        machine = OSMachine(NodeImage("image-1", "Ubuntu", driver=None))
+        cache._scrub([machine])
+        _, (loaded,) = _round_trip([machine])
+        with self.assertRaises(AttributeError):
+            loaded.name = "Renamed"
+        with self.assertRaises(AttributeError):
+            del loaded.name
+        renamed = cache.copy_with(loaded, name="Renamed")
+        self.assertIsInstance(renamed, OSMachine)
+        self.assertEquals((renamed.id, renamed.name), ("image-1", "Renamed"))
+        self.assertEquals(loaded.name, "Ubuntu")
+        with self.assertRaises(AttributeError):
+            renamed.name = "Renamed again"
+        # Works on objects that are not cached as well.
+        self.assertEquals(cache.copy_with(machine, name="Renamed").name,
+                          "Renamed")
+        self.assertEquals(machine.name, "Ubuntu")
+
+    def test_pickle_cached_copy(self):
+        machine = OSMachine(NodeImage("image-1", "Ubuntu", driver=None))
+        cache._scrub([machine])
+        _, (loaded,) = _round_trip([machine])
+        unpickled = pickle.loads(pickle.dumps(loaded, pickle.HIGHEST_PROTOCOL))
+        self.assertIs(type(unpickled), type(loaded))
+        self.assertEquals(self._fields(unpickled), self._fields(loaded))
+        # Cached again, as the original class
+        encoding, (reloaded,) = _round_trip([unpickled])
+        self.assertEquals(encoding, "J")
+        self.assertEquals(self._fields(reloaded), self._fields(machine))
+
+    def test_tuples_and_keys(self):
+        data = {"tuple": (1, "a"), 1: "int", (2, 3): ["tuple key"],
+                "nested": {"__class__": "not a class"}}
+        encoding, loaded = _round_trip(data)
+        self.assertEquals(encoding, "J")
+        self.assertEquals(loaded, data)
+        self.assertIsInstance(loaded["tuple"], tuple)
+
+    @mock.patch('service.cache.logger')
+    @mock.patch('service.cache.redis_connection')
+    def test_pickle_fallback(self, redis_connection, logger):
+        circular = []
+        circular.append(circular)
+        for data in ([object()], circular):
+            encoding, loaded = _round_trip(data)
+            self.assertEquals(encoding, "P")
+        self.assertIs(loaded[0], loaded)
+        # Logged, and counted
+        self.assertEquals(logger.error.call_count, 2)
+        self.assertEquals(
+            redis_connection().incr.call_args_list,
+            [mock.call(cache.PICKLE_FALLBACKS_KEY)] * 2)
+
+    def test_unknown_classes_are_not_loaded(self):
+        for class_name in ["rtwo.instance.NotAClass",
+                           "rtwo.provider.OSProvider",
+                           "libcloud.compute.base.Node"]:
+            with self.assertRaises(ValueError):
+                cache._decode({"__class__": class_name, "__fields__": {}})
+
+
+@mock.patch('service.cache.redis_connection')
+class TestProjectDirectory(TestCase):
+    def setUp(self):
+        self.provider = mock.Mock(uuid='provider-uuid')
+        self.account_driver = mock.Mock()
+        self.account_driver.list_projects.return_value = [
+            mock.Mock(id='project-1'), mock.Mock(id='project-2')]
+        self.account_driver.list_projects.return_value[0].name = 'alice'
+        self.account_driver.list_projects.return_value[1].name = 'bob'
+        patcher = mock.patch.object(
+            cache, '_get_cached',
+            side_effect=lambda key, data_method, scrub, force=False:
+            data_method())
+        self.get_cached = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_known_ids_are_not_refreshed(self, redis_connection):
+        directory = cache.get_cached_project_directory(
+            self.provider, self.account_driver, project_ids=['project-1'])
+        self.assertEquals(directory.get_name('project-1'), 'alice')
+        self.assertEquals(self.get_cached.call_count, 1)
+        self.assertFalse(redis_connection().set.called)
+
+    def test_unknown_id_refreshes_once_per_interval(self, redis_connection):
+        redis_connection().set.side_effect = [True, None]
+        for _ in range(2):
+            directory = cache.get_cached_project_directory(
+                self.provider, self.account_driver,
+                project_ids=['project-1', 'deleted'])
+            self.assertEquals(directory.missing(['deleted']),
+                              set(['deleted']))
+        # One forced refresh, then the miss is rate limited.
+        self.assertEquals(
+            [call[1].get('force', False)
+             for call in self.get_cached.call_args_list],
+            [False, True, False])
+        redis_connection().set.assert_called_with(
+            'projects.provider-uuid.refreshed', "1", nx=True,
+            ex=cache.PROJECT_DIRECTORY_MISS_INTERVAL)
+
+
+def _esh_size(size_id, name, ram=512, disk=10, cpu=1):
+    return OSSize(NodeSize(
+        size_id, name, ram, disk, None, 0.0, driver=None,
+        extra={"cpu": cpu, "ephemeral": 0}))
+
+
+def _core_size(alias, name, mem=512, disk=10, cpu=1):
+    core_size = mock.Mock(alias=alias, disk=disk, root=0, cpu=cpu, mem=mem)
+    core_size.name = name
+    return core_size
+
+
+class TestSizeMatches(TestCase):
+    def test_size_matches(self):
+        esh_size = _esh_size("1", "m1.tiny")
+        self.assertTrue(
+            cache._size_matches(_core_size("1", "m1.tiny"), esh_size))
+        for core_size in [_core_size("1", "m1.renamed"),
+                          _core_size("1", "m1.tiny", mem=1024),
+                          _core_size("1", "m1.tiny", disk=20),
+                          _core_size("1", "m1.tiny", cpu=2)]:
+            self.assertFalse(cache._size_matches(core_size, esh_size))
+
+
+@mock.patch('service.cache.convert_esh_size')
+@mock.patch('service.cache.Size')
+class TestSizeCatalog(CacheTestCase):
+    def setUp(self):
+        super(TestSizeCatalog, self).setUp()
+        self.provider = mock.Mock(uuid="provider-uuid")
+        self.esh_sizes = [_esh_size("1", "m1.tiny"),
+                          _esh_size("2", "m1.small", ram=2048),
+                          _esh_size("3", "m1.new")]
+        self.core_sizes = [_core_size("1", "m1.tiny"),
+                           # Resized (on the cloud)
+                           _core_size("2", "m1.small", mem=1024),
+                           # Removed (from the cloud)
+                           _core_size("4", "m1.old")]
+
+    def test_get_core_size(self, size, convert_esh_size):
+        size.objects.filter.return_value = self.core_sizes
+        convert_esh_size.side_effect = \
+            lambda esh_size, provider_uuid: _core_size(
+                esh_size.id, esh_size.name, mem=esh_size.ram)
+        catalog = cache.SizeCatalog(self.provider, self.esh_sizes)
+        self.assertEquals(len(catalog), 3)
+        self.assertEquals(catalog.get_esh_size("2"), self.esh_sizes[1])
+        self.assertIsNone(catalog.get_esh_size("4"))
+        tiny = catalog.get_core_size("1")
+        self.assertEquals(tiny, self.core_sizes[0])
+        self.assertEquals(tiny.esh, self.esh_sizes[0])
+        self.assertFalse(convert_esh_size.called)
+        self.assertEquals(catalog.get_core_size("2").mem, 2048)
+        self.assertEquals(catalog.get_core_size("3").name, "m1.new")
+        self.assertEquals(catalog.get_core_size("4"), self.core_sizes[2])
+        self.assertIsNone(catalog.get_core_size("5"))
+        # Converted once, looked up with a single query.
+        self.assertEquals(catalog.get_core_size("2"),
+                          catalog.get_core_size("2"))
+        self.assertEquals(
+            [call[0][0].id for call in convert_esh_size.call_args_list],
+            ["2", "3"])
+        self.assertEquals(size.objects.filter.call_count, 1)
+
+    @mock.patch('service.cache.get_admin_driver')
+    def test_get_cached_size_catalog(self, get_admin_driver, size,
+                                     convert_esh_size):
+        list_sizes = get_admin_driver.return_value.list_sizes
+        list_sizes.return_value = self.esh_sizes
+        for _ in range(2):
+            catalog = cache.get_cached_size_catalog(self.provider)
+            self.assertEquals(len(catalog), 3)
+            self.assertEquals(catalog.get_esh_size("2").ram, 2048)
+        self.assertEquals(list_sizes.call_count, 1)
+        self.assertIn("sizes.provider-uuid", self.redis.data)
+        cache.get_cached_size_catalog(self.provider, force=True)
+        self.assertEquals(list_sizes.call_count, 2)
+        cache.invalidate_cached_size_catalog(self.provider)
+        self.assertNotIn("sizes.provider-uuid", self.redis.data)
@@ -0,0 +1,137 @@
+"""
+tests for batched (multi-host) deployments and the playbook registry
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from django.test import TestCase
+
+from service.deploy import (
+    PlaybookRegistry, _write_batch_inventory, deploy_to_many)
+from service.exceptions import AnsibleDeployException
+
+
+def _deploy_vars(username):
+    return {"ATMOUSERNAME": username, "VNCLICENSE": "license",
+            "USERSSHKEYS": []}
+
+
+@mock.patch('service.deploy._deploy_vars', side_effect=_deploy_vars)
+class TestBatchInventory(TestCase):
+    def setUp(self):
+        self.inventory_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.inventory_dir)
+
+    def test_inventory(self, deploy_vars):
+        hosts = [("vm1", "10.0.0.1", "alice", "instance-1"),
+                 ("vm2", "10.0.0.2", "bob", "instance-2"),
+                 ("vm3", "10.0.0.3", "alice", "instance-3")]
+        inventory_path = _write_batch_inventory(self.inventory_dir, hosts)
+        with open(inventory_path) as inventory:
+            lines = inventory.read().splitlines()
+        self.assertEquals(lines[1:], [
+            "vm1 ansible_ssh_host=10.0.0.1",
+            "vm2 ansible_ssh_host=10.0.0.2",
+            "vm3 ansible_ssh_host=10.0.0.3"])
+        with open(os.path.join(self.inventory_dir, "host_vars", "vm2")) as f:
+            self.assertEquals(
+                json.load(f), {"ATMOUSERNAME": "bob", "USERSSHKEYS": []})
+        # Once per user
+        self.assertEquals(deploy_vars.call_count, 2)
+
+
+def _get_files(directory):
+    return sorted(os.path.join(directory, filename)
+                  for filename in os.listdir(directory))
+
+
+@mock.patch('service.deploy.subspace.PlayBook.factory')
+@mock.patch('service.deploy.subspace.playbook._get_files',
+            side_effect=_get_files)
+class TestPlaybookRegistry(TestCase):
+    def setUp(self):
+        self.playbooks_dir = tempfile.mkdtemp()
+        for filename in ("00_check_networking.yml", "05_ssh_setup.yml",
+                         "10_deploy.yml"):
+            open(os.path.join(self.playbooks_dir, filename), 'w').close()
+        self.registry = PlaybookRegistry(self.playbooks_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.playbooks_dir)
+
+    def test_select_by_name(self, get_files, factory):
+        self.registry.get_playbooks(names=['05_ssh_setup'], limit={})
+        factory.assert_called_once_with(
+            os.path.join(self.playbooks_dir, "05_ssh_setup.yml"), limit={})
+
+    def test_files_are_listed_once(self, get_files, factory):
+        self.assertEquals(len(self.registry.files()), 3)
+        self.registry.files(names=['10_deploy'])
+        self.assertEquals(get_files.call_count, 1)
+
+    def test_files_are_listed_again_on_change(self, get_files, factory):
+        self.registry.files()
+        self.registry._mtimes = {}
+        self.registry.files()
+        self.assertEquals(get_files.call_count, 2)
+
+
+def _playbook(filename, dark=None, failures=None):
+    pb = mock.Mock(filename=filename)
+    pb.stats.dark = dark or {}
+    pb.stats.failures = failures or {}
+    return pb
+
+
+@mock.patch('service.deploy.check_ansible', return_value=True)
+@mock.patch('service.deploy.configure_ansible')
+@mock.patch('service.deploy.cache_bust')
+@mock.patch('service.deploy.create_instance_logger')
+@mock.patch('service.deploy._write_batch_inventory',
+            return_value="/tmp/inventory/hosts")
+@mock.patch('service.deploy.get_playbooks')
+class TestDeployToMany(TestCase):
+    def setUp(self):
+        self.deployments = [("10.0.0.1", "alice", "instance-1"),
+                            ("10.0.0.2", "bob", "instance-2"),
+                            ("10.0.0.3", "carol", "instance-3")]
+
+    def test_results_per_host(self, get_playbooks, write_inventory,
+                              instance_logger, cache_bust, configure,
+                              check_ansible):
+        get_playbooks.return_value = [
+            _playbook("/playbooks/00_check_networking.yml",
+                      dark={"vm10-0-0-2.local": 1}),
+            _playbook("/playbooks/10_deploy.yml",
+                      failures={"vm10-0-0-3.local": 2})]
+        with mock.patch('service.deploy.build_host_name',
+                        side_effect=lambda ip: "vm%s.local"
+                        % ip.replace(".", "-")):
+            results = deploy_to_many(self.deployments)
+        self.assertEquals(sorted(results.keys()),
+                          ["instance-1", "instance-2", "instance-3"])
+        self.assertIsNone(results["instance-1"])
+        self.assertIsInstance(results["instance-2"], AnsibleDeployException)
+        self.assertIn("Unreachable", str(results["instance-2"]))
+        self.assertIsInstance(results["instance-3"], AnsibleDeployException)
+        self.assertIn("Failures", str(results["instance-3"]))
+        # One run of each playbook, for every host
+        for pb in get_playbooks.return_value:
+            pb.run.assert_called_once_with()
+            self.assertEquals(pb.forks, 3)
+        limit = get_playbooks.call_args[1]['limit']
+        self.assertEquals([host['ip'] for host in limit],
+                          ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+
+    def test_ansible_not_configured(self, get_playbooks, write_inventory,
+                                    instance_logger, cache_bust, configure,
+                                    check_ansible):
+        check_ansible.return_value = False
+        self.assertEquals(deploy_to_many(self.deployments), {})
+        self.assertFalse(get_playbooks.called)
@@ -0,0 +1,229 @@
+"""
+tests for batched deployments (service.deploy_batch and 'deploy_batch')
+"""
+import cPickle as pickle
+
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from service import deploy_batch
+from service.tasks.driver import deploy_batch as deploy_batch_task
+
+
+def _deployment(instance_id, instance_ip):
+    return {
+        "instance_id": instance_id,
+        "instance_ip": instance_ip,
+        "username": "alice",
+        "status_fields": ("provider", "identity", instance_id),
+        "task_id": "task-%s" % instance_id,
+        "task_args": ("driverCls", "provider", "identity", instance_id),
+        "task_kwargs": {"username": "alice", "batch": True},
+        "callbacks": [{"task": "callback-%s" % instance_id}],
+        "errbacks": [{"task": "errback-%s" % instance_id}],
+    }
+
+
+class FakeRedis(object):
+
+    """
+    The (StrictRedis) list and sorted set calls made by the deploy batch
+    """
+
+    def __init__(self):
+        self.lists = {}
+        self.deadlines = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def delete(self, key):
+        self.lists.pop(key, None)
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    def rpoplpush(self, source, destination):
+        if not self.lists.get(source):
+            return None
+        value = self.lists[source].pop()
+        self.lpush(destination, value)
+        return value
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def lrem(self, key, count, value):
+        self.lists.get(key, []).remove(value)
+
+    def zadd(self, key, **scores):
+        self.deadlines.update(scores)
+
+    def zrangebyscore(self, key, low, high):
+        return [name for name, score in self.deadlines.items()
+                if low <= score <= high]
+
+    def zrem(self, key, name):
+        self.deadlines.pop(name, None)
+
+
+class FakePipeline(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.calls = []
+
+    def rpoplpush(self, *args):
+        self.calls.append(args)
+
+    def execute(self):
+        return [self.conn.rpoplpush(*args) for args in self.calls]
+
+
+@override_settings(ANSIBLE_DEPLOY_BATCH_SIZE=2,
+                   ANSIBLE_DEPLOY_BATCH_WINDOW=10)
+@mock.patch('service.deploy_batch.schedule_deploy_batch')
+class TestTakeDeployments(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('service.deploy_batch.redis_connection',
+                             return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.deployments = [_deployment("instance-%s" % idx, "10.0.0.%s" % idx)
+                            for idx in range(1, 4)]
+        for deployment in self.deployments:
+            self.redis.lpush(deploy_batch.DEPLOY_BATCH_KEY,
+                             pickle.dumps(deployment))
+
+    def _processing(self, batch_id):
+        return self.redis.lists.get(
+            deploy_batch.DEPLOY_BATCH_PROCESSING_LIST_KEY.format(batch_id))
+
+    def test_take_batch(self, schedule):
+        taken = deploy_batch.take_deployments("batch-1")
+        # The oldest deployments, at most ANSIBLE_DEPLOY_BATCH_SIZE
+        self.assertEquals([deployment for _, deployment in taken],
+                          self.deployments[:2])
+        self.assertEquals(len(self._processing("batch-1")), 2)
+        # ... the rest is scheduled.
+        schedule.assert_called_once_with()
+        for payload, _ in taken:
+            deploy_batch.finish_deployment("batch-1", payload)
+        self.assertEquals(self._processing("batch-1"), [])
+        deploy_batch.release_batch("batch-1")
+        self.assertEquals(self.redis.deadlines, {})
+        self.assertEquals(schedule.call_count, 1)
+
+    def test_unfinished_deployments_are_released(self, schedule):
+        taken = deploy_batch.take_deployments("batch-1")
+        deploy_batch.finish_deployment("batch-1", taken[0][0])
+        deploy_batch.release_batch("batch-1")
+        self.assertEquals(
+            [deployment for _, deployment in
+             deploy_batch.take_deployments("batch-2")],
+            [self.deployments[2], self.deployments[1]])
+
+    @mock.patch('service.deploy_batch.time.time')
+    def test_expired_batch_is_requeued(self, time, schedule):
+        time.return_value = 1000
+        deploy_batch.take_deployments("batch-1")
+        # The worker of 'batch-1' died, its deadline passed.
+        time.return_value = 999 + 2 * deploy_batch.DEPLOY_BATCH_TIME_LIMIT
+        self.assertEquals(deploy_batch.requeue_expired_batches(), 0)
+        time.return_value += 2
+        self.assertEquals(deploy_batch.requeue_expired_batches(), 2)
+        self.assertFalse(self._processing("batch-1"))
+        self.assertEquals(
+            self.redis.llen(deploy_batch.DEPLOY_BATCH_KEY), 3)
+
+
+@override_settings(ANSIBLE_DEPLOY_BATCH_WINDOW=10)
+@mock.patch('service.deploy_batch.redis_connection')
+class TestScheduleDeployBatch(TestCase):
+    @mock.patch('service.tasks.driver.deploy_batch.apply_async')
+    def test_scheduled_once_per_window(self, apply_async, redis_connection):
+        redis_connection().set.side_effect = [True, None]
+        deploy_batch.schedule_deploy_batch()
+        deploy_batch.schedule_deploy_batch()
+        apply_async.assert_called_once_with(countdown=10)
+        redis_connection().set.assert_called_with(
+            deploy_batch.DEPLOY_BATCH_SCHEDULED_KEY, 1, ex=40, nx=True)
+
+    @override_settings(ANSIBLE_DEPLOY_BATCH=False)
+    def test_batch_disabled(self, redis_connection):
+        self.assertFalse(deploy_batch.add_deployment({}))
+        self.assertFalse(redis_connection().lpush.called)
+
+
+@mock.patch('service.tasks.driver.signature',
+            side_effect=lambda task_dict, app=None: task_dict["task"])
+@mock.patch('service.tasks.driver._deploy_init_to.apply_async')
+@mock.patch('service.tasks.driver.complete_deferred_task')
+@mock.patch('service.tasks.driver._write_status_log')
+@mock.patch('service.tasks.driver.deploy_to_many')
+@mock.patch('service.tasks.driver.release_batch')
+@mock.patch('service.tasks.driver.finish_deployment')
+@mock.patch('service.tasks.driver.take_deployments')
+class TestDeployBatchTask(TestCase):
+    def setUp(self):
+        self.deployments = [
+            ("payload-1", _deployment("instance-1", "10.0.0.1")),
+            ("payload-2", _deployment("instance-2", "10.0.0.2"))]
+
+    def test_results_per_instance(self, take_deployments, finish, release,
+                                  deploy_to_many, status_log, complete,
+                                  apply_async, signature):
+        take_deployments.return_value = self.deployments
+        deploy_to_many.return_value = {
+            "instance-1": None, "instance-2": Exception("Unreachable")}
+        deploy_batch_task()
+        batch_id = take_deployments.call_args[0][0]
+        deploy_to_many.assert_called_once_with(
+            [("10.0.0.1", "alice", "instance-1"),
+             ("10.0.0.2", "alice", "instance-2")])
+        complete.assert_called_once_with(
+            "task-instance-1", [{"task": "callback-instance-1"}], None)
+        # The failed deployment is retried on its own, as the original
+        # task (Same id and links)
+        apply_async.assert_called_once_with(
+            ("driverCls", "provider", "identity", "instance-2"),
+            {"username": "alice", "batch": False},
+            task_id="task-instance-2",
+            link=["callback-instance-2"],
+            link_error=["errback-instance-2"])
+        self.assertEquals(finish.call_args_list,
+                          [mock.call(batch_id, "payload-1"),
+                           mock.call(batch_id, "payload-2")])
+        release.assert_called_once_with(batch_id)
+
+    def test_failed_batch_is_retried(self, take_deployments, finish, release,
+                                     deploy_to_many, status_log, complete,
+                                     apply_async, signature):
+        take_deployments.return_value = self.deployments
+        deploy_to_many.side_effect = Exception("No inventory")
+        deploy_batch_task()
+        self.assertFalse(complete.called)
+        self.assertEquals(apply_async.call_count, 2)
+        for call in apply_async.call_args_list:
+            self.assertFalse(call[0][1]["batch"])
+
+    def test_unfinished_batch_is_released(self, take_deployments, finish,
+                                          release, deploy_to_many,
+                                          status_log, complete, apply_async,
+                                          signature):
+        take_deployments.return_value = self.deployments
+        deploy_to_many.return_value = {}
+        complete.side_effect = Exception("Broker is down")
+        self.assertRaises(Exception, deploy_batch_task)
+        self.assertFalse(finish.called)
+        release.assert_called_once_with(take_deployments.call_args[0][0])
+
+    def test_empty_batch(self, take_deployments, finish, release,
+                         deploy_to_many, status_log, complete, apply_async,
+                         signature):
+        take_deployments.return_value = []
+        deploy_batch_task()
+        self.assertFalse(deploy_to_many.called)
+        self.assertTrue(release.called)
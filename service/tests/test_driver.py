@@ -0,0 +1,154 @@
+"""
+tests for the pool of (rtwo) drivers
+"""
+from datetime import datetime, timedelta
+import threading
+
+import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from service import driver as service_driver
+from service.driver import DriverPool, get_admin_driver
+
+
+def _driver(token_expires=None):
+    driver = mock.Mock()
+    driver._connection.connection.auth_token_expires = token_expires
+    return driver
+
+
+def _in_thread(func):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+class TestDriverPool(TestCase):
+    def setUp(self):
+        self.pool = DriverPool(max_size=2, max_age=60)
+        self.identity = mock.Mock(uuid="identity-1")
+
+    def _key(self, identity=None, password="secret"):
+        return DriverPool.key_for(
+            identity or self.identity, "alice",
+            {"region_name": "RegionOne"}, {"key": "alice",
+                                           "secret": password})
+
+    def test_eviction(self):
+        drivers = [_driver() for _ in range(3)]
+        self.pool.put("a", drivers[0])
+        self.pool.put("b", drivers[1])
+        # 'a' is used, so 'b' is the least recently used.
+        self.assertEquals(self.pool.get("a"), drivers[0])
+        self.pool.put("c", drivers[2])
+        self.assertEquals(len(self.pool), 2)
+        self.assertIsNone(self.pool.get("b"))
+        self.assertEquals(self.pool.get("a"), drivers[0])
+        self.assertEquals(self.pool.get("c"), drivers[2])
+
+    @mock.patch('service.driver.time.time')
+    def test_max_age(self, time):
+        driver = _driver()
+        time.return_value = 1000
+        self.pool.put("a", driver)
+        time.return_value = 1060
+        self.assertEquals(self.pool.get("a"), driver)
+        time.return_value = 1061
+        self.assertIsNone(self.pool.get("a"))
+        # Expired drivers are removed.
+        self.assertEquals(len(self.pool), 0)
+
+    def test_token_expiry(self):
+        now = timezone.now()
+        utcnow = datetime.utcnow()
+        for token_expires, reusable in [
+                (utcnow + timedelta(minutes=10), True),
+                (utcnow + timedelta(minutes=4), False),
+                (now + timedelta(minutes=10), True),
+                (now + timedelta(minutes=4), False),
+                (now - timedelta(minutes=1), False)]:
+            driver = _driver(token_expires)
+            self.pool.put("a", driver)
+            self.assertEquals(self.pool.get("a") is driver, reusable,
+                              "Token expires at %s" % token_expires)
+
+    def test_credentials_are_part_of_the_key(self):
+        self.assertEquals(self._key(), self._key())
+        self.assertNotEquals(self._key(), self._key(password="changed"))
+        self.assertNotIn("secret", repr(self._key()))
+
+    def test_invalidate(self):
+        other_identity = mock.Mock(uuid="identity-2")
+        driver, other_driver = _driver(), _driver()
+        self.pool.put(self._key(), driver)
+        self.pool.put(self._key(other_identity), other_driver)
+        self.pool.invalidate(self.identity)
+        self.assertIsNone(self.pool.get(self._key()))
+        self.assertEquals(
+            self.pool.get(self._key(other_identity)), other_driver)
+        self.pool.invalidate()
+        self.assertEquals(len(self.pool), 0)
+
+
+    def test_drivers_are_not_shared_by_threads(self):
+        def get_or_create():
+            driver = self.pool.get(self._key())
+            if not driver:
+                driver = _driver()
+                self.pool.put(self._key(), driver)
+            return driver
+        driver = get_or_create()
+        other_driver = _in_thread(get_or_create)
+        self.assertIsNot(driver, other_driver)
+        self.assertIs(get_or_create(), driver)
+
+    def test_invalidate_from_another_thread(self):
+        other_key = self._key(mock.Mock(uuid="identity-2"))
+        other_driver = _driver()
+        self.pool.put(self._key(), _driver())
+        self.pool.put(other_key, other_driver)
+        _in_thread(lambda: self.pool.invalidate(self.identity))
+        self.assertIsNone(self.pool.get(self._key()))
+        self.assertEquals(self.pool.get(other_key), other_driver)
+        _in_thread(lambda: self.pool.invalidate())
+        self.assertIsNone(self.pool.get(other_key))
+        # Drivers created after the invalidation are re-used.
+        self.pool.put(other_key, other_driver)
+        self.assertEquals(self.pool.get(other_key), other_driver)
+
+
+@mock.patch('service.driver.get_esh_driver')
+class TestGetAdminDriver(TestCase):
+    def setUp(self):
+        self.admin_identity = mock.Mock(uuid="admin-identity")
+        self.provider = mock.Mock()
+        self.provider.accountprovider_set.all().first().identity = \
+            self.admin_identity
+        self.pool = DriverPool()
+        patcher = mock.patch.object(service_driver, 'driver_pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.key = DriverPool.key_for(self.admin_identity, "admin", {}, {})
+        self.pool.put(self.key, _driver())
+
+    def test_pooled(self, get_esh_driver):
+        self.assertEquals(get_admin_driver(self.provider),
+                          get_esh_driver.return_value)
+        get_esh_driver.assert_called_once_with(self.admin_identity)
+        self.assertEquals(len(self.pool), 1)
+
+    def test_force(self, get_esh_driver):
+        self.assertEquals(get_admin_driver(self.provider, force=True),
+                          get_esh_driver.return_value)
+        get_esh_driver.assert_called_once_with(self.admin_identity)
+        # The pooled driver is dropped before a new one is created.
+        self.assertIsNone(self.pool.get(self.key))
+
+    def test_no_admin_identity(self, get_esh_driver):
+        self.provider.accountprovider_set.all().first.return_value = None
+        self.assertIsNone(get_admin_driver(self.provider))
+        self.assertFalse(get_esh_driver.called)
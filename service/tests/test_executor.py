@@ -0,0 +1,46 @@
+"""
+tests for the account driver's CloudExecutor
+"""
+import mock
+
+from django.test import TestCase
+from requests.exceptions import ConnectionError
+
+from service.accounts.executor import CloudExecutor
+
+
+@mock.patch('service.accounts.executor.time.sleep')
+class TestCloudExecutor(TestCase):
+    def setUp(self):
+        self.executor = CloudExecutor(
+            max_workers=4, rate_limit=0, retries=2, backoff=0.1)
+
+    def test_transient_errors_are_retried(self, sleep):
+        func = mock.Mock(__name__='func', side_effect=[
+            ConnectionError(), ConnectionError(), 'ok'])
+        self.assertEquals(self.executor.call(func), 'ok')
+        self.assertEquals(func.call_count, 3)
+        self.assertEquals(sleep.call_count, 2)
+
+    def test_other_errors_are_raised(self, sleep):
+        func = mock.Mock(__name__='func', side_effect=ValueError())
+        with self.assertRaises(ValueError):
+            self.executor.call(func)
+        self.assertEquals(func.call_count, 1)
+
+    def test_map_keeps_the_order(self, sleep):
+        items = range(20)
+        self.assertEquals(
+            self.executor.map(lambda item: item * 2, items),
+            [item * 2 for item in items])
+
+    def test_map_return_exceptions(self, sleep):
+        def func(item):
+            if item % 2:
+                raise ValueError(item)
+            return item
+        results = self.executor.map(func, range(4), return_exceptions=True)
+        self.assertEquals(results[0], 0)
+        self.assertIsInstance(results[1], ValueError)
+        with self.assertRaises(ValueError):
+            self.executor.map(func, range(4))
@@ -0,0 +1,165 @@
+"""
+tests for the (bulk) sync of image membership with ApplicationMembership
+"""
+from uuid import uuid4
+
+import mock
+
+from django.test import TestCase
+
+from core.factories import IdentityFactory
+from core.factories.provider import ProviderFactory
+from core.models import (
+    Application, ApplicationMembership, ApplicationVersion, Credential,
+    Group, Identity, IdentityMembership, InstanceSource, ProviderMachine,
+    Quota)
+from service.image_membership import ImageMembershipSync
+
+
+def _image(image_id, is_public=False):
+    image = mock.Mock(id=image_id, is_public=is_public)
+    image.name = image_id
+    return image
+
+
+class TestImageMembershipSync(TestCase):
+
+    def setUp(self):
+        self.identity = IdentityFactory.create()
+        self.provider = self.identity.provider
+        self.other_provider = ProviderFactory.create(uuid=uuid4())
+        self.user = self.identity.created_by
+        self.quota = Quota.objects.create()
+
+        # Tenant 'carol' only has an identity on the other provider.
+        self.groups = {}
+        for tenant_name, provider in [("alice", self.provider),
+                                      ("bob", self.provider),
+                                      ("carol", self.other_provider)]:
+            self.groups[tenant_name] = self._tenant(tenant_name, provider)
+        self.groups["stale"] = Group.objects.create(name="stale")
+        self.groups["editor"] = Group.objects.create(name="editor")
+
+        self.application = Application.objects.create(
+            name="ubuntu", private=True, created_by=self.user,
+            created_by_identity=self.identity)
+        self.version = ApplicationVersion.objects.create(
+            application=self.application, name="1.0", created_by=self.user,
+            created_by_identity=self.identity)
+        self.images = [_image("image-1"), _image("image-2")]
+        for image in self.images:
+            self._machine(self.provider, image.id)
+        for group_name, can_edit in [("alice", False), ("stale", False),
+                                     ("editor", True)]:
+            ApplicationMembership.objects.create(
+                application=self.application,
+                group=self.groups[group_name], can_edit=can_edit)
+
+        self.account_driver = mock.Mock()
+        self.account_driver.list_all_images.return_value = self.images
+        self.account_driver.share_images.side_effect = \
+            lambda share_args: [None for _ in share_args]
+        self.members = {"image-1": set(["tenant-alice"]),
+                        "image-2": set(["tenant-bob"])}
+        self.account_driver.shared_images_for_many.side_effect = \
+            lambda image_ids: dict((image_id, self.members[image_id])
+                                   for image_id in image_ids)
+        patcher = mock.patch(
+            'service.image_membership.get_cached_project_directory')
+        project_directory = patcher.start()
+        self.addCleanup(patcher.stop)
+        project_directory.return_value.project_names = {
+            "tenant-alice": "alice",
+            "tenant-bob": "bob",
+            "tenant-carol": "carol",
+        }
+
+    def _tenant(self, tenant_name, provider):
+        identity = Identity.objects.create(
+            created_by=self.user, provider=provider)
+        Credential.objects.create(
+            key='ex_tenant_name', value=tenant_name, identity=identity)
+        group = Group.objects.create(name=tenant_name)
+        IdentityMembership.objects.create(
+            identity=identity, member=group, quota=self.quota)
+        return group
+
+    def _machine(self, provider, identifier):
+        source = InstanceSource.objects.create(
+            provider=provider, identifier=identifier,
+            created_by=self.user, created_by_identity=self.identity)
+        return ProviderMachine.objects.create(
+            instance_source=source, application_version=self.version)
+
+    def _run(self, dry_run=False):
+        return ImageMembershipSync(
+            self.provider, self.account_driver, dry_run=dry_run).run()
+
+    def _member_names(self):
+        return sorted(ApplicationMembership.objects.filter(
+            application=self.application).values_list(
+            'group__name', flat=True))
+
+    def _shares(self):
+        return sorted(
+            (image.id, tenant_name)
+            for (share_args,), _ in
+            self.account_driver.share_images.call_args_list
+            for image, tenant_name in share_args)
+
+    def test_membership_diff(self):
+        summary = self._run()
+        # 'bob' is added, 'stale' is removed, 'editor' can edit.
+        self.assertEquals(summary["created"], 1)
+        self.assertEquals(summary["deleted"], 1)
+        self.assertEquals(self._member_names(), ["alice", "bob", "editor"])
+        # Every image is shared with the tenants of the other images.
+        self.assertEquals(summary["shared"], 2)
+        self.assertEquals(self._shares(), [("image-1", "bob"),
+                                           ("image-2", "alice")])
+        # Once in sync, nothing changes.
+        self.account_driver.share_images.reset_mock()
+        self.members = {"image-1": set(["tenant-alice", "tenant-bob"]),
+                        "image-2": set(["tenant-alice", "tenant-bob"])}
+        summary = self._run()
+        self.assertEquals((summary["created"], summary["deleted"],
+                           summary["shared"]), (0, 0, 0))
+        self.assertEquals(self._member_names(), ["alice", "bob", "editor"])
+
+    def test_incomplete_listing_does_not_delete(self):
+        # The members of 'image-2' could not be listed
+        self.members["image-2"] = None
+        summary = self._run()
+        self.assertEquals(summary["deleted"], 0)
+        self.assertEquals(self._member_names(), ["alice", "editor", "stale"])
+        # Images that could not be listed are not shared.
+        self.assertEquals(self._shares(), [])
+
+    def test_shared_applications_do_not_delete(self):
+        # Memberships may come from the images on the other provider.
+        self._machine(self.other_provider, "other-image")
+        summary = self._run()
+        self.assertEquals(summary["created"], 1)
+        self.assertEquals(summary["deleted"], 0)
+        self.assertEquals(self._member_names(),
+                          ["alice", "bob", "editor", "stale"])
+
+    def test_identities_of_other_providers_are_skipped(self):
+        self.members["image-1"].add("tenant-carol")
+        self._run()
+        self.assertNotIn("carol", self._member_names())
+        self.assertNotIn("carol", [tenant_name for _, tenant_name
+                                   in self._shares()])
+
+    def test_dry_run(self):
+        Application.objects.filter(id=self.application.id).update(
+            private=False)
+        summary = self._run(dry_run=True)
+        self.assertEquals(
+            (summary["created"], summary["deleted"], summary["shared"],
+             summary["made_private"]), (1, 1, 2, 1))
+        self.assertEquals(self._member_names(),
+                          ["alice", "editor", "stale"])
+        self.assertFalse(self.account_driver.share_images.called)
+        self.assertFalse(
+            Application.objects.get(id=self.application.id).private)
@@ -0,0 +1,206 @@
+"""
+tests for the instance readiness watcher
+"""
+import time
+
+import mock
+
+from django.test import TestCase
+
+from service.exceptions import InstanceTerminalState
+from service.instance_watcher import (
+    InstanceWatcher, instance_readiness, READY, WAITING, TERMINAL)
+
+
+def _instance(status, task=None, instance_id="vm-1"):
+    esh_instance = mock.Mock(id=instance_id)
+    esh_instance._node.extra = {'status': status, 'task': task}
+    return esh_instance
+
+
+def _waiter(instance_alias="vm-1", status_query="active", return_id=False,
+            deadline=None):
+    return {
+        'instance_alias': instance_alias,
+        'status_query': status_query,
+        'tasks_allowed': False,
+        'return_id': return_id,
+        'callbacks': ['callback'],
+        'errbacks': ['errback'],
+        'deadline': deadline or time.time() + 60,
+    }
+
+
+class TestInstanceReadiness(TestCase):
+    def test_ready(self):
+        self.assertEquals(
+            instance_readiness(_instance('ACTIVE'), "active"), READY)
+        self.assertEquals(
+            instance_readiness(
+                _instance('suspended'), ["active", "suspended"]), READY)
+
+    def test_task_in_progress(self):
+        self.assertEquals(
+            instance_readiness(_instance('active', 'networking'), "active"),
+            WAITING)
+        self.assertEquals(
+            instance_readiness(
+                _instance('active', 'networking'), "active",
+                tasks_allowed=True),
+            READY)
+
+    def test_building(self):
+        self.assertEquals(
+            instance_readiness(_instance('build', 'spawning'), "active"),
+            WAITING)
+
+    def test_terminal(self):
+        self.assertEquals(
+            instance_readiness(_instance('error'), "active"), TERMINAL)
+        self.assertEquals(
+            instance_readiness(_instance('error'), ["active", "error"]),
+            READY)
+
+
+@mock.patch('service.instance_watcher.record_ready_time')
+@mock.patch('service.instance_watcher.fail_deferred_task')
+@mock.patch('service.instance_watcher.complete_deferred_task')
+@mock.patch('service.instance_watcher.get_account_driver')
+@mock.patch('service.instance_watcher.redis_connection')
+class TestInstanceWatcherPoll(TestCase):
+    def setUp(self):
+        self.watcher = InstanceWatcher(mock.Mock(uuid="provider"))
+
+    def _poll(self, redis_connection, get_account_driver, waiters,
+              instances):
+        redis_connection.return_value.hdel.return_value = 1
+        get_account_driver.return_value.list_all_instances.return_value = \
+            instances
+        with mock.patch.object(
+                InstanceWatcher, 'waiters', return_value=waiters):
+            return self.watcher.poll()
+
+    def test_ready(self, redis_connection, get_account_driver,
+                   complete, fail, record_ready_time):
+        resolved = self._poll(
+            redis_connection, get_account_driver,
+            {'task-1': _waiter(),
+             'task-2': _waiter(instance_alias="vm-2", return_id=True)},
+            [_instance('active'), _instance('active', instance_id="vm-2")])
+        self.assertEquals(resolved, 2)
+        self.assertEquals(
+            sorted(complete.call_args_list),
+            [mock.call('task-1', ['callback'], True),
+             mock.call('task-2', ['callback'], "vm-2")])
+        self.assertFalse(fail.called)
+        self.assertEquals(record_ready_time.call_count, 2)
+
+    def test_waiting(self, redis_connection, get_account_driver,
+                     complete, fail, record_ready_time):
+        resolved = self._poll(
+            redis_connection, get_account_driver,
+            {'task-1': _waiter()}, [_instance('build', 'spawning')])
+        self.assertEquals(resolved, 0)
+        self.assertFalse(redis_connection.return_value.hdel.called)
+        self.assertFalse(complete.called)
+        self.assertFalse(fail.called)
+
+    def test_terminal(self, redis_connection, get_account_driver,
+                      complete, fail, record_ready_time):
+        resolved = self._poll(
+            redis_connection, get_account_driver,
+            {'task-1': _waiter()}, [_instance('error')])
+        self.assertEquals(resolved, 1)
+        self.assertFalse(complete.called)
+        task_id, errbacks, exc = fail.call_args[0]
+        self.assertEquals((task_id, errbacks), ('task-1', ['errback']))
+        self.assertTrue(isinstance(exc, InstanceTerminalState))
+
+    def test_missing_instance(self, redis_connection, get_account_driver,
+                              complete, fail, record_ready_time):
+        resolved = self._poll(
+            redis_connection, get_account_driver,
+            {'task-1': _waiter(),
+             'task-2': _waiter(return_id=True)}, [])
+        self.assertEquals(resolved, 2)
+        # Same results as 'wait_for_instance' for a terminated instance
+        self.assertEquals(
+            sorted(complete.call_args_list),
+            [mock.call('task-1', ['callback'], False),
+             mock.call('task-2', ['callback'], None)])
+        self.assertFalse(fail.called)
+
+    def test_timeout(self, redis_connection, get_account_driver,
+                     complete, fail, record_ready_time):
+        resolved = self._poll(
+            redis_connection, get_account_driver,
+            {'task-1': _waiter(deadline=time.time() - 1),
+             'task-2': _waiter()},
+            [_instance('build', 'spawning')])
+        self.assertEquals(resolved, 1)
+        self.assertEquals(fail.call_args[0][0], 'task-1')
+        self.assertFalse(complete.called)
+
+    def test_timeout_when_the_instances_can_not_be_listed(
+            self, redis_connection, get_account_driver,
+            complete, fail, record_ready_time):
+        get_account_driver.return_value.list_all_instances.side_effect = \
+            Exception("Service unavailable")
+        redis_connection.return_value.hdel.return_value = 1
+        with mock.patch.object(InstanceWatcher, 'waiters', return_value={
+                'task-1': _waiter(deadline=time.time() - 1),
+                'task-2': _waiter()}):
+            self.assertEquals(self.watcher.poll(), 1)
+        self.assertEquals(fail.call_args[0][0], 'task-1')
+
+    def test_watchers_race_for_a_claim(
+            self, redis_connection, get_account_driver,
+            complete, fail, record_ready_time):
+        # Only the first HDEL removes the waiter
+        redis_connection.return_value.hdel.side_effect = [1, 0]
+        other_watcher = InstanceWatcher(mock.Mock(uuid="provider"))
+        esh_instance = _instance('active')
+        self.assertEquals(
+            self.watcher._check('task-1', _waiter(), esh_instance), 1)
+        self.assertEquals(
+            other_watcher._check('task-1', _waiter(), esh_instance), 0)
+        complete.assert_called_once_with('task-1', ['callback'], True)
+        redis_connection.return_value.hdel.assert_called_with(
+            "instance_waiters.provider", 'task-1')
+
+
+@mock.patch('service.tasks.driver.watch_instances_for')
+@mock.patch('service.instance_watcher.redis_connection')
+@mock.patch.object(InstanceWatcher, 'poll')
+class TestInstanceWatcherRun(TestCase):
+    def setUp(self):
+        self.watcher = InstanceWatcher(mock.Mock(uuid="provider"))
+
+    def test_owner_reschedules(self, poll, redis_connection, watch):
+        conn = redis_connection.return_value
+        conn.set.return_value = None
+        conn.get.return_value = "token"
+        conn.hlen.return_value = 1
+        conn.eval.return_value = True
+        self.watcher.run("token")
+        self.assertTrue(poll.called)
+        watch.apply_async.assert_called_once_with(
+            args=["provider", "token"], countdown=mock.ANY)
+
+    def test_other_owner(self, poll, redis_connection, watch):
+        conn = redis_connection.return_value
+        conn.set.return_value = None
+        conn.get.return_value = "other-token"
+        self.watcher.run("token")
+        self.assertFalse(poll.called)
+        self.assertFalse(watch.apply_async.called)
+
+    def test_lock_lost_while_polling(self, poll, redis_connection, watch):
+        conn = redis_connection.return_value
+        conn.set.return_value = True
+        conn.hlen.return_value = 1
+        # The lock expired, then was taken by another chain.
+        conn.eval.return_value = None
+        self.watcher.run("token")
+        self.assertTrue(poll.called)
+        self.assertFalse(watch.apply_async.called)
@@ -0,0 +1,138 @@
+"""
+tests for the (sharded) instance monitoring tasks
+"""
+import mock
+
+from celery import current_app as app
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from core.factories.provider import ProviderFactory, ProviderTypeFactory
+from service.tasks.monitoring import (
+    _convert_running_instances, _new_monitoring_summary,
+    _shard_instance_map, monitor_instances_for, monitor_instances_summary)
+
+
+def _summary(users, running_instances, over_allocation=None, errors=None):
+    return {'users': users, 'running_instances': running_instances,
+            'over_allocation': over_allocation or [],
+            'errors': errors or []}
+
+
+class TestMonitorInstancesSummary(TestCase):
+    def test_shard_instance_map(self):
+        instance_map = dict(("user%s" % idx, [idx]) for idx in range(5))
+        shards = _shard_instance_map(instance_map, 2)
+        self.assertEquals([sorted(shard.keys()) for shard in shards],
+                          [["user0", "user1"], ["user2", "user3"],
+                           ["user4"]])
+        self.assertEquals(_shard_instance_map({}, 2), [])
+
+    def test_summary(self):
+        summary = monitor_instances_summary(
+            [_summary(2, 3, over_allocation=["alice"]),
+             _summary(1, 0, errors=["bob"]),
+             _summary(2, 4, over_allocation=["carol"], errors=["dave"])],
+            1)
+        self.assertEquals(summary, _summary(
+            5, 7, over_allocation=["alice", "carol"],
+            errors=["bob", "dave"]))
+
+
+@override_settings(MONITOR_INSTANCES_CHUNK_SIZE=2,
+                   MONITOR_INSTANCES_PROCESSES=1)
+@mock.patch('service.tasks.monitoring._cleanup_missing_instances')
+@mock.patch('service.tasks.monitoring.convert_esh_instances',
+            return_value=[])
+@mock.patch('service.tasks.monitoring.get_cached_size_catalog')
+@mock.patch('service.tasks.monitoring._get_identity_from_tenant_name',
+            return_value=None)
+@mock.patch('service.tasks.monitoring._get_instance_owner_map')
+class TestMonitorInstancesFor(TestCase):
+    def setUp(self):
+        self.provider = ProviderFactory.create(
+            type=ProviderTypeFactory.create(name="OpenStack"))
+        self.instance_map = dict(
+            ("user%s" % idx, [mock.Mock(id="instance-%s" % idx)])
+            for idx in range(5))
+        always_eager = app.conf.CELERY_ALWAYS_EAGER
+        app.conf.CELERY_ALWAYS_EAGER = True
+        self.addCleanup(setattr, app.conf, 'CELERY_ALWAYS_EAGER',
+                        always_eager)
+
+    def test_chord(self, owner_map, identity, size_catalog, convert,
+                   cleanup):
+        owner_map.return_value = self.instance_map
+        summaries = []
+        summary_run = monitor_instances_summary.run
+
+        # (Celery only runs a function as a task, not a Mock)
+        def run(shard_summaries, provider_id):
+            summaries.append((shard_summaries, provider_id))
+            return summary_run(shard_summaries, provider_id)
+        with mock.patch.object(monitor_instances_summary, 'run', run):
+            shards = monitor_instances_for.apply(
+                args=[self.provider.id]).get()
+        self.assertEquals(shards, 3)
+        # Every user is monitored (once), by one of the shards
+        self.assertEquals(cleanup.call_count, 5)
+        self.assertEquals(summaries, [
+            ([_summary(2, 2), _summary(2, 2), _summary(1, 1)],
+             self.provider.id)])
+
+    def test_no_shards(self, owner_map, identity, size_catalog, convert,
+                       cleanup):
+        owner_map.return_value = {}
+        self.assertEquals(monitor_instances_for.apply(
+            args=[self.provider.id]).get(), 0)
+        self.assertFalse(cleanup.called)
+
+    def test_called_directly(self, owner_map, identity, size_catalog,
+                             convert, cleanup):
+        owner_map.return_value = self.instance_map
+        self.assertEquals(monitor_instances_for(self.provider.id),
+                          _summary(5, 5))
+
+
+@mock.patch('service.tasks.monitoring.get_cached_size_catalog')
+@mock.patch('service.tasks.monitoring.convert_esh_instance')
+@mock.patch('service.tasks.monitoring.convert_esh_instances')
+class TestConvertRunningInstances(TestCase):
+    def setUp(self):
+        self.provider = mock.Mock(uuid="provider-uuid")
+        self.convert_list = []
+        for username in ("alice", "bob", "carol"):
+            user = mock.Mock(username=username)
+            self.convert_list.append(
+                (mock.Mock(), mock.Mock(id="%s-vm" % username),
+                 "%s-identity" % username, user))
+
+    def test_bulk(self, convert_bulk, convert, size_catalog):
+        convert_bulk.return_value = ["alice-core", "bob-core", "carol-core"]
+        summary = _new_monitoring_summary()
+        core_running_map = _convert_running_instances(
+            self.provider, self.convert_list, summary)
+        self.assertEquals(core_running_map, {
+            "alice-vm": "alice-core", "bob-vm": "bob-core",
+            "carol-vm": "carol-core"})
+        convert_bulk.assert_called_once_with(
+            self.convert_list, "provider-uuid", size_catalog.return_value)
+        self.assertFalse(convert.called)
+
+    def test_per_user_fallback(self, convert_bulk, convert, size_catalog):
+        convert_bulk.side_effect = Exception("Bad instance")
+
+        def convert_instance(driver, inst, provider_uuid, identity_uuid,
+                             user, size_catalog=None):
+            if user.username == "bob":
+                raise Exception("Bad instance")
+            return "%s-core" % user.username
+        convert.side_effect = convert_instance
+        summary = _new_monitoring_summary()
+        # Users with errors (in this shard) are not converted again.
+        summary['errors'].append("carol")
+        core_running_map = _convert_running_instances(
+            self.provider, self.convert_list, summary)
+        self.assertEquals(core_running_map, {"alice-vm": "alice-core"})
+        self.assertEquals(summary['errors'], ["carol", "bob"])
+        self.assertEquals(convert.call_count, 2)
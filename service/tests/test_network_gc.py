@@ -0,0 +1,77 @@
+"""
+tests for the provider-wide network garbage collector
+"""
+import mock
+
+from django.test import TestCase
+
+from service.network_gc import NetworkGC
+
+
+def _instance(instance_id, tenant_id, status, ip="10.0.0.1"):
+    instance = mock.Mock(id=instance_id, ip=ip)
+    instance.extra = {'tenantId': tenant_id, 'status': status}
+    return instance
+
+
+@mock.patch('service.network_gc._update_instance_metadata')
+@mock.patch.object(NetworkGC, '_tenants', return_value={
+    'tenant-1': 'alice', 'tenant-2': 'bob', 'tenant-3': 'carol'})
+class TestNetworkGC(TestCase):
+    def setUp(self):
+        self.account_driver = mock.Mock()
+        self.account_driver.list_all_instances.return_value = [
+            _instance('active', 'tenant-1', 'active'),
+            _instance('suspended', 'tenant-2', 'suspended'),
+            _instance('error', 'tenant-3', 'error', ip=None),
+        ]
+        driver = self.account_driver.admin_driver
+        driver._is_active_instance.side_effect = \
+            lambda inst: inst.extra['status'] == 'active'
+        driver._is_inactive_instance.side_effect = \
+            lambda inst: inst.extra['status'] == 'suspended'
+        neutron = self.account_driver.network_manager.neutron
+        self.account_driver.network_manager.default_router = 'router'
+        neutron.list_ports.return_value = {'ports': [
+            {'id': 'port-2', 'device_id': 'suspended',
+             'fixed_ips': [{'ip_address': '10.0.0.2'}]}]}
+        neutron.list_floatingips.return_value = {'floatingips': [
+            {'id': 'fip-1', 'port_id': None, 'tenant_id': 'tenant-1',
+             'floating_ip_address': '1.2.3.4'},
+            {'id': 'fip-2', 'port_id': 'port-2', 'tenant_id': 'tenant-2',
+             'floating_ip_address': '1.2.3.5'},
+            {'id': 'fip-other', 'port_id': None, 'tenant_id': 'other',
+             'floating_ip_address': '1.2.3.6'}]}
+        neutron.list_subnets.return_value = {'subnets': [
+            {'id': 'subnet-3', 'name': 'carol-subnet'}]}
+        neutron.list_networks.return_value = {'networks': [
+            {'id': 'net-2', 'name': 'bob-net'},
+            {'id': 'net-3', 'name': 'carol-net'}]}
+        neutron.list_routers.return_value = {'routers': [
+            {'id': 'router-1', 'name': 'router'}]}
+        neutron.list_security_groups.return_value = {'security_groups': [
+            {'id': 'sg-3', 'tenant_id': 'tenant-3'}]}
+        self.neutron = neutron
+
+    def test_run(self, tenants, update_metadata):
+        gc = NetworkGC(mock.Mock(), account_driver=self.account_driver)
+        summary = gc.run()
+        self.assertEquals(
+            summary, {'floating_ips': 1, 'instances': 1, 'networks': 1})
+        self.assertEquals(
+            self.neutron.delete_floatingip.call_args_list,
+            [mock.call('fip-1'), mock.call('fip-2')])
+        self.account_driver.admin_driver._connection.ex_remove_fixed_ip\
+            .assert_called_once_with(mock.ANY, '10.0.0.2')
+        # Only the tenant with neither active nor inactive instances
+        self.neutron.delete_security_group.assert_called_once_with('sg-3')
+        self.neutron.remove_interface_router.assert_called_once_with(
+            'router-1', {"subnet_id": 'subnet-3'})
+        self.neutron.delete_network.assert_called_once_with('net-3')
+
+    def test_dry_run(self, tenants, update_metadata):
+        gc = NetworkGC(mock.Mock(), account_driver=self.account_driver,
+                       dry_run=True)
+        gc.run()
+        self.assertFalse(self.neutron.delete_floatingip.called)
+        self.assertFalse(self.neutron.delete_network.called)
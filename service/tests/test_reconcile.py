@@ -0,0 +1,153 @@
+"""
+tests for the reconciliation of cloud inventory with the database
+"""
+from datetime import timedelta
+
+import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from core.factories import IdentityFactory
+from core.models import (
+    Application, ApplicationVersion, InstanceSource, ProviderMachine, Size)
+from service.reconcile import (
+    diff_inventory, reconcile_machines, reconcile_sizes)
+
+
+class TestDiffInventory(TestCase):
+    def test_diff_inventory(self):
+        self.assertEquals(
+            diff_inventory(['a', 'b', 'c'], ['b', 'c', 'd']),
+            (set(['a']), set(['d']), set(['b', 'c'])))
+
+    def test_empty_inventory(self):
+        self.assertEquals(diff_inventory([], ['a']),
+                          (set(), set(['a']), set()))
+
+
+class ReconcileTestCase(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.identity = IdentityFactory.create()
+        self.provider = self.identity.provider
+        self.user = self.identity.created_by
+
+    def _application(self, name):
+        return Application.objects.create(
+            name=name, created_by=self.user,
+            created_by_identity=self.identity)
+
+    def _version(self, application, name="1.0"):
+        return ApplicationVersion.objects.create(
+            application=application, name=name, created_by=self.user,
+            created_by_identity=self.identity)
+
+    def _machine(self, version, identifier):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=identifier,
+            created_by=self.user, created_by_identity=self.identity)
+        return ProviderMachine.objects.create(
+            instance_source=source, application_version=version)
+
+    def _end_date(self, model, obj):
+        return model.objects.get(id=obj.id).end_date
+
+
+class TestReconcileMachines(ReconcileTestCase):
+    def setUp(self):
+        super(TestReconcileMachines, self).setUp()
+        # 'ubuntu' keeps a machine in its second version,
+        # 'centos' loses its only machine.
+        self.ubuntu = self._application("ubuntu")
+        self.ubuntu_1 = self._version(self.ubuntu, "1.0")
+        self.ubuntu_2 = self._version(self.ubuntu, "2.0")
+        self.centos = self._application("centos")
+        self.centos_1 = self._version(self.centos)
+        self.machines = [
+            self._machine(self.ubuntu_1, "ubuntu-1"),
+            self._machine(self.ubuntu_2, "ubuntu-2a"),
+            self._machine(self.ubuntu_2, "ubuntu-2b"),
+            self._machine(self.centos_1, "centos-1"),
+        ]
+
+    def _reconcile(self, cloud_ids, dry_run=False):
+        return reconcile_machines(
+            ProviderMachine.objects.filter(
+                instance_source__provider=self.provider),
+            [mock.Mock(id=cloud_id) for cloud_id in cloud_ids],
+            now=self.now, dry_run=dry_run)
+
+    def test_cascade(self):
+        result = self._reconcile(["ubuntu-2a", "new"])
+        self.assertEquals(
+            (result.added, result.removed, result.unchanged,
+             result.versions, result.applications),
+            (1, 3, 1, 2, 1))
+        for machine in self.machines:
+            end_date = self._end_date(
+                InstanceSource, machine.instance_source)
+            if machine.instance_source.identifier == "ubuntu-2a":
+                self.assertIsNone(end_date)
+            else:
+                self.assertEquals(end_date, self.now)
+        self.assertEquals(
+            self._end_date(ApplicationVersion, self.ubuntu_1), self.now)
+        self.assertIsNone(self._end_date(ApplicationVersion, self.ubuntu_2))
+        self.assertEquals(
+            self._end_date(ApplicationVersion, self.centos_1), self.now)
+        self.assertIsNone(self._end_date(Application, self.ubuntu))
+        self.assertEquals(self._end_date(Application, self.centos), self.now)
+
+    def test_future_end_date_is_cascaded(self):
+        # A version that has not ended yet is still current.
+        ApplicationVersion.objects.filter(id=self.centos_1.id).update(
+            end_date=self.now + timedelta(days=1))
+        result = self._reconcile(
+            ["ubuntu-1", "ubuntu-2a", "ubuntu-2b"])
+        self.assertEquals((result.removed, result.versions,
+                           result.applications), (1, 1, 1))
+
+    def test_dry_run(self):
+        result = self._reconcile([], dry_run=True)
+        self.assertEquals((result.removed, result.versions,
+                           result.applications), (4, 3, 2))
+        self.assertFalse(InstanceSource.objects.filter(
+            end_date__isnull=False).exists())
+        self.assertIsNone(self._end_date(Application, self.centos))
+
+    def test_nothing_removed(self):
+        result = self._reconcile(
+            ["ubuntu-1", "ubuntu-2a", "ubuntu-2b", "centos-1"])
+        self.assertEquals(
+            (result.added, result.removed, result.unchanged), (0, 0, 4))
+
+
+class TestReconcileSizes(ReconcileTestCase):
+    def _size(self, alias, end_date=None):
+        return Size.objects.create(
+            alias=alias, name=alias, provider=self.provider,
+            cpu=1, disk=0, root=0, mem=512, end_date=end_date)
+
+    def _esh_size(self, alias, cpu=1):
+        esh_size = mock.Mock(id=alias, disk=0, ephemeral=0, cpu=cpu,
+                             ram=512)
+        esh_size.name = alias
+        return esh_size
+
+    def test_reconcile_sizes(self):
+        tiny = self._size("tiny")
+        removed = self._size("removed")
+        ended = self._size("ended", end_date=self.now - timedelta(days=1))
+        result = reconcile_sizes(
+            self.provider, [self._esh_size("tiny", cpu=2),
+                            self._esh_size("large")], now=self.now)
+        self.assertEquals(
+            (result.added, result.removed, result.unchanged), (1, 1, 1))
+        self.assertEquals(Size.objects.get(id=tiny.id).cpu, 2)
+        self.assertIsNone(self._end_date(Size, tiny))
+        self.assertEquals(self._end_date(Size, removed), self.now)
+        self.assertEquals(
+            self._end_date(Size, ended), self.now - timedelta(days=1))
+        self.assertTrue(Size.objects.filter(
+            alias="large", provider=self.provider).exists())
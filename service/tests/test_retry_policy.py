@@ -0,0 +1,52 @@
+"""
+tests for the retry policies of the polling tasks
+"""
+from datetime import timedelta
+
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from service.retry_policy import RetryPolicy, next_retry_delay
+
+
+class TestRetryPolicy(TestCase):
+    def test_backoff(self):
+        policy = RetryPolicy(5, factor=2, max_delay=60, jitter=0)
+        self.assertEquals(
+            [policy.backoff(retries) for retries in range(6)],
+            [5, 10, 20, 40, 60, 60])
+
+    def test_jitter(self):
+        policy = RetryPolicy(10, jitter=0.2)
+        for _ in range(20):
+            self.assertTrue(8 <= policy.backoff(0) <= 12)
+
+
+@override_settings(TASK_RETRY_POLICIES={
+    "wait_for_instance": {"delay": 5, "max_delay": 15, "max_wait": 300,
+                          "jitter": 0}},
+    TASK_RETRIES_IN_FLIGHT=None)
+@mock.patch('service.retry_policy._instance_info')
+@mock.patch('service.retry_policy.expected_ready_time')
+class TestNextRetryDelay(TestCase):
+    def test_without_instance(self, expected_ready_time, instance_info):
+        instance_info.return_value = None
+        self.assertEquals(next_retry_delay("wait_for_instance", 1), 10)
+
+    def test_waits_for_the_expected_ready_time(
+            self, expected_ready_time, instance_info):
+        instance_info.return_value = (
+            timezone.now() - timedelta(seconds=60), "image", "provider")
+        expected_ready_time.return_value = 180
+        delay = next_retry_delay("wait_for_instance", 0, "instance")
+        self.assertTrue(119 <= delay <= 121)
+
+    def test_slower_than_expected(self, expected_ready_time, instance_info):
+        instance_info.return_value = (
+            timezone.now() - timedelta(seconds=600), "image", "provider")
+        expected_ready_time.return_value = 180
+        self.assertEquals(
+            next_retry_delay("wait_for_instance", 0, "instance"), 5)